@@ -1,6 +1,8 @@
 # agent.py
 
 import logging
+from typing import AsyncIterator
+
 from base_agent import BaseAgent
 from semantic_kernel.agents import ChatCompletionAgent, ChatHistoryAgentThread
 from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
@@ -11,32 +13,51 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 
+def create_mcp_plugin(url: str) -> MCPSsePlugin:
+    return MCPSsePlugin(
+        name="EmailMCP",
+        description="Cosmos Email Search Plugin",
+        url=url,
+        headers={"Content-Type": "application/json"},
+        timeout=30,
+    )
+
+
 class SearchAgent(BaseAgent):
-    def __init__(self, state_store, session_id) -> None:
+    def __init__(
+        self,
+        state_store,
+        session_id,
+        service: AzureChatCompletion | None = None,
+        plugin: MCPSsePlugin | None = None,
+    ) -> None:
         super().__init__(state_store, session_id)
         self._agent = None
         self._initialized = False
+        # A shared chat service / MCP connection (e.g. owned by AgentRuntime) is reused as-is;
+        # otherwise the agent creates and owns its own.
+        self._service = service
+        self._plugin = plugin
+        self._owns_plugin = plugin is None
 
     async def _setup_agent(self) -> None:
         if self._initialized:
             return
 
-        cosmos_plugin = MCPSsePlugin(
-            name="EmailMCP",
-            description="Cosmos Email Search Plugin",
-            url="http://localhost:8000/sse",
-            headers={"Content-Type": "application/json"},
-            timeout=30,
-        )
-        await cosmos_plugin.connect()
+        if self._plugin is None:
+            self._plugin = create_mcp_plugin(self.mcp_server_uri)
+            await self._plugin.connect()
 
-        self._agent = ChatCompletionAgent(
-            service=AzureChatCompletion(
+        if self._service is None:
+            self._service = AzureChatCompletion(
                 api_key=self.azure_openai_key,
                 endpoint=self.azure_openai_endpoint,
                 api_version=self.api_version,
                 deployment_name=self.azure_deployment,
-            ),
+            )
+
+        self._agent = ChatCompletionAgent(
+            service=self._service,
             name="EmailSearchBot",
             instructions="You are a helpful assistant. You can search emails stored in Cosmos DB as per user queries"
             "you take user input which is natural language and create embedding to find best match from cosmos db."
@@ -44,8 +65,8 @@ class SearchAgent(BaseAgent):
             "Make sure to use the information provided to best possible identical match, for example in if asked to show emails from A to B, just with first names provided"
             "Your output should focus first on identical name from sender to receiver, any other matches should be listed as 'less possible results'"
             "if from and to in emails are not identical, focus on first name matches (like alice.johnson@company.com has first name as 'alice'), and then last name matches, and then any other matches"
-            "show only top 2 matches"
-            plugins=[cosmos_plugin],
+            "show only top 2 matches",
+            plugins=[self._plugin],
         )
 
         self._thread: ChatHistoryAgentThread | None = None
@@ -74,3 +95,30 @@ class SearchAgent(BaseAgent):
         self.append_to_chat_history(messages)
 
         return response_content
+
+    async def chat_stream_async(self, prompt: str) -> AsyncIterator[str]:
+        """Streaming variant of chat_async: yields response text chunks as the model produces them."""
+        await self._setup_agent()
+        chunks: list[str] = []
+        async for response in self._agent.invoke_stream(messages=prompt, thread=self._thread):
+            chunk = str(response.content)
+            if chunk:
+                chunks.append(chunk)
+                yield chunk
+            self._thread = response.thread
+
+        if self._thread:
+            self._setstate({"thread": self._thread})
+
+        messages = [
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": "".join(chunks)},
+        ]
+        self.append_to_chat_history(messages)
+
+    async def close(self) -> None:
+        """Release the MCP connection if this agent opened it."""
+        if self._owns_plugin and self._plugin is not None:
+            await self._plugin.close()
+            self._plugin = None
+        self._initialized = False
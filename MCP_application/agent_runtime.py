@@ -0,0 +1,148 @@
+# agent_runtime.py
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Iterator
+
+from agent import SearchAgent, create_mcp_plugin
+from base_agent import MemoryStateStore
+from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
+from semantic_kernel.connectors.mcp import MCPSsePlugin
+
+
+logger = logging.getLogger(__name__)
+
+
+class AgentRuntime:
+    """
+    Long-lived background event loop that owns the search agents, the MCP SSE connection and the
+    Azure chat service across Streamlit reruns.
+
+    Streamlit executes the script on a fresh thread for every rerun, so async resources created with
+    a throwaway loop cannot be reused. Everything here lives on one loop running in a daemon thread;
+    callers hand coroutines over with run_coroutine_threadsafe and block on the result.
+    """
+
+    def __init__(self, keepalive_interval: float = 30.0, session_idle_timeout: float = 1800.0) -> None:
+        self.keepalive_interval = keepalive_interval
+        self.session_idle_timeout = session_idle_timeout
+        self.mcp_server_uri = os.getenv("MCP_SERVER_URI", "http://localhost:8000/sse")
+
+        self._state_store = MemoryStateStore()
+        self._agents: dict[str, SearchAgent] = {}
+        self._last_used: dict[str, float] = {}
+        self._service: AzureChatCompletion | None = None
+        self._plugin: MCPSsePlugin | None = None
+        self._plugin_lock: asyncio.Lock | None = None
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="agent-runtime", daemon=True)
+        self._thread.start()
+        self._submit(self._start()).result()
+
+    # ------------- sync API used by the Streamlit script ------------------
+    def chat(self, session_id: str, prompt: str) -> str:
+        return self._submit(self._chat(session_id, prompt)).result()
+
+    def chat_stream(self, session_id: str, prompt: str) -> Iterator[str]:
+        """Yield response chunks; each chunk is pulled from the runtime loop as soon as it is produced."""
+        stream = self._submit(self._open_stream(session_id, prompt)).result()
+        while True:
+            try:
+                yield self._submit(stream.__anext__()).result()
+            except StopAsyncIteration:
+                break
+
+    def reset_session(self, session_id: str) -> None:
+        self._submit(self._drop_session(session_id)).result()
+
+    def shutdown(self) -> None:
+        self._submit(self._close_all()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # ------------- coroutines executed on the runtime loop ------------------
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def _start(self) -> None:
+        self._plugin_lock = asyncio.Lock()
+        self._service = AzureChatCompletion(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+            deployment_name=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT"),
+        )
+        self._keepalive_task = asyncio.create_task(self._keepalive())
+
+    async def _get_agent(self, session_id: str) -> SearchAgent:
+        await self._ensure_connected()
+        agent = self._agents.get(session_id)
+        if agent is None:
+            agent = SearchAgent(self._state_store, session_id, service=self._service, plugin=self._plugin)
+            self._agents[session_id] = agent
+            logger.info(f"Created agent for session {session_id}")
+        self._last_used[session_id] = time.monotonic()
+        return agent
+
+    async def _chat(self, session_id: str, prompt: str) -> str:
+        agent = await self._get_agent(session_id)
+        return await agent.chat_async(prompt)
+
+    async def _open_stream(self, session_id: str, prompt: str):
+        agent = await self._get_agent(session_id)
+        return agent.chat_stream_async(prompt)
+
+    async def _drop_session(self, session_id: str) -> None:
+        agent = self._agents.pop(session_id, None)
+        self._last_used.pop(session_id, None)
+        # The session's thread (its whole history) lives in the shared store, not in the agent
+        self._state_store.delete(session_id)
+        if agent is not None:
+            await agent.close()
+
+    async def _evict_idle(self) -> None:
+        now = time.monotonic()
+        for session_id, last_used in list(self._last_used.items()):
+            if now - last_used > self.session_idle_timeout:
+                logger.info(f"Evicting idle session {session_id}")
+                await self._drop_session(session_id)
+
+    async def _ensure_connected(self) -> None:
+        """Open the shared MCP connection, or reconnect it in place if a ping fails."""
+        async with self._plugin_lock:
+            if self._plugin is None:
+                self._plugin = create_mcp_plugin(self.mcp_server_uri)
+                await self._plugin.connect()
+                logger.info("Connected to MCP server")
+                return
+            try:
+                await self._plugin.session.send_ping()
+            except Exception as e:
+                logger.warning(f"MCP connection lost ({e}); reconnecting")
+                try:
+                    await self._plugin.close()
+                except Exception:
+                    pass
+                # Agents keep a reference to the same plugin object, so reconnecting in place is enough.
+                await self._plugin.connect()
+
+    async def _keepalive(self) -> None:
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            await self._evict_idle()
+            if self._agents:
+                try:
+                    await self._ensure_connected()
+                except Exception as e:
+                    logger.warning(f"MCP keep-alive failed: {e}")
+
+    async def _close_all(self) -> None:
+        self._keepalive_task.cancel()
+        for session_id in list(self._agents):
+            await self._drop_session(session_id)
+        if self._plugin is not None:
+            await self._plugin.close()
+            self._plugin = None
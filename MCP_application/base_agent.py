@@ -45,3 +45,6 @@ class MemoryStateStore:
     def update(self, session_id, state):
         # Just use set for update
         self.set(session_id, state)
+
+    def delete(self, session_id):
+        self._store.pop(session_id, None)
@@ -1,10 +1,9 @@
 # streamlit_ui.py
 
 import os
+import uuid
 import streamlit as st
-import asyncio
-from agent import SearchAgent  # Make sure agent.py is in same folder
-from base_agent import MemoryStateStore  # Assumes base_agent.py exists and defines this
+from agent_runtime import AgentRuntime  # Make sure agent_runtime.py is in same folder
 
 # ────────────────────────────── App Setup ──────────────────────────────
 st.set_page_config(page_title="Intelligent Email Search", layout="wide")
@@ -23,10 +22,17 @@ st.markdown(
 # ────────────────────────────── Session Setup ──────────────────────────────
 if "conversation" not in st.session_state:
     st.session_state.conversation = []
-if "search_agent" not in st.session_state:
-    state_store = MemoryStateStore()
-    session_id = "streamlit-session"  # could be user ID, etc.
-    st.session_state.search_agent = SearchAgent(state_store, session_id)
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())  # could be user ID, etc.
+
+
+@st.cache_resource
+def get_agent_runtime() -> AgentRuntime:
+    """One background runtime per server process; it owns the agents and connections across reruns."""
+    return AgentRuntime()
+
+
+runtime = get_agent_runtime()
 
 # ────────────────────────────── Input Form ──────────────────────────────
 with st.form("query_form", clear_on_submit=True):
@@ -37,22 +43,12 @@ with st.form("query_form", clear_on_submit=True):
 # ────────────────────────────── Logic ──────────────────────────────
 if clear_history:
     st.session_state.conversation = []
+    runtime.reset_session(st.session_state.session_id)
     st.success("Conversation cleared.")
 
-if submitted and query:
-    st.session_state.conversation.append({"role": "user", "content": query})
-
-    with st.spinner("Thinking..."):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        agent_response = loop.run_until_complete(
-            st.session_state.search_agent.chat_async(query)
-        )
-
-    st.session_state.conversation.append({"role": "assistant", "content": agent_response})
-
 # ────────────────────────────── Display Chat ──────────────────────────────
-if st.session_state.conversation:
+new_turn = submitted and query
+if st.session_state.conversation or new_turn:
     st.subheader("🔎 Conversation")
     for msg in st.session_state.conversation:
         if msg["role"] == "user":
@@ -60,3 +56,13 @@ if st.session_state.conversation:
         else:
             st.markdown(f"**🤖 Agent:** {msg['content']}")
         st.markdown("---")
+
+# The new turn is rendered below the existing conversation while tokens are still arriving.
+if new_turn:
+    st.session_state.conversation.append({"role": "user", "content": query})
+    st.markdown(f"**🧑 User:** {query}")
+    st.markdown("**🤖 Agent:**")
+    agent_response = st.write_stream(runtime.chat_stream(st.session_state.session_id, query))
+    st.markdown("---")
+
+    st.session_state.conversation.append({"role": "assistant", "content": agent_response})
@@ -5,6 +5,7 @@ from semantic_kernel.functions.kernel_plugin import KernelPlugin
 from fastmcp import FastMCP 
 from pydantic import BaseModel, Field
 from typing import Dict, List, Optional
+from functools import lru_cache
 from dotenv import load_dotenv
 from datetime import datetime
 import os
@@ -13,6 +14,19 @@ import json
 import math
 from azure.cosmos import CosmosClient
 from azure.identity import ClientSecretCredential
+import sys
+from pathlib import Path
+# Repo root on the path for the shared metadata index (utils/metadata_index.py)
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.embedding_dimensions import embedding_payload, fit_dimensions
+from utils.active_store import active_name
+from utils.cosmos_partitioning import layout_of
+from utils.metadata_index import MetadataIndex, UnsupportedFilter
+from utils.pagination import Cursor, InvalidCursor, next_page_token
+from utils.email_threads import collapse_threads
+from utils.query_planner import FILTER_SCAN, HYBRID
+from utils.result_fields import COSMOS_RESULT_PROJECTION, read_projected
+from utils.vector_layout import vector_field_of
 
 
 
@@ -35,7 +49,8 @@ system_prompt = (
     "Convert the conversation of natural language email search queries into a complete query JSON object. "
     "The JSON object must contain exactly the following keys: 'search_text' and 'filter'.\n\n"
     "Additional guidelines:\n"
-    "1. The 'search_text' key should include useful free-text search terms extracted from subject, body, and attachments.\n"
+    "1. The 'search_text' key should include useful free-text search terms extracted from subject, body, and attachments. "
+    "Leave it empty when the request only constrains structured fields (sender, recipients, category, importance, dates, size).\n"
     "2. The 'filter' key should include any structured filter expressions. When filtering on dates, use ISO 8601 format. "
     "For example, if the user says 'before June 13 2025', output a filter like: c.sent_time < '2025-06-13T00:00:00Z'.\n"
     "For sender emails or other string properties, use equality with proper quoting.\n"
@@ -81,7 +96,12 @@ credential = ClientSecretCredential(
 )
 
 cosmos_client = CosmosClient(COSMOS_URI, credential=credential)
-container = cosmos_client.get_database_client(COSMOS_DB_NAME).get_container_client(COSMOS_CONTAINER_NAME)
+database = cosmos_client.get_database_client(COSMOS_DB_NAME)
+
+
+def get_container():
+    """Client for the live container: the active-store pointer flipped by utils/reindex.py, else COSMOS_CONTAINER_NAME."""
+    return database.get_container_client(active_name("cosmos", COSMOS_CONTAINER_NAME))
 
 # ─────────────────── Models ───────────────────
 class SearchQuery(BaseModel):
@@ -94,50 +114,133 @@ class EmailResult(BaseModel):
     subject: str
     sent_time: str
     body_preview: str
+    thread_id: Optional[str] = None
+
+class SearchPage(BaseModel):
+    results: List[EmailResult]
+    next_cursor: Optional[str] = None  # pass back as `cursor` for the next page; None on the last page
 
 # ─────────────────── Utility ───────────────────
+@lru_cache(maxsize=256)
 def get_embedding(text: str) -> List[float]:
+    """Query embedding; cached so later pages of a search do not embed the text again."""
     url = f"{AZURE_OPENAI_ENDPOINT}/openai/deployments/{EMBEDDING_DEPLOYMENT}/embeddings?api-version={AZURE_OPENAI_API_VERSION}"
     headers = {"Content-Type": "application/json", "api-key": AZURE_OPENAI_KEY}
-    response = requests.post(url, headers=headers, json={"input": text})
+    response = requests.post(url, headers=headers, json=embedding_payload(text))
     response.raise_for_status()
-    return response.json()["data"][0]["embedding"]
+    return fit_dimensions(response.json()["data"][0]["embedding"])
+
+
+# Filter-only queries, counts and facets are answered from the local metadata index
+METADATA_INDEX = MetadataIndex()
+
+
+def email_result(item) -> EmailResult:
+    """EmailResult from a row projected with COSMOS_RESULT_PROJECTION."""
+    return EmailResult(
+        id=item.get("id"),
+        sender=item.get("from", "N/A"),
+        subject=item.get("subject", ""),
+        sent_time=item.get("sent_time", ""),
+        body_preview=item.get("body_preview") or "",
+        thread_id=item.get("thread_id"),
+    )
+
+
+def search_page(results: List[EmailResult], next_cursor: Optional[str]) -> SearchPage:
+    """One result per thread; the page token still counts every row read."""
+    return SearchPage(results=list(collapse_threads(results, key=lambda r: r.thread_id or r.id)), next_cursor=next_cursor)
+
+
+def filter_only_results(filter_str: str, limit: int = 20, offset: int = 0) -> Optional[List[EmailResult]]:
+    """Newest emails matching the filter via the metadata index + projected reads; None when the index can't answer."""
+    container = get_container()
+    try:
+        # Rows may be missing or stale unless the index was built from the live container
+        if not METADATA_INDEX.covers(container.id):
+            return None
+        matches = METADATA_INDEX.search(filter_str, limit=limit, offset=offset)
+    except UnsupportedFilter as e:
+        print(f"[DEBUG] Metadata index cannot evaluate the filter ({e}), using Cosmos DB.")
+        return None
+    return [email_result(item) for item in read_projected(container, layout_of(container), matches)]
+
+
+@mcp.tool(description="Count emails matching a Cosmos DB filter and break them down by a field (from, recipient, category, important) and by sent date (interval: day, week, month or year)")
+def email_facets(filter: str = "", field: str = "from", interval: str = "day", limit: int = 10) -> Dict:
+    if not METADATA_INDEX.covers(get_container().id):
+        return {"error": "The metadata index does not cover the live container; run utils/metadata_index.py --rebuild"}
+    try:
+        return {
+            "count": METADATA_INDEX.count(filter),
+            "top_values": [{"value": v, "count": n} for v, n in METADATA_INDEX.facet(field, filter, limit)],
+            "histogram": [{"bucket": b, "count": n} for b, n in METADATA_INDEX.histogram(filter, interval)],
+        }
+    except (UnsupportedFilter, ValueError) as e:
+        return {"error": str(e)}
 
 # ─────────────────── Tool Endpoint ───────────────────
-@mcp.tool(description="Run vector + full-text query over Cosmos DB email container")
-def run_cosmos_query(params: SearchQuery) -> List[EmailResult]:
-    embedding = get_embedding(params.search_text)
+@mcp.tool(description="Run vector + full-text query over Cosmos DB email container. Returns one page of results; "
+                      "to get more, call again with `cursor` set to the returned next_cursor (the query is taken from the cursor)")
+def run_cosmos_query(params: SearchQuery, cursor: Optional[str] = None, page_size: int = 20) -> SearchPage:
+    page_size = max(1, min(page_size, 50))
+    try:
+        page = Cursor.decode(cursor) if cursor else None
+    except InvalidCursor as e:
+        raise ValueError(str(e)) from e
+    if page is None:
+        filter_only = not params.search_text.strip() and bool(params.filter)
+        page = Cursor(params.search_text, params.filter or "", FILTER_SCAN if filter_only else HYBRID)
+
+    # No semantic component: skip the embedding and vector ranking entirely
+    if page.plan == FILTER_SCAN:
+        if page.continuation is None:
+            results = filter_only_results(page.filter, limit=page_size, offset=page.offset)
+            if results is not None:
+                return search_page(results, next_page_token(page, len(results), page_size))
+        container = get_container()
+        route = layout_of(container).route(page.filter)
+        # Resumes from Cosmos DB's continuation token; offset paging only after metadata index pages
+        native = page.continuation is not None or page.offset == 0
+        page_clause = "" if native else f"OFFSET {page.offset} LIMIT {page_size}"
+        query = f"""
+        SELECT {COSMOS_RESULT_PROJECTION}
+        FROM c
+        {route.where(page.filter)}
+        ORDER BY c.sent_time DESC
+        {page_clause}
+        """
+        query = query.replace("c.from", "c[\"from\"]")  # keyword escaping
+        pager = container.query_items(query=query, max_item_count=page_size, **route.query_kwargs()).by_page(page.continuation)
+        top_results = [email_result(item) for item in next(pager, [])]
+        next_cursor = next_page_token(page, len(top_results), page_size, pager.continuation_token, native=native)
+        return search_page(top_results, next_cursor)
+
+    embedding = get_embedding(page.search_text)
     embedding_literal = "[" + ",".join(str(x) for x in embedding) + "]"
-    safe_text = params.search_text.replace("'", "\\'")
-    where_clause = f"WHERE {params.filter}" if params.filter else ""
+    safe_text = page.search_text.replace("'", "\\'")
+    container = get_container()
+    route = layout_of(container).route(page.filter)
+    where_clause = route.where(page.filter)
 
     query = f"""
-    SELECT TOP 20 c.id, c["from"], c.subject, c.sent_time, c.body
+    SELECT {COSMOS_RESULT_PROJECTION}
     FROM c
     {where_clause}
     ORDER BY RANK RRF(
-        VectorDistance(c.bodyVector, {embedding_literal}),
+        VectorDistance(c.{vector_field_of(container)}, {embedding_literal}),
         FullTextScore(c.body, '{safe_text}')
     )
+    OFFSET {page.offset} LIMIT {page_size}
     """
     query = query.replace("c.from", "c[\"from\"]")  # keyword escaping
 
-    results = list(container.query_items(query=query, enable_cross_partition_query=True))
+    results = list(container.query_items(query=query, **route.query_kwargs()))
 
     top_results = []
     for item in results:
-        body = item.get("body", "")
-        body_preview = body[:200] + ("..." if len(body) > 200 else "")
-        top_results.append(
-            EmailResult(
-                id=item.get("id"),
-                sender=item.get("from", "N/A"),
-                subject=item.get("subject", ""),
-                sent_time=item.get("sent_time", ""),
-                body_preview=body_preview,
-            )
-        )
-    return top_results
+        top_results.append(email_result(item))
+    return search_page(top_results, next_page_token(page, len(top_results), page_size))
 
 # ─────────────────── Run as SSE Server ───────────────────
 if __name__ == "__main__":
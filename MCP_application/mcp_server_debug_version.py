@@ -3,14 +3,30 @@ from semantic_kernel.functions.kernel_plugin import KernelPlugin
 from fastmcp import FastMCP
 from pydantic import BaseModel, Field
 from typing import Dict, List, Optional
+from functools import lru_cache
 from dotenv import load_dotenv
 from datetime import datetime
 import os
 import requests
 import json
+import threading
 import time
 from azure.cosmos import CosmosClient
 from azure.identity import ClientSecretCredential
+from openai import APIError, AzureOpenAI
+import sys
+from pathlib import Path
+# Repo root on the path for the shared metadata index (utils/metadata_index.py)
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.embedding_dimensions import embedding_payload, fit_dimensions
+from utils.active_store import active_name
+from utils.cosmos_partitioning import layout_of
+from utils.metadata_index import MetadataIndex, UnsupportedFilter
+from utils.pagination import Cursor, InvalidCursor, next_page_token
+from utils.email_threads import collapse_threads
+from utils.query_planner import FILTER_SCAN, HYBRID
+from utils.result_fields import COSMOS_RESULT_PROJECTION, read_projected
+from utils.vector_layout import vector_field_of
 
 # ─────────────────── Load ENV and Initialize ───────────────────
 load_dotenv()
@@ -48,7 +64,12 @@ credential = ClientSecretCredential(
 )
 
 cosmos_client = CosmosClient(COSMOS_URI, credential=credential)
-container = cosmos_client.get_database_client(COSMOS_DB_NAME).get_container_client(COSMOS_CONTAINER_NAME)
+database = cosmos_client.get_database_client(COSMOS_DB_NAME)
+
+
+def get_container():
+    """Client for the live container: the active-store pointer flipped by utils/reindex.py, else COSMOS_CONTAINER_NAME."""
+    return database.get_container_client(active_name("cosmos", COSMOS_CONTAINER_NAME))
 
 # ─────────────────── Models ───────────────────
 class SearchQuery(BaseModel):
@@ -61,6 +82,11 @@ class EmailResult(BaseModel):
     subject: str
     sent_time: str
     body_preview: str
+    thread_id: Optional[str] = None
+
+class SearchPage(BaseModel):
+    results: List[EmailResult]
+    next_cursor: Optional[str] = None  # pass back as `cursor` for the next page; None on the last page
 
 class ConversationMessage(BaseModel):
     role: str
@@ -71,35 +97,75 @@ class ConversationHistory(BaseModel):
 
 
 # ─────────────────── Utility ───────────────────
+@lru_cache(maxsize=256)
 def get_embedding(text: str) -> List[float]:
+    """Query embedding; cached so later pages of a search do not embed the text again."""
     print(f"[DEBUG] Generating embedding for search_text: '{text}'")
     url = f"{AZURE_OPENAI_ENDPOINT}/openai/deployments/{EMBEDDING_DEPLOYMENT}/embeddings?api-version={AZURE_OPENAI_API_VERSION}"
     headers = {"Content-Type": "application/json", "api-key": AZURE_OPENAI_KEY}
-    response = requests.post(url, headers=headers, json={"input": text})
+    response = requests.post(url, headers=headers, json=embedding_payload(text))
     response.raise_for_status()
     print("[DEBUG] Embedding created successfully.")
-    return response.json()["data"][0]["embedding"]
+    return fit_dimensions(response.json()["data"][0]["embedding"])
 
-def call_azure_openai_chat(messages: List[Dict]) -> Optional[str]:
-    # print(f"[DEBUG] Calling Azure OpenAI chat with messages: {messages}")
-    url = f"{AZURE_OPENAI_ENDPOINT}/openai/deployments/{CHAT_DEPLOYMENT}/chat/completions?api-version={AZURE_OPENAI_API_VERSION}"
-    headers = {"Content-Type": "application/json", "api-key": AZURE_OPENAI_KEY}
-    body = {
-        "messages": messages,
-        "max_tokens": 500,
-        "temperature": 0,
-        "top_p": 1,
-        "n": 1,
-        "stop": None,
-    }
+chat_completion_client = AzureOpenAI(
+    api_key=AZURE_OPENAI_KEY,
+    azure_endpoint=AZURE_OPENAI_ENDPOINT,
+    api_version=AZURE_OPENAI_API_VERSION,
+)
+
+# Filter-only queries, counts and facets are answered from the local metadata index
+METADATA_INDEX = MetadataIndex()
+
+
+def email_result(item) -> EmailResult:
+    """EmailResult from a row projected with COSMOS_RESULT_PROJECTION."""
+    return EmailResult(
+        id=item.get("id"),
+        sender=item.get("from", "N/A"),
+        subject=item.get("subject", ""),
+        sent_time=item.get("sent_time", ""),
+        body_preview=item.get("body_preview") or "",
+        thread_id=item.get("thread_id"),
+    )
+
+
+def search_page(results: List[EmailResult], next_cursor: Optional[str]) -> SearchPage:
+    """One result per thread; the page token still counts every row read."""
+    return SearchPage(results=list(collapse_threads(results, key=lambda r: r.thread_id or r.id)), next_cursor=next_cursor)
+
+
+def filter_only_results(filter_str: str, limit: int = 20, offset: int = 0) -> Optional[List[EmailResult]]:
+    """Newest emails matching the filter via the metadata index + projected reads; None when the index can't answer."""
+    container = get_container()
     try:
-        resp = requests.post(url, headers=headers, json=body)
-        resp.raise_for_status()
-        completion = resp.json()
-        return completion["choices"][0]["message"]["content"]
-    except Exception as e:
-        print(f"[ERROR] Azure OpenAI chat call failed: {e}")
+        # Rows may be missing or stale unless the index was built from the live container
+        if not METADATA_INDEX.covers(container.id):
+            return None
+        matches = METADATA_INDEX.search(filter_str, limit=limit, offset=offset)
+    except UnsupportedFilter as e:
+        print(f"[DEBUG] Metadata index cannot evaluate the filter ({e}), using Cosmos DB.")
         return None
+    return [email_result(item) for item in read_projected(container, layout_of(container), matches)]
+
+
+@mcp.tool(description="Count emails matching a Cosmos DB filter and break them down by a field (from, recipient, category, important) and by sent date (interval: day, week, month or year)")
+def email_facets(filter: str = "", field: str = "from", interval: str = "day", limit: int = 10) -> Dict:
+    if not METADATA_INDEX.covers(get_container().id):
+        return {"error": "The metadata index does not cover the live container; run utils/metadata_index.py --rebuild"}
+    try:
+        return {
+            "count": METADATA_INDEX.count(filter),
+            "top_values": [{"value": v, "count": n} for v, n in METADATA_INDEX.facet(field, filter, limit)],
+            "histogram": [{"bucket": b, "count": n} for b, n in METADATA_INDEX.histogram(filter, interval)],
+        }
+    except (UnsupportedFilter, ValueError) as e:
+        return {"error": str(e)}
+
+# Process-wide counters for the structured query translator: malformed model outputs apart from
+# API / network errors; tool calls run concurrently, so update them under the lock
+QUERY_GENERATION_STATS = {"calls": 0, "malformed": 0, "api_errors": 0, "total_latency": 0.0}
+QUERY_GENERATION_STATS_LOCK = threading.Lock()
 
 
 
@@ -114,7 +180,7 @@ Convert the conversation of natural language email search queries into a complet
 The JSON object must contain exactly the following keys: 'search_text' and 'filter'.
 
 Additional guidelines:
-1. The 'search_text' key should include useful free-text search terms extracted from subject, body, and attachments.
+1. The 'search_text' key should include useful free-text search terms extracted from subject, body, and attachments. Leave it empty when the request only constrains structured fields (sender, recipients, category, importance, dates, size).
 2. The 'filter' key should include any structured filter expressions. When filtering on dates, use ISO 8601 format. 
 For example, if the user says 'before June 13 2025', output a filter like: c.sent_time < '2025-06-13T00:00:00Z'.
 For sender emails or other string properties, use equality with proper quoting.
@@ -137,119 +203,142 @@ Document schema:
     messages = [{"role": "system", "content": system_prompt}]
     messages.extend([{"role": m.role, "content": m.content} for m in params.messages])
 
-    max_attempts = 3
-    for attempt in range(max_attempts):
-        print(f"[DEBUG] Attempt {attempt+1}: Sending messages to OpenAI for NLP-to-JSON conversion.")
-        reply = call_azure_openai_chat(messages)
-        if not reply:
-            error_msg = "No response obtained from OpenAI."
-        else:
-            # print(f"[DEBUG] OpenAI raw reply: {reply}")
-            try:
-                query_json = json.loads(reply)
-                print(f"[DEBUG] Parsed JSON: {query_json}")
-                if "search_text" in query_json and "filter" in query_json:
-                    print(f"[DEBUG] Extracted search_text: '{query_json['search_text']}', filter: '{query_json['filter']}'")
-                    return SearchQuery(search_text=query_json["search_text"], filter=query_json["filter"])
-                else:
-                    error_msg = "The JSON is missing required keys 'search_text' or 'filter'."
-            except Exception as e:
-                error_msg = f"JSON parse error: {str(e)}. Full response was: {reply}"
-
-        messages.append({"role": "assistant", "content": reply if reply else ""})
-        messages.append({"role": "user", "content": f"Error: {error_msg} Please provide a valid JSON object with only the keys 'search_text' and 'filter'."})
-        time.sleep(1)
-
-    print("[ERROR] All attempts to generate search query failed.")
-    return SearchQuery(search_text="", filter="")
+    start = time.perf_counter()
+    failure = None
+    try:
+        # Schema-constrained output replaces the old json.loads + retry/sleep loop
+        response = chat_completion_client.beta.chat.completions.parse(
+            model=CHAT_DEPLOYMENT,
+            messages=messages,
+            max_tokens=500,
+            temperature=0,
+            response_format=SearchQuery,
+        )
+        search_query = response.choices[0].message.parsed
+        if search_query is None:
+            failure = "malformed"  # refusal
+    except APIError as e:
+        # Connection, timeout, rate-limit and HTTP errors say nothing about the model's output
+        print(f"[ERROR] Azure OpenAI structured query call failed: {e}")
+        search_query, failure = None, "api_errors"
+    except Exception as e:
+        # Truncated, filtered or schema-violating output
+        print(f"[ERROR] Azure OpenAI returned no valid structured query: {e}")
+        search_query, failure = None, "malformed"
+    latency = time.perf_counter() - start
+    with QUERY_GENERATION_STATS_LOCK:
+        QUERY_GENERATION_STATS["calls"] += 1
+        QUERY_GENERATION_STATS["total_latency"] += latency
+        if failure:
+            QUERY_GENERATION_STATS[failure] += 1
+        summary = (
+            f"malformed outputs: {QUERY_GENERATION_STATS['malformed']}/{QUERY_GENERATION_STATS['calls']}, "
+            f"API errors: {QUERY_GENERATION_STATS['api_errors']}"
+        )
+    print(f"[DEBUG] Query generation took {latency:.2f}s ({summary})")
+
+    if search_query is None:
+        print("[ERROR] Failed to generate search query.")
+        return SearchQuery(search_text="", filter="")
+    print(f"[DEBUG] Extracted search_text: '{search_query.search_text}', filter: '{search_query.filter}'")
+    return search_query
     
 @mcp.tool(description="Run vector + full-text query over Cosmos DB email container")
-def _run_cosmos_query_impl(params: ConversationHistory) -> List[EmailResult]:
-    print(f"[DEBUG] User query received: {params.messages[-1].content if params.messages else '[No message]'}")
-    search_query = generate_search_query(params)
-    if not search_query:
-        print("[ERROR] No search query generated.")
-        return []
+def _run_cosmos_query_impl(params: ConversationHistory, cursor: Optional[str] = None, page_size: int = 20) -> SearchPage:
+    page_size = max(1, min(page_size, 50))
+    if cursor:
+        # Later pages reuse the translated query and plan carried by the cursor: no query generation
+        try:
+            page = Cursor.decode(cursor)
+        except InvalidCursor as e:
+            print(f"[ERROR] {e}")
+            return SearchPage(results=[])
+        print(f"[DEBUG] Continuing search from offset {page.offset}: search_text '{page.search_text}', filter '{page.filter}'")
+    else:
+        print(f"[DEBUG] User query received: {params.messages[-1].content if params.messages else '[No message]'}")
+        search_query = generate_search_query(params)
+        if not search_query:
+            print("[ERROR] No search query generated.")
+            return SearchPage(results=[])
+        filter_only = not search_query.search_text and bool(search_query.filter)
+        page = Cursor(search_query.search_text, search_query.filter or "", FILTER_SCAN if filter_only else HYBRID)
 
     # If search_text is empty but filter is present, do filter-only search
-    if not search_query.search_text and search_query.filter:
+    if page.plan == FILTER_SCAN:
+        if page.continuation is None:
+            results = filter_only_results(page.filter, limit=page_size, offset=page.offset)
+            if results is not None:
+                print(f"[DEBUG] No search_text found, answered from the metadata index ({len(results)} results).")
+                return search_page(results, next_page_token(page, len(results), page_size))
         print("[DEBUG] No search_text found, running filter-only Cosmos DB query.")
-        where_clause = f"WHERE {search_query.filter}" if search_query.filter else ""
+        container = get_container()
+        route = layout_of(container).route(page.filter)
+        where_clause = route.where(page.filter)
+        # Resumes from Cosmos DB's continuation token; offset paging only after metadata index pages
+        native = page.continuation is not None or page.offset == 0
+        page_clause = "" if native else f"OFFSET {page.offset} LIMIT {page_size}"
         query = f"""
-        SELECT TOP 20 c.id, c["from"], c.subject, c.sent_time, c.body
+        SELECT {COSMOS_RESULT_PROJECTION}
         FROM c
         {where_clause}
         ORDER BY c.sent_time DESC
+        {page_clause}
         """
         query = query.replace("c.from", "c[\"from\"]")
         # print(f"[DEBUG] Final Cosmos DB SQL Query (filter-only):\n{query}")
         try:
-            results = list(container.query_items(query=query, enable_cross_partition_query=True))
+            pager = container.query_items(query=query, max_item_count=page_size, **route.query_kwargs()).by_page(page.continuation)
+            results = list(next(pager, []))
             print(f"[DEBUG] Cosmos DB returned {len(results)} results.")
         except Exception as e:
             print(f"[ERROR] Cosmos DB query failed: {e}")
-            return []
+            return SearchPage(results=[])
         top_results = []
         for item in results:
-            body = item.get("body", "")
-            body_preview = body[:200] + ("..." if len(body) > 200 else "")
-            top_results.append(
-                EmailResult(
-                    id=item.get("id"),
-                    sender=item.get("from", "N/A"),
-                    subject=item.get("subject", ""),
-                    sent_time=item.get("sent_time", ""),
-                    body_preview=body_preview,
-                )
-            )
-        return top_results
+            top_results.append(email_result(item))
+        next_cursor = next_page_token(page, len(top_results), page_size, pager.continuation_token, native=native)
+        return search_page(top_results, next_cursor)
 
     # If both are empty, return error
-    if not search_query.search_text and not search_query.filter:
+    if not page.search_text and not page.filter:
         print("[ERROR] No valid search_text or filter extracted from NLP-to-JSON step.")
-        return []
+        return SearchPage(results=[])
 
     # Otherwise, proceed as before (hybrid search)
     print("[DEBUG] Proceeding with hybrid (vector + filter) search.")
-    embedding = get_embedding(search_query.search_text)
+    embedding = get_embedding(page.search_text)
     embedding_literal = "[" + ",".join(str(x) for x in embedding) + "]"
-    safe_text = search_query.search_text.replace("'", "\\'")
-    where_clause = f"WHERE {search_query.filter}" if search_query.filter else ""
+    safe_text = page.search_text.replace("'", "\\'")
+    container = get_container()
+    route = layout_of(container).route(page.filter)
+    where_clause = route.where(page.filter)
     query = f"""
-    SELECT TOP 20 c.id, c["from"], c.subject, c.sent_time, c.body
+    SELECT {COSMOS_RESULT_PROJECTION}
     FROM c
     {where_clause}
     ORDER BY RANK RRF(
-        VectorDistance(c.bodyVector, {embedding_literal}),
+        VectorDistance(c.{vector_field_of(container)}, {embedding_literal}),
         FullTextScore(c.body, '{safe_text}')
     )
+    OFFSET {page.offset} LIMIT {page_size}
     """
     query = query.replace("c.from", "c[\"from\"]")
     # print(f"[DEBUG] Final Cosmos DB SQL Query (hybrid):\n{query}")
     try:
-        results = list(container.query_items(query=query, enable_cross_partition_query=True))
+        results = list(container.query_items(query=query, **route.query_kwargs()))
         print(f"[DEBUG] Cosmos DB returned {len(results)} results.")
     except Exception as e:
         print(f"[ERROR] Cosmos DB query failed: {e}")
-        return []
+        return SearchPage(results=[])
     top_results = []
     for item in results:
-        body = item.get("body", "")
-        body_preview = body[:200] + ("..." if len(body) > 200 else "")
-        top_results.append(
-            EmailResult(
-                id=item.get("id"),
-                sender=item.get("from", "N/A"),
-                subject=item.get("subject", ""),
-                sent_time=item.get("sent_time", ""),
-                body_preview=body_preview,
-            )
-        )
-    return top_results
+        top_results.append(email_result(item))
+    return search_page(top_results, next_page_token(page, len(top_results), page_size))
 
-@mcp.tool(description="Submit a natural language email search and get results from Cosmos DB")
-def run_cosmos_query(params: ConversationHistory) -> List[EmailResult]:
-    return _run_cosmos_query_impl(params)
+@mcp.tool(description="Submit a natural language email search and get one page of results from Cosmos DB. "
+                      "For more results call again with `cursor` set to the returned next_cursor")
+def run_cosmos_query(params: ConversationHistory, cursor: Optional[str] = None, page_size: int = 20) -> SearchPage:
+    return _run_cosmos_query_impl(params, cursor, page_size)
 
 # ─────────────────── Test Block ───────────────────
 if __name__ == "__main__":
@@ -261,7 +350,7 @@ if __name__ == "__main__":
     print(f"[TEST] Submitting user query: {user_query}")
     results = _run_cosmos_query_impl(conversation)
     print("\n=== Search Results ===")
-    for email in results:
+    for email in results.results:
         print(f"Subject: {email.subject}")
         print(f"From: {email.sender}")
         print(f"Sent: {email.sent_time}")
@@ -68,11 +68,51 @@ def extract_email(text):
 def format_datetime(dt):  
     return dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'  
   
+def normalize_message_id(value):  
+    match = re.search(r"<[^<>\s]+>", value or "")  
+    return (match.group() if match else (value or "").strip()).strip("<>").lower()  
+  
+def normalize_subject(subject):  
+    subject = subject or ""  
+    while True:  
+        stripped = re.sub(r"^\s*\[[^\]]*\]\s*", "", re.sub(r"^\s*(re|fw|fwd|aw|wg|sv|vs|antw|tr|rv)\s*(\[\d+\])?\s*:\s*", "", subject, flags=re.IGNORECASE))  
+        if stripped == subject:  
+            return " ".join(subject.split()).lower()  
+        subject = stripped  
+  
+def thread_fields(msg):  
+    """  
+    message_id and thread_id from the headers alone (same rules as utils/email_threads.py): the thread  
+    is identified by its root Message-ID, so every reply of a chain gets the same thread_id. References  
+    starts at the root; In-Reply-To only names the parent, so without References the parent is passed on  
+    as in_reply_to and UploadDocuments takes the parent's thread_id from the index when it is there.  
+    """  
+    header = msg.header or {}  
+    message_id = normalize_message_id(header.get("Message-ID"))  
+    references = [normalize_message_id(m) for m in re.findall(r"<[^<>\s]+>", header.get("References") or "")]  
+    in_reply_to = "" if references else normalize_message_id(header.get("In-Reply-To"))  
+    root = (  
+        (references[0] if references else in_reply_to)  
+        or message_id  
+        or f"subject:{normalize_subject(msg.subject)}"  
+    )  
+    fields = {  
+        "message_id": message_id,  
+        "thread_id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"email-thread:{root}")),  
+        "duplicate_count": 0,  
+    }  
+    if in_reply_to:  
+        fields["in_reply_to"] = in_reply_to  
+    return fields  
+  
 def process_msg_file(msg_file_path, email_id):  
     try:  
         msg = extract_msg.Message(msg_file_path)  
         msg_data = {}  
-        msg_data["id"] = email_id  
+        msg_data.update(thread_fields(msg))  
+        # Stable per Message-ID, so a message uploaded twice (e.g. from two mailboxes) is stored once  
+        message_id = msg_data["message_id"]  
+        msg_data["id"] = str(uuid.uuid5(uuid.NAMESPACE_URL, f"email:{message_id}")) if message_id else email_id  
         msg_data["from"] = extract_email(msg.sender) if msg.sender else ""  
         msg_data["to_list"] = ",".join([r.email for r in msg.recipients if hasattr(r, 'email')]) if msg.recipients else ""  
         msg_data["cc_list"] = str(msg.cc) if msg.cc else ""  
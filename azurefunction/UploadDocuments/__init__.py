@@ -1,9 +1,12 @@
 import logging  
+import math  
 import os  
 import json  
+import uuid  
 import requests  
 import azure.functions as func  
 from azure.core.credentials import AzureKeyCredential  
+from azure.core.exceptions import ResourceNotFoundError  
 from azure.identity import DefaultAzureCredential  
 from azure.search.documents import SearchClient  
 def get_embedding(text):  
@@ -13,16 +16,38 @@ def get_embedding(text):
     azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION")  
     url = f"{azure_openai_endpoint}/openai/deployments/{azure_openai_embedding_deployment}/embeddings?api-version={azure_openai_api_version}"  
     headers = {"Content-Type": "application/json", "api-key": azure_openai_key}  
-    response = requests.post(url, headers=headers, json={"input": text})  
+    # Reduced dimensions must match the index; same settings and rules as utils/embedding_dimensions.py:  
+    # the API's `dimensions` parameter in "api" mode (text-embedding-3 only), else truncate and re-normalize  
+    dimensions = int(os.getenv("AZURE_OPENAI_EMB_DIMENSIONS", "1536"))  
+    native_dimensions = int(os.getenv("AZURE_OPENAI_EMB_NATIVE_DIMENSIONS", "1536"))  
+    payload = {"input": text}  
+    if os.getenv("AZURE_OPENAI_EMB_DIMENSION_MODE", "api") == "api" and dimensions != native_dimensions:  
+        payload["dimensions"] = dimensions  
+    response = requests.post(url, headers=headers, json=payload)  
     response.raise_for_status()  
-    return response.json()["data"][0]["embedding"]  
+    vector = response.json()["data"][0]["embedding"]  
+    if len(vector) <= dimensions:  
+        return vector  
+    vector = vector[:dimensions]  
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0  
+    return [v / norm for v in vector]  
   
 def main(myblob: func.InputStream) -> None:  
     logging.info(f"Triggered UploadDocuments for blob: {myblob.name}")  
     msg_data = json.loads(myblob.read())  
-    # Compute vector embeddings for the email subject and body  
-    msg_data["subjectVector"] = get_embedding(msg_data.get("subject", ""))  
-    msg_data["bodyVector"] = get_embedding(msg_data.get("body", ""))  
+    # Compute vector embeddings for the email subject and body, or one fused "subject + summary"  
+    # vector (EMAIL_VECTOR_LAYOUT=fused, must match the index; same as utils/vector_layout.py)  
+    if os.getenv("EMAIL_VECTOR_LAYOUT", "split") == "fused":  
+        subject = (msg_data.get("subject") or "").strip()  
+        body = (msg_data.get("body") or "").strip()  
+        msg_data["contentVector"] = get_embedding(f"{subject}\n\n{body}" if subject and body else subject or body)  
+    else:  
+        msg_data["subjectVector"] = get_embedding(msg_data.get("subject", ""))  
+        msg_data["bodyVector"] = get_embedding(msg_data.get("body", ""))  
+    # Preview shown in result lists (same as utils/result_fields.py), so searches need not fetch the body  
+    if not msg_data.get("body_preview"):  
+        body = msg_data.get("body", "")  
+        msg_data["body_preview"] = body[:200] + ("..." if len(body) > 200 else "")  
 
     # Prepare Azure Cognitive Search settings  
     endpoint = os.environ["AZURE_SEARCH_SERVICE_ENDPOINT"]  
@@ -33,5 +58,16 @@ def main(myblob: func.InputStream) -> None:
     credential = AzureKeyCredential(admin_key) if admin_key else DefaultAzureCredential()  
     logging.info("endpoint: %s", endpoint)
     search_client = SearchClient(endpoint=endpoint, index_name=index_name, credential=credential)  
+
+    # A reply without References only names its parent: join the parent's thread when it is indexed  
+    # (same root rule as utils/email_threads.py), else the parent stays the thread root  
+    in_reply_to = msg_data.pop("in_reply_to", "")  
+    if in_reply_to:  
+        parent_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"email:{in_reply_to}"))  
+        try:  
+            parent = search_client.get_document(key=parent_id, selected_fields=["thread_id"])  
+            msg_data["thread_id"] = parent.get("thread_id") or msg_data["thread_id"]  
+        except ResourceNotFoundError:  
+            pass  
     results = search_client.upload_documents(documents=[msg_data])  
     logging.info(f"Documents uploaded successfully: {results}")  
@@ -3,15 +3,22 @@
 # ───────────────────────────── Begin search_app.py ─────────────────────────────  
 import os  
 import json  
+import threading  
 import time  
 import streamlit as st  
 from azure.search.documents import SearchClient  
 from azure.core.credentials import AzureKeyCredential  
-from openai import AzureOpenAI  
+from openai import APIError, AzureOpenAI  
 from azure.search.documents.models import VectorizableTextQuery, VectorFilterMode  
 from dotenv import load_dotenv  
-from pydantic import BaseModel  
+from pydantic import BaseModel, Field  
 from azure.search.documents.models import QueryType, QueryCaptionType, QueryAnswerType  
+from utils.active_store import active_name  
+from utils.result_fields import RESULT_FIELDS  
+from utils.vector_layout import query_vector_field  
+from utils.pagination import Cursor, ResultPage  
+from utils.email_threads import collapse_threads, thread_key  
+from utils.query_planner import FILTER_SCAN, KEYWORD, VECTOR, HYBRID, HYBRID_RERANK, PlanStats, QueryPlan, plan_query  
 import time
 # Load environment variables  
 load_dotenv()  
@@ -22,6 +29,11 @@ azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION")  
 chat_model = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT")  
   
+# Incremental refinement: send only the previous query JSON plus the newest utterance ("full" resends the whole history)  
+query_refinement_mode = os.getenv("QUERY_REFINEMENT_MODE", "incremental")  
+# Fold older requests into a short running summary every N turns (0 disables summarization)  
+query_summary_every_n_turns = int(os.getenv("QUERY_SUMMARY_EVERY_N_TURNS", "5"))  
+  
 chat_completion_client = AzureOpenAI(  
     api_key=azure_openai_key,  
     azure_endpoint=azure_openai_endpoint,  
@@ -40,16 +52,32 @@ def get_openai_chat_response(messages):
     except Exception as e:  
         print(f"Error getting OpenAI chat response: {e}")  
         return None  
+  
+class SearchQuery(BaseModel):  
+    """Typed search query returned by the structured-output query translator."""  
+    search_text: str = Field(description="Free-text search terms extracted from subject, body, and attachments.")  
+    filter: str = Field(description="OData filter expression, or an empty string when there are no structured constraints.")  
+  
+@st.cache_resource  
+def get_query_generation_stats():  
+    """  
+    Process-wide query generation counters that survive Streamlit reruns: calls, malformed model  
+    outputs, API / network errors and latency. Sessions run concurrently, so update them under "lock".  
+    """  
+    return {"lock": threading.Lock(), "calls": 0, "malformed": 0, "api_errors": 0,  
+            "total_latency": 0.0, "last_latency": 0.0, "last_first_token_latency": 0.0}  
+  
 #print out the current time in 2025-06-13T00:00:00Z format
 def get_current_time():
     """Get the current time in ISO 8601 format."""  
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 # 2. Generate a complete Azure Cognitive Search query from the conversation history  
-def generate_search_query(conversation_history: list) -> dict:  
+def generate_search_query(conversation_history: list, on_partial=None) -> dict:  
     """  
     Converts the conversation of natural language email search queries into a complete Azure Cognitive  
     Search query in JSON format. The JSON object must contain exactly the following keys:  
     "search_text" and "filter".  
+    If given, on_partial is called with the partial JSON text as tokens stream in.  
     """  
     system_prompt = (  
         f"Today is {get_current_time()}. You are an expert query translator for Azure Cognitive Search. Convert the conversation of natural language "  
@@ -79,27 +107,91 @@ def generate_search_query(conversation_history: list) -> dict:
     )  
   
     messages = [{"role": "system", "content": system_prompt}] + conversation_history  
-    max_attempts = 3  
+    start = time.perf_counter()  
+    first_token_latency = None  
+    failure = None  
+    try:  
+        # Schema-constrained output: the model can only answer with a SearchQuery, so no parse/retry loop is needed.  
+        # The response is streamed so the UI can show the query while it is still being written.  
+        with chat_completion_client.beta.chat.completions.stream(  
+            model=chat_model,  
+            messages=messages,  
+            max_tokens=500,  
+            response_format=SearchQuery,  
+        ) as stream:  
+            for event in stream:  
+                if event.type == "content.delta":  
+                    if first_token_latency is None:  
+                        first_token_latency = time.perf_counter() - start  
+                    if on_partial is not None:  
+                        on_partial(event.snapshot)  
+            parsed = stream.get_final_completion().choices[0].message.parsed  
+        if parsed is None:  
+            failure = "malformed"  # refusal  
+    except APIError as e:  
+        # Connection, timeout and HTTP errors say nothing about the model's output  
+        print(f"Error calling OpenAI for the structured query: {e}")  
+        parsed, failure = None, "api_errors"  
+    except Exception as e:  
+        # Truncated, filtered or schema-violating output  
+        print(f"Error getting structured query from OpenAI: {e}")  
+        parsed, failure = None, "malformed"  
+    latency = time.perf_counter() - start  
+    stats = get_query_generation_stats()  
+    with stats["lock"]:  
+        stats["calls"] += 1  
+        stats["total_latency"] += latency  
+        stats["last_latency"] = latency  
+        stats["last_first_token_latency"] = first_token_latency or latency  
+        if failure:  
+            stats[failure] += 1  
+        summary = f"malformed outputs: {stats['malformed']}/{stats['calls']}, API errors: {stats['api_errors']}"  
+    print(f"Query generation took {latency:.2f}s, first token after {first_token_latency or latency:.2f}s ({summary})")  
   
-    for attempt in range(max_attempts):  
-        reply = get_openai_chat_response(messages)  
-        if not reply:  
-            error_msg = "No response obtained from OpenAI."  
-        else:  
-            try:  
-                query_json = json.loads(reply)  
-                if "search_text" in query_json and "filter" in query_json:  
-                    return query_json  
-                else:  
-                    error_msg = "The JSON is missing required keys 'search_text' or 'filter'."  
-            except Exception as e:  
-                error_msg = f"JSON parse error: {str(e)}. Full response was: {reply}"  
+    return parsed.model_dump() if parsed else None  
   
-        messages.append({"role": "assistant", "content": reply if reply else ""})  
-        messages.append({"role": "user", "content": f"Error: {error_msg} Please provide a valid JSON object with only the keys 'search_text', 'filter'"})  
-        time.sleep(1)  
+def build_refinement_messages(previous_query: dict, new_utterance: str, summary: str = "") -> list:  
+    """Constant-size refinement prompt: the current query JSON, an optional session summary and only the newest utterance."""  
+    content = ""  
+    if summary:  
+        content += f"Summary of earlier requests in this session: {summary}\n"  
+    content += f"Current query JSON: {json.dumps(previous_query)}\n"  
+    content += f"New request: {new_utterance}\n"  
+    content += "Merge the new request into the current query and return the complete updated query."  
+    return [{"role": "user", "content": content}]  
   
-    return None  
+def summarize_requests(summary: str, requests_to_fold: list):  
+    """Fold a batch of user requests into the running session summary."""  
+    messages = [  
+        {"role": "system", "content": "Maintain a one-paragraph summary (under 80 words) of what the user is searching for. Return only the updated summary."},  
+        {"role": "user", "content": f"Current summary: {summary or '(none)'}\nNew requests:\n" + "\n".join(f"- {r}" for r in requests_to_fold)},  
+    ]  
+    return get_openai_chat_response(messages) or summary  
+  
+def update_search_query(conversation_history: list, on_partial=None):  
+    """  
+    Produce the query for the newest utterance. In incremental mode the LLM only sees the previous query_json  
+    (plus an optional summary) and the newest utterance, so per-turn tokens stay roughly constant.  
+    """  
+    previous_query = st.session_state.query_json  
+    new_utterance = conversation_history[-1]["content"]  
+    incremental = query_refinement_mode == "incremental" and previous_query is not None  
+    if incremental:  
+        messages = build_refinement_messages(previous_query, new_utterance, st.session_state.query_summary)  
+    else:  
+        messages = conversation_history  
+  
+    query_json = generate_search_query(messages, on_partial=on_partial)  
+    if query_json is None:  
+        return None  
+    st.session_state.query_json = query_json  
+  
+    if query_refinement_mode == "incremental" and query_summary_every_n_turns > 0:  
+        st.session_state.pending_requests.append(new_utterance)  
+        if len(st.session_state.pending_requests) >= query_summary_every_n_turns:  
+            st.session_state.query_summary = summarize_requests(st.session_state.query_summary, st.session_state.pending_requests)  
+            st.session_state.pending_requests = []  
+    return query_json  
   
 # 3. Azure Cognitive Search configuration and query execution  
 service_endpoint = os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT")  # e.g., "https://.search.windows.net"  
@@ -107,28 +199,96 @@ index_name = os.getenv("AZURE_SEARCH_INDEX")  # e.g., "emails-index"
 admin_key = os.getenv("AZURE_SEARCH_ADMIN_KEY")  
 credential = AzureKeyCredential(admin_key)  
   
-search_client = SearchClient(endpoint=service_endpoint, index_name=index_name, credential=credential)  
+@st.cache_resource  
+def _search_client(name):  
+    return SearchClient(endpoint=service_endpoint, index_name=name, credential=credential)  
+  
+def get_search_client():  
+    """Client for the live index: the active-store pointer flipped by utils/reindex.py, else AZURE_SEARCH_INDEX."""  
+    return _search_client(active_name("aisearch", index_name))  
   
-def run_search_query(query_json: dict):  
-    """Execute the search query on Azure Cognitive Search using the generated JSON."""  
+@st.cache_resource  
+def get_plan_stats():  
+    """Per-plan latency/cost counters (also logged to PLANNER_LOG_PATH) that survive Streamlit reruns."""  
+    return PlanStats()  
+  
+# Results per page; more are fetched on demand with the page's continuation cursor  
+results_page_size = int(os.getenv("SEARCH_PAGE_SIZE", "3"))  
+  
+def run_search_query(query_json: dict, cursor: Cursor = None):  
+    """  
+    Execute one page of the search query on Azure Cognitive Search using the generated JSON.  
+    The planner picks the cheapest adequate execution; only natural-language requests  
+    pay for the hybrid + semantic reranker route. With a cursor (from a previous page)  
+    the same query and plan continue where that page ended.  
+    """  
+    if cursor is None:  
+        plan = plan_query(query_json)  
+        cursor = Cursor(plan.search_text, plan.filter, plan.name)  
+    else:  
+        plan = QueryPlan(cursor.plan, f"page from offset {cursor.offset}", cursor.search_text, cursor.filter)  
     # Use the search_text and filter returned from our generated query JSON  
-    search_text = query_json.get("search_text", "")  
-    filter_str = query_json.get("filter", None)  
-    vector_query = VectorizableTextQuery(text=search_text, k_nearest_neighbors=50, fields="bodyVector")  
-  
-    results = search_client.search(  
-        vector_queries=[vector_query],  
-        search_text=search_text,  
-        vector_filter_mode=VectorFilterMode.PRE_FILTER,  
-        filter=filter_str,  
-        query_type=QueryType.SEMANTIC,  
-        semantic_configuration_name='my-semantic-config',  
-        query_caption=QueryCaptionType.EXTRACTIVE,  
-        query_answer=QueryAnswerType.EXTRACTIVE,  
-        top=3  
-    )  
-    # Convert the generator into a list  
-    return [doc for doc in results]  
+    search_text = plan.search_text  
+    filter_str = plan.filter or None  
+    st.session_state.last_plan = plan  
+    search_client = get_search_client()  
+  
+    if plan.name == FILTER_SCAN:  
+        # Newest first, as in the Cosmos DB app; without an order skip/top pages are not stable  
+        results = search_client.search(search_text="*", filter=filter_str, select=RESULT_FIELDS, order_by=["sent_time desc"],  
+                                       skip=cursor.offset, top=results_page_size)  
+    elif plan.name == KEYWORD:  
+        results = search_client.search(search_text=search_text, filter=filter_str, select=RESULT_FIELDS, skip=cursor.offset, top=results_page_size)  
+    else:  
+        # The nearest neighbours must cover every page up to this one  
+        vector_query = VectorizableTextQuery(  
+            text=search_text, k_nearest_neighbors=max(50, cursor.offset + results_page_size),  
+            fields=query_vector_field(),  # bodyVector, or contentVector in the fused layout (EMAIL_VECTOR_LAYOUT)  
+        )  
+        if plan.name == VECTOR:  
+            results = search_client.search(  
+                vector_queries=[vector_query],  
+                vector_filter_mode=VectorFilterMode.PRE_FILTER,  
+                filter=filter_str,  
+                select=RESULT_FIELDS,  
+                skip=cursor.offset,  
+                top=results_page_size  
+            )  
+        elif plan.name == HYBRID:  
+            results = search_client.search(  
+                vector_queries=[vector_query],  
+                search_text=search_text,  
+                vector_filter_mode=VectorFilterMode.PRE_FILTER,  
+                filter=filter_str,  
+                select=RESULT_FIELDS,  
+                skip=cursor.offset,  
+                top=results_page_size  
+            )  
+        else:  # HYBRID_RERANK  
+            results = search_client.search(  
+                vector_queries=[vector_query],  
+                search_text=search_text,  
+                vector_filter_mode=VectorFilterMode.PRE_FILTER,  
+                filter=filter_str,  
+                query_type=QueryType.SEMANTIC,  
+                semantic_configuration_name='my-semantic-config',  
+                query_caption=QueryCaptionType.EXTRACTIVE,  
+                query_answer=QueryAnswerType.EXTRACTIVE,  
+                select=RESULT_FIELDS,  
+                skip=cursor.offset,  
+                top=results_page_size  
+            )  
+    # Only the displayed fields are selected (no vectors, no body); return the lazy pager (timed per plan) so the UI can render documents as they arrive  
+    return ResultPage(get_plan_stats().timed("ai_search", plan, results), results_page_size, cursor.next)  
+  
+def show_result(idx, res):  
+    """Render one search result (the fields selected by RESULT_FIELDS / COSMOS_RESULT_PROJECTION)."""  
+    st.markdown(f"**Result {idx+1}:**")  
+    st.write(f"**From:** {res.get('from', 'N/A')}")  
+    st.write(f"**Subject:** {res.get('subject', 'N/A')}")  
+    st.write(f"**Sent Time:** {res.get('sent_time', 'N/A')}")  
+    st.write(f"**Body Preview:** {res.get('body_preview') or ''}")  
+    st.markdown("---")  
   
 # 4. Streamlit UI  
 st.set_page_config(page_title="Intelligent Email Search", layout="wide")  
@@ -143,6 +303,10 @@ st.markdown(
 # Initialize conversation history in session state if not already present.  
 if "conversation_history" not in st.session_state:  
     st.session_state.conversation_history = []  
+if "query_json" not in st.session_state:  
+    st.session_state.query_json = None  
+    st.session_state.query_summary = ""  
+    st.session_state.pending_requests = []  
   
 # Use a Streamlit form so that the input text clears after submission.  
 with st.form("query_form", clear_on_submit=True):  
@@ -166,6 +330,9 @@ if submitted and new_query:
 if clear_history:  
     # Clear the conversation history  
     st.session_state.conversation_history = []  
+    st.session_state.query_json = None  
+    st.session_state.query_summary = ""  
+    st.session_state.pending_requests = []  
     st.success("Conversation history cleared!")  
 # Display the last two queries (if available) beneath the search box.  
 if st.session_state.conversation_history:  
@@ -176,30 +343,54 @@ if st.session_state.conversation_history:
 # If there is any conversation history, generate a new combined query and run it against Azure Cognitive Search.  
 if st.session_state.conversation_history:  
     st.info("Generating complete Azure Cognitive Search query using conversation history…")  
+    partial_query = st.empty()  
     with st.spinner("Calling OpenAI to generate the query…"):  
-        query_json = generate_search_query(st.session_state.conversation_history)  
-        if query_json is None:  
-            st.error("Unable to generate a valid search query. Please try again.")  
+        if (submitted and new_query) or st.session_state.query_json is None:  
+            query_json = update_search_query(  
+                st.session_state.conversation_history,  
+                on_partial=lambda snapshot: partial_query.code(snapshot, language="json"),  
+            )  
         else:  
-            st.markdown("Generated Azure Cognitive Search Query")  
-            st.json(query_json)  
-  
-            with st.spinner("Running query against Azure Cognitive Search…"):  
-                results_list = run_search_query(query_json)  
-                time.sleep(0.5)  
-  
-            st.subheader("Search Results")  
-            if not results_list:  
-                st.write("No results found.")  
-            else:  
-                for idx, res in enumerate(results_list):  
-                    st.markdown(f"**Result {idx+1}:**")  
-                    st.write(f"**From:** {res.get('from', 'N/A')}")  
-                    st.write(f"**Subject:** {res.get('subject', 'N/A')}")  
-                    st.write(f"**Sent Time:** {res.get('sent_time', 'N/A')}")  
-                    body_text = res.get('body', '')  
-                    body_preview = body_text[:200] + ("..." if len(body_text) > 200 else "")  
-                    st.write(f"**Body Preview:** {body_preview}")  
-                    st.markdown("---")  
+            query_json = st.session_state.query_json  
+    partial_query.empty()  
+    if query_json is None:  
+        st.error("Unable to generate a valid search query. Please try again.")  
+    else:  
+        st.markdown("Generated Azure Cognitive Search Query")  
+        st.json(query_json)  
+        stats = get_query_generation_stats()  
+        with stats["lock"]:  
+            stats = dict(stats)  
+        st.caption(  
+            f"Query generated in {stats['last_latency']:.2f}s (first token {stats['last_first_token_latency']:.2f}s) · "  
+            f"malformed outputs: {stats['malformed']}/{stats['calls']} · API errors: {stats['api_errors']}"  
+        )  
+  
+        # Results are rendered one by one as the search pager yields them; further pages are  
+        # fetched on demand from the last page's cursor, without regenerating the query.  
+        st.subheader("Search Results")  
+        if st.session_state.get("results_query") != query_json:  
+            st.session_state.results_query = query_json  
+            st.session_state.result_rows = []  
+            st.session_state.next_cursor = None  
+            st.session_state.load_more = True  
+        rows = st.session_state.result_rows  
+        for idx, res in enumerate(rows):  
+            show_result(idx, res)  
+        if st.session_state.get("load_more"):  
+            st.session_state.load_more = False  
+            cursor = Cursor.decode(st.session_state.next_cursor) if st.session_state.next_cursor else None  
+            page = run_search_query(query_json, cursor)  
+            # One result per thread, also across pages (the page still advances by every row it read)  
+            for res in collapse_threads(page, seen={thread_key(row) for row in rows}):  
+                show_result(len(rows), res)  
+                rows.append(dict(res))  
+            st.session_state.next_cursor = page.next_cursor  
+        plan = st.session_state.last_plan  
+        st.caption(f"Query plan: {plan.name} ({plan.reason}) · {len(rows)} results shown")  
+        if not rows:  
+            st.write("No results found.")  
+        if st.session_state.next_cursor:  
+            st.button("Load more results", on_click=lambda: st.session_state.update(load_more=True))  
   
 # ───────────────────────────── End search_app.py ─────────────────────────────  
\ No newline at end of file
@@ -3,14 +3,25 @@
 # Import required modules  
 import os  
 import json  
+import threading  
 import time  
 import streamlit as st  
 import requests  
 import uuid  
 from azure.cosmos import CosmosClient, PartitionKey  
 from azure.identity import DefaultAzureCredential  
-from openai import AzureOpenAI  
+from openai import APIError, AzureOpenAI  
+from pydantic import BaseModel, Field  
 from dotenv import load_dotenv  
+from utils.embedding_dimensions import embedding_payload, fit_dimensions  
+from utils.metadata_index import MetadataIndex, UnsupportedFilter, is_filter_only  
+from utils.active_store import active_name  
+from utils.cosmos_partitioning import layout_of  
+from utils.result_fields import COSMOS_RESULT_PROJECTION, read_projected  
+from utils.vector_layout import vector_field_of  
+from utils.pagination import Cursor, ResultPage  
+from utils.email_threads import collapse_threads, thread_key  
+from utils.query_planner import FILTER_SCAN, KEYWORD, VECTOR, HYBRID, PlanStats, QueryPlan, plan_query  
   
 # Load environment variables from .env file  
 load_dotenv()  
@@ -21,6 +32,11 @@ azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION")  
 chat_model = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT")  
   
+# Incremental refinement: send only the previous query JSON plus the newest utterance ("full" resends the whole history)  
+query_refinement_mode = os.getenv("QUERY_REFINEMENT_MODE", "incremental")  
+# Fold older requests into a short running summary every N turns (0 disables summarization)  
+query_summary_every_n_turns = int(os.getenv("QUERY_SUMMARY_EVERY_N_TURNS", "5"))  
+  
 # Create the Azure OpenAI client for chat completions  
 chat_completion_client = AzureOpenAI(  
     api_key=azure_openai_key,  
@@ -41,22 +57,38 @@ def get_openai_chat_response(messages):
         print(f"Error getting OpenAI chat response: {e}")  
         return None  
   
+class SearchQuery(BaseModel):  
+    """Typed search query returned by the structured-output query translator."""  
+    search_text: str = Field(description="Free-text search terms extracted from subject, body, and attachments.")  
+    filter: str = Field(description="Cosmos DB SQL filter expression on alias 'c', or an empty string when there are no structured constraints.")  
+  
+@st.cache_resource  
+def get_query_generation_stats():  
+    """  
+    Process-wide query generation counters that survive Streamlit reruns: calls, malformed model  
+    outputs, API / network errors and latency. Sessions run concurrently, so update them under "lock".  
+    """  
+    return {"lock": threading.Lock(), "calls": 0, "malformed": 0, "api_errors": 0,  
+            "total_latency": 0.0, "last_latency": 0.0, "last_first_token_latency": 0.0}  
+  
 def get_current_time():  
     """Return the current time in ISO 8601 format."""  
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())  
   
 # ───────────────────────── Query Generation ─────────────────────────  
-def generate_search_query(conversation_history: list) -> dict:  
+def generate_search_query(conversation_history: list, on_partial=None) -> dict:  
     """  
     Translates the natural language conversation into a JSON object containing two keys:  
     'search_text' and 'filter'. The system prompt instructs OpenAI to output ONLY the JSON.  
+    If given, on_partial is called with the partial JSON text as tokens stream in.  
     """  
     system_prompt = (  
         f"Today is {get_current_time()}. You are an expert query translator for a Cosmos DB vector search engine. "  
         "Convert the conversation of natural language email search queries into a complete query JSON object. "  
         "The JSON object must contain exactly the following keys: 'search_text' and 'filter'.\n\n"  
         "Additional guidelines:\n"  
-        "1. The 'search_text' key should include useful free-text search terms extracted from subject, body, and attachments.\n"  
+        "1. The 'search_text' key should include useful free-text search terms extracted from subject, body, and attachments. "  
+        "Leave it empty when the request only constrains structured fields (sender, recipients, category, importance, dates, size).\n"  
         "2. The 'filter' key should include any structured filter expressions. When filtering on dates, use ISO 8601 format. "  
         "For example, if the user says 'before June 13 2025', output a filter like: c.sent_time < '2025-06-13T00:00:00Z'.\n"  
         "For sender emails or other string properties, use equality with proper quoting.\n"  
@@ -76,27 +108,91 @@ def generate_search_query(conversation_history: list) -> dict:
     )  
   
     messages = [{"role": "system", "content": system_prompt}] + conversation_history  
-    max_attempts = 3  
+    start = time.perf_counter()  
+    first_token_latency = None  
+    failure = None  
+    try:  
+        # Schema-constrained output: the model can only answer with a SearchQuery, so no parse/retry loop is needed.  
+        # The response is streamed so the UI can show the query while it is still being written.  
+        with chat_completion_client.beta.chat.completions.stream(  
+            model=chat_model,  
+            messages=messages,  
+            max_tokens=500,  
+            response_format=SearchQuery,  
+        ) as stream:  
+            for event in stream:  
+                if event.type == "content.delta":  
+                    if first_token_latency is None:  
+                        first_token_latency = time.perf_counter() - start  
+                    if on_partial is not None:  
+                        on_partial(event.snapshot)  
+            parsed = stream.get_final_completion().choices[0].message.parsed  
+        if parsed is None:  
+            failure = "malformed"  # refusal  
+    except APIError as e:  
+        # Connection, timeout and HTTP errors say nothing about the model's output  
+        print(f"Error calling OpenAI for the structured query: {e}")  
+        parsed, failure = None, "api_errors"  
+    except Exception as e:  
+        # Truncated, filtered or schema-violating output  
+        print(f"Error getting structured query from OpenAI: {e}")  
+        parsed, failure = None, "malformed"  
+    latency = time.perf_counter() - start  
+    stats = get_query_generation_stats()  
+    with stats["lock"]:  
+        stats["calls"] += 1  
+        stats["total_latency"] += latency  
+        stats["last_latency"] = latency  
+        stats["last_first_token_latency"] = first_token_latency or latency  
+        if failure:  
+            stats[failure] += 1  
+        summary = f"malformed outputs: {stats['malformed']}/{stats['calls']}, API errors: {stats['api_errors']}"  
+    print(f"Query generation took {latency:.2f}s, first token after {first_token_latency or latency:.2f}s ({summary})")  
   
-    for attempt in range(max_attempts):  
-        reply = get_openai_chat_response(messages)  
-        if not reply:  
-            error_msg = "No response obtained from OpenAI."  
-        else:  
-            try:  
-                query_json = json.loads(reply)  
-                if "search_text" in query_json and "filter" in query_json:  
-                    return query_json  
-                else:  
-                    error_msg = "The JSON is missing required keys 'search_text' or 'filter'."  
-            except Exception as e:  
-                error_msg = f"JSON parse error: {str(e)}. Full response was: {reply}"  
+    return parsed.model_dump() if parsed else None  
+  
+def build_refinement_messages(previous_query: dict, new_utterance: str, summary: str = "") -> list:  
+    """Constant-size refinement prompt: the current query JSON, an optional session summary and only the newest utterance."""  
+    content = ""  
+    if summary:  
+        content += f"Summary of earlier requests in this session: {summary}\n"  
+    content += f"Current query JSON: {json.dumps(previous_query)}\n"  
+    content += f"New request: {new_utterance}\n"  
+    content += "Merge the new request into the current query and return the complete updated query."  
+    return [{"role": "user", "content": content}]  
   
-        messages.append({"role": "assistant", "content": reply if reply else ""})  
-        messages.append({"role": "user", "content": f"Error: {error_msg} Please provide a valid JSON object with only the keys 'search_text' and 'filter'."})  
-        time.sleep(1)  
+def summarize_requests(summary: str, requests_to_fold: list):  
+    """Fold a batch of user requests into the running session summary."""  
+    messages = [  
+        {"role": "system", "content": "Maintain a one-paragraph summary (under 80 words) of what the user is searching for. Return only the updated summary."},  
+        {"role": "user", "content": f"Current summary: {summary or '(none)'}\nNew requests:\n" + "\n".join(f"- {r}" for r in requests_to_fold)},  
+    ]  
+    return get_openai_chat_response(messages) or summary  
   
-    return None  
+def update_search_query(conversation_history: list, on_partial=None):  
+    """  
+    Produce the query for the newest utterance. In incremental mode the LLM only sees the previous query_json  
+    (plus an optional summary) and the newest utterance, so per-turn tokens stay roughly constant.  
+    """  
+    previous_query = st.session_state.query_json  
+    new_utterance = conversation_history[-1]["content"]  
+    incremental = query_refinement_mode == "incremental" and previous_query is not None  
+    if incremental:  
+        messages = build_refinement_messages(previous_query, new_utterance, st.session_state.query_summary)  
+    else:  
+        messages = conversation_history  
+  
+    query_json = generate_search_query(messages, on_partial=on_partial)  
+    if query_json is None:  
+        return None  
+    st.session_state.query_json = query_json  
+  
+    if query_refinement_mode == "incremental" and query_summary_every_n_turns > 0:  
+        st.session_state.pending_requests.append(new_utterance)  
+        if len(st.session_state.pending_requests) >= query_summary_every_n_turns:  
+            st.session_state.query_summary = summarize_requests(st.session_state.query_summary, st.session_state.pending_requests)  
+            st.session_state.pending_requests = []  
+    return query_json  
   
 # ───────────────────────── Cosmos DB Configuration ─────────────────────────  
 cosmos_uri = os.getenv("COSMOS_URI", "https://<your-account>.documents.azure.com:443/")  
@@ -115,60 +211,142 @@ os.environ["AZURE_TENANT_ID"] = aad_tenant_id
 credential = DefaultAzureCredential()  
 cosmos_client = CosmosClient(cosmos_uri, credential=credential)  
 cosmos_db_client = cosmos_client.get_database_client(cosmos_db_name)  
-cosmos_container_client = cosmos_db_client.get_container_client(container_name)  
+  
+def get_container():  
+    """Client for the live container: the active-store pointer flipped by utils/reindex.py, else COSMOS_CONTAINER_NAME."""  
+    return cosmos_db_client.get_container_client(active_name("cosmos", container_name))  
+  
+@st.cache_resource  
+def get_metadata_index():  
+    """Local metadata index (see utils/metadata_index.py) used for filter-only queries, counts and facets."""  
+    return MetadataIndex()  
   
 # ───────────────────────── Embedding Function ─────────────────────────  
+@st.cache_data(max_entries=256, show_spinner=False)  
 def get_embedding(text):  
     """  
     Compute an embedding for the input text using Azure OpenAI.  
     Adjust the deployment name (AZURE_OPENAI_EMB_DEPLOYMENT) in your environment variables.  
+    Cached, so later result pages of the same search reuse the query embedding.  
     """  
     emb_deployment = os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT")  
     url = f"{azure_openai_endpoint}/openai/deployments/{emb_deployment}/embeddings?api-version={azure_openai_api_version}"  
     headers = {"Content-Type": "application/json", "api-key": azure_openai_key}  
-    response = requests.post(url, headers=headers, json={"input": text})  
+    # Reduced dimensions (AZURE_OPENAI_EMB_DIMENSIONS) must match the container's vector policy  
+    response = requests.post(url, headers=headers, json=embedding_payload(text))  
     response.raise_for_status()  
-    return response.json()["data"][0]["embedding"]  
+    return fit_dimensions(response.json()["data"][0]["embedding"])  
   
 # ───────────────────────── Query Execution ─────────────────────────  
-def run_search_query(query_json: dict):  
+@st.cache_resource  
+def get_plan_stats():  
+    """Per-plan latency/cost counters (also logged to PLANNER_LOG_PATH) that survive Streamlit reruns."""  
+    return PlanStats()  
+  
+# Results per page; more are fetched on demand with the page's continuation cursor  
+results_page_size = int(os.getenv("SEARCH_PAGE_SIZE", "20"))  
+  
+def last_request_charge():  
+    """RU charge reported by Cosmos DB for the most recent request (page)."""  
+    return float(cosmos_client.client_connection.last_response_headers.get("x-ms-request-charge", 0))  
+  
+def run_search_query(query_json: dict, cursor: Cursor = None):  
     """  
-    Execute a Cosmos DB vector search query.  
-    The query uses vector similarity on the 'bodyVector' field and full-text scoring on the 'body' field.  
+    Execute one page of a Cosmos DB query for the generated JSON. The planner picks the cheapest  
+    adequate execution: a filter scan (metadata index when available), full-text only, vector only,  
+    or RRF over vector similarity (on 'bodyVector', or the fused 'contentVector' when the container has  
+    one) and full-text scoring on 'body'. Partition keys  
+    implied by the filter route the query to the matching partitions only.  
+    With a cursor (from a previous page) the same query and plan continue where that page ended.  
     """  
-    search_text = query_json.get("search_text", "")  
-    filter_str = query_json.get("filter", "")
+    if cursor is None:  
+        # Cosmos DB has no semantic reranker; requests that would use it run as plain hybrid  
+        plan = plan_query(query_json, supported=(FILTER_SCAN, KEYWORD, VECTOR, HYBRID))  
+        cursor = Cursor(plan.search_text, plan.filter, plan.name)  
+    else:  
+        plan = QueryPlan(cursor.plan, f"page from offset {cursor.offset}", cursor.search_text, cursor.filter)  
+    search_text = plan.search_text  
+    filter_str = plan.filter  
+    st.session_state.last_plan = plan  
     print(f"Filter string: {filter_str}")
-  
-    # Get embedding for the search text  
-    search_embedding = get_embedding(search_text)  
-    embedding_literal = "[" + ",".join(str(x) for x in search_embedding) + "]"  
+    stats = get_plan_stats()  
+    container = get_container()  
+    layout = layout_of(container)  
+
+    # No semantic component: answer from the local metadata index and fetch only the hits' result fields
+    if plan.name == FILTER_SCAN and filter_str and cursor.continuation is None:  
+        index = get_metadata_index()  
+        try:  
+            # Rows may be missing or stale unless the index was built from the live container  
+            if index.covers(container.id):  
+                matches = index.search(filter_str, limit=results_page_size, offset=cursor.offset)  
+                print(f"Filter-only query answered by the metadata index ({len(matches)} matches)")  
+                items = read_projected(container, layout, matches)  
+                timed = stats.timed("cosmos+metadata_index", plan, items, request_charge=last_request_charge)  
+                return ResultPage(timed, results_page_size, cursor.next)  
+        except UnsupportedFilter as e:  
+            print(f"Metadata index cannot evaluate the filter, using Cosmos DB: {e}")  
   
     # Escape single quotes in search_text for SQL safety  
     safe_search_text = search_text.replace("'", "\\'")  
   
-    # Build WHERE clause if a filter is provided  
-    where_clause = f"WHERE {filter_str}" if filter_str else ""  
+    # Build WHERE clause if a filter is provided, plus the partition key predicate it implies  
+    route = layout.route(filter_str)  
+    where_clause = route.where(filter_str)  
+  
+    if plan.name == FILTER_SCAN:  
+        order_by = "ORDER BY c.sent_time DESC"  
+    elif plan.name == KEYWORD:  
+        order_by = f"ORDER BY RANK FullTextScore(c.body, '{safe_search_text}')"  
+    else:  
+        # Get embedding for the search text (cached across pages)  
+        search_embedding = get_embedding(search_text)  
+        embedding_literal = "[" + ",".join(str(x) for x in search_embedding) + "]"  
+        vector_field = vector_field_of(container)  
+        if plan.name == VECTOR:  
+            order_by = f"ORDER BY VectorDistance(c.{vector_field}, {embedding_literal})"  
+        else:  # HYBRID  
+            order_by = f"""ORDER BY RANK RRF(  
+        VectorDistance(c.{vector_field}, {embedding_literal}),  
+        FullTextScore(c.body, '{safe_search_text}')  
+    )"""  
+    # Ranked queries page with OFFSET/LIMIT; the filter scan resumes from Cosmos DB's continuation token  
+    # (unless earlier pages came from the metadata index, which pages by offset)  
+    native_paging = plan.name == FILTER_SCAN and (cursor.continuation is not None or cursor.offset == 0)  
+    page_clause = "" if native_paging else f"OFFSET {cursor.offset} LIMIT {results_page_size}"  
   
     # Build the query string  
     query_string = f"""  
-    SELECT TOP 20 c.id, c["from"], c.subject, c.sent_time, c.body  
+    SELECT {COSMOS_RESULT_PROJECTION}  
     FROM c  
     {where_clause}  
-    ORDER BY RANK RRF(  
-        VectorDistance(c.bodyVector, {embedding_literal}),  
-        FullTextScore(c.body, '{safe_search_text}')  
-    )  
+    {order_by}  
+    {page_clause}  
     """  
     query_string= query_string.replace('c.from', 'c["from"]')  #Add escape from keyword
-    print("Executing Cosmos DB Query:")  
+    print(f"Executing Cosmos DB Query ({plan.name}: {plan.reason}; {layout.strategy} layout, {route.description}):")  
     print(query_string)  
   
-    items = list(cosmos_container_client.query_items(  
+    # Return the lazy page iterator (timed per plan) so the UI can render items as they arrive  
+    pager = container.query_items(  
         query=query_string,  
-        enable_cross_partition_query=True  
-    ))  
-    return items  
+        max_item_count=results_page_size,  
+        **route.query_kwargs()  
+    ).by_page(cursor.continuation)  
+    items = next(pager, [])  
+    timed = stats.timed("cosmos", plan, items, request_charge=last_request_charge)  
+    if native_paging:  
+        return ResultPage(timed, results_page_size, lambda count: cursor.next(count, pager.continuation_token) if pager.continuation_token else None)  
+    return ResultPage(timed, results_page_size, cursor.next)  
+  
+def show_result(idx, res):  
+    """Render one search result (the fields selected by RESULT_FIELDS / COSMOS_RESULT_PROJECTION)."""  
+    st.markdown(f"**Result {idx+1}:**")  
+    st.write(f"**From:** {res.get('from', 'N/A')}")  
+    st.write(f"**Subject:** {res.get('subject', 'N/A')}")  
+    st.write(f"**Sent Time:** {res.get('sent_time', 'N/A')}")  
+    st.write(f"**Body Preview:** {res.get('body_preview') or ''}")  
+    st.markdown("---")  
   
 # ───────────────────────── Streamlit UI ─────────────────────────  
 st.set_page_config(page_title="Intelligent Email Search (Cosmos DB)", layout="wide")  
@@ -183,6 +361,10 @@ st.markdown(
 # Initialize conversation history in session state if not already present  
 if "conversation_history" not in st.session_state:  
     st.session_state.conversation_history = []  
+if "query_json" not in st.session_state:  
+    st.session_state.query_json = None  
+    st.session_state.query_summary = ""  
+    st.session_state.pending_requests = []  
   
 # Use a Streamlit form so that input text clears after submission  
 with st.form("query_form", clear_on_submit=True):  
@@ -199,32 +381,72 @@ if submitted and new_query:
   
 if clear_history:  
     st.session_state.conversation_history = []  
+    st.session_state.query_json = None  
+    st.session_state.query_summary = ""  
+    st.session_state.pending_requests = []  
     st.success("Conversation history cleared!")  
   
 # Display recent conversation messages  
 if st.session_state.conversation_history:  
     st.info("Generating complete Cosmos DB query using conversation history…")  
+    partial_query = st.empty()  
     with st.spinner("Calling OpenAI to generate the query…"):  
-        query_json = generate_search_query(st.session_state.conversation_history)  
-        if query_json is None:  
-            st.error("Unable to generate a valid search query. Please try again.")  
+        if (submitted and new_query) or st.session_state.query_json is None:  
+            query_json = update_search_query(  
+                st.session_state.conversation_history,  
+                on_partial=lambda snapshot: partial_query.code(snapshot, language="json"),  
+            )  
         else:  
-            st.markdown("Generated Cosmos DB Search Query:")  
-            st.json(query_json)  
-            with st.spinner("Running query against Cosmos DB…"):  
-                results_list = run_search_query(query_json)  
-                time.sleep(0.5)  
-  
-                st.subheader("Search Results")  
-                if not results_list:  
-                    st.write("No results found.")  
-                else:  
-                    for idx, res in enumerate(results_list):  
-                        st.markdown(f"**Result {idx+1}:**")  
-                        st.write(f"**From:** {res.get('from', 'N/A')}")  
-                        st.write(f"**Subject:** {res.get('subject', 'N/A')}")  
-                        st.write(f"**Sent Time:** {res.get('sent_time', 'N/A')}")  
-                        body_text = res.get("body", "")  
-                        body_preview = body_text[:200] + ("..." if len(body_text) > 200 else "")  
-                        st.write(f"**Body Preview:** {body_preview}")  
-                        st.markdown("---")  
\ No newline at end of file
+            query_json = st.session_state.query_json  
+    partial_query.empty()  
+    if query_json is None:  
+        st.error("Unable to generate a valid search query. Please try again.")  
+    else:  
+        st.markdown("Generated Cosmos DB Search Query:")  
+        st.json(query_json)  
+        stats = get_query_generation_stats()  
+        with stats["lock"]:  
+            stats = dict(stats)  
+        st.caption(  
+            f"Query generated in {stats['last_latency']:.2f}s (first token {stats['last_first_token_latency']:.2f}s) · "  
+            f"malformed outputs: {stats['malformed']}/{stats['calls']} · API errors: {stats['api_errors']}"  
+        )  
+  
+        # Results are rendered one by one as the Cosmos DB query iterator yields them; further pages are  
+        # fetched on demand from the last page's cursor, without regenerating the query.  
+        st.subheader("Search Results")  
+        if st.session_state.get("results_query") != query_json:  
+            st.session_state.results_query = query_json  
+            st.session_state.result_rows = []  
+            st.session_state.next_cursor = None  
+            st.session_state.load_more = True  
+        rows = st.session_state.result_rows  
+        for idx, res in enumerate(rows):  
+            show_result(idx, res)  
+        if st.session_state.get("load_more"):  
+            st.session_state.load_more = False  
+            cursor = Cursor.decode(st.session_state.next_cursor) if st.session_state.next_cursor else None  
+            page = run_search_query(query_json, cursor)  
+            # One result per thread, also across pages (the page still advances by every row it read)  
+            for res in collapse_threads(page, seen={thread_key(row) for row in rows}):  
+                show_result(len(rows), res)  
+                rows.append(dict(res))  
+            st.session_state.next_cursor = page.next_cursor  
+        plan = st.session_state.last_plan  
+        st.caption(f"Query plan: {plan.name} ({plan.reason}) · {len(rows)} results shown")  
+        if not rows:  
+            st.write("No results found.")  
+        if st.session_state.next_cursor:  
+            st.button("Load more results", on_click=lambda: st.session_state.update(load_more=True))  
+  
+        # Counts and facets over all matches come straight from the metadata index  
+        index = get_metadata_index()  
+        if is_filter_only(query_json) and index.covers(get_container().id):  
+            try:  
+                with st.expander(f"All matching emails: {index.count(query_json['filter'])}"):  
+                    st.write("**Top senders:**")  
+                    st.table([{"from": value, "emails": n} for value, n in index.facet("from", query_json["filter"])])  
+                    st.write("**Emails per day:**")  
+                    st.bar_chart({day: n for day, n in index.histogram(query_json["filter"], "day")})  
+            except UnsupportedFilter:  
+                pass  
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""
+Admission control for agent runs.
+
+One agent run can launch browser renders and a dozen LLM calls, so the
+backend must not start more of them than the host and the model deployment
+can carry. At most `max_concurrent` runs execute at once, at most
+`max_queue` more wait for a slot (for up to `queue_timeout` seconds), and
+everything beyond that is rejected immediately with `Overloaded`, which
+carries a retry hint derived from the recent average run time.
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+
+class Overloaded(Exception):
+    """No run slot is available; retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Parameters
+    ----------
+    max_concurrent : int
+        Max. number of agent runs executing at once.
+    max_queue : int
+        Max. number of requests waiting for a slot; further requests are rejected.
+    queue_timeout : float
+        Seconds a request may wait for a slot before it is rejected.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 16, queue_timeout: float = 30.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.avg_run_seconds = 30.0  # moving average, seeded with a typical multi-step run
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """Hold a run slot for the duration of the block, or raise `Overloaded`."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded("Server is at capacity", self.retry_after())
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise Overloaded("Timed out waiting for a free slot", self.retry_after()) from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.running += 1
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+            self.avg_run_seconds = 0.8 * self.avg_run_seconds + 0.2 * (time.monotonic() - started)
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue is expected to have drained by one slot."""
+        rounds = (self.waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(rounds * self.avg_run_seconds))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_run_seconds": round(self.avg_run_seconds, 2),
+        }
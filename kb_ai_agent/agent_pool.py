@@ -0,0 +1,145 @@
+"""
+Session-keyed pool of live `loop_agent.Agent` instances.
+
+Building an Agent means building an AssistantAgent, a RoundRobinGroupChat and
+reloading the saved team state. The pool keeps that work out of the request
+path: every pooled agent shares ONE model client (one HTTP connection pool),
+sessions are evicted LRU-first or after being idle too long, and a per-session
+lock stops two concurrent requests from running the same team at once.
+Evicted sessions are not lost – their state lives in the session store and is
+reloaded the next time the session is used. The idle sweep also purges expired
+entries from the session store, at most once per `purge_interval`.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
+
+from loop_agent import Agent, create_model_client
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class AgentPool:
+    """
+    Parameters
+    ----------
+    state_store : dict-like
+        The session store handed to every Agent.
+    max_sessions : int
+        Max. number of live agents; the least recently used one is evicted beyond that.
+    idle_ttl : float
+        Seconds after which an unused agent is evicted.
+    purge_interval : float
+        Min. seconds between two purges of expired session store entries.
+    """
+
+    def __init__(self, state_store: Dict[str, Any], max_sessions: int = 100, idle_ttl: float = 1800.0,
+                 purge_interval: float = 300.0):
+        self.state_store = state_store
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.purge_interval = purge_interval
+        self._last_purge = time.monotonic()
+        self.model_client = create_model_client()
+
+        self._agents: "OrderedDict[str, Agent]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._queued: Dict[str, int] = {}
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    @asynccontextmanager
+    async def acquire(self, session_id: str) -> AsyncIterator[Agent]:
+        """Yield the session's agent while holding the session lock."""
+        async with self.lock(session_id):
+            agent = self._get_or_create(session_id)
+            try:
+                yield agent
+            finally:
+                self._last_used[session_id] = time.monotonic()
+
+    @asynccontextmanager
+    async def lock(self, session_id: str) -> AsyncIterator[None]:
+        """Hold the session lock without building an agent (e.g. to update the stored history)."""
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        self._queued[session_id] = self._queued.get(session_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._queued[session_id] -= 1
+            if not self._queued[session_id]:
+                del self._queued[session_id]
+
+    def queued(self, session_id: str) -> int:
+        """Requests of a session currently running or waiting for its lock."""
+        return self._queued.get(session_id, 0)
+
+    def evict(self, session_id: str) -> None:
+        """Drop the live agent for a session (e.g. after the session was reset)."""
+        if self._agents.pop(session_id, None) is not None:
+            self.evicted += 1
+        self._last_used.pop(session_id, None)
+        lock = self._locks.get(session_id)
+        if lock is not None and not lock.locked():
+            del self._locks[session_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "live_agents": len(self._agents),
+            "created": self.created,
+            "reused": self.reused,
+            "evicted": self.evicted,
+        }
+
+    async def close(self) -> None:
+        self._agents.clear()
+        await self.model_client.close()
+
+    # ------------- internals ------------------
+    def _get_or_create(self, session_id: str) -> Agent:
+        self._evict_idle()
+        agent = self._agents.get(session_id)
+        if agent is not None:
+            self._agents.move_to_end(session_id)
+            self.reused += 1
+            return agent
+
+        agent = Agent(self.state_store, session_id, model_client=self.model_client)
+        self._agents[session_id] = agent
+        self.created += 1
+        self._evict_lru()
+        return agent
+
+    def _busy(self, session_id: str) -> bool:
+        lock = self._locks.get(session_id)
+        return lock is not None and lock.locked()
+
+    def _evict_idle(self) -> None:
+        now = time.monotonic()
+        for session_id, last_used in list(self._last_used.items()):
+            if now - last_used > self.idle_ttl and not self._busy(session_id):
+                logger.info(f"Evicting idle agent for session {session_id}")
+                self.evict(session_id)
+        # Expired sessions that are never read again would otherwise stay in the store for good
+        purge = getattr(self.state_store, "purge_expired", None)
+        if purge is not None and now - self._last_purge > self.purge_interval:
+            self._last_purge = now
+            purge()
+
+    def _evict_lru(self) -> None:
+        # Oldest first; sessions with a request in flight are skipped
+        for session_id in list(self._agents):
+            if len(self._agents) <= self.max_sessions:
+                break
+            if not self._busy(session_id):
+                logger.info(f"Evicting least recently used agent for session {session_id}")
+                self.evict(session_id)
@@ -0,0 +1,169 @@
+"""
+Semantic answer cache for the research agent.
+
+Many sessions open with essentially the same product question, and each
+one would otherwise trigger a full multi-search / multi-fetch / multi-LLM
+research loop. Final answers are stored together with the embedding of the
+question and the veeam.com sources they were built from (URL + fetch time).
+A new question whose embedding is at least `threshold` cosine-similar to a
+stored one is answered from the cache – but only while every source of that
+answer is younger than `max_age`; otherwise it falls through to the agent,
+whose fresh answer then replaces the stale entry.
+
+Entries live in SQLite (WAL) so all workers share them; each worker keeps
+the normalized embeddings in memory and picks up new rows incrementally.
+Lookups scan every stored embedding and write to SQLite, so async callers
+use match_async / put_async, which run them off the event loop.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import sqlite3
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    sources: List[Dict[str, Any]]  # [{"url": ..., "fetched_at": ...}]
+    similarity: float
+
+    def is_fresh(self, max_age: float) -> bool:
+        return all(time.time() - s["fetched_at"] < max_age for s in self.sources)
+
+
+def _normalize(vector: List[float]) -> array:
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return array("f", (v / norm for v in vector))
+
+
+class AnswerCache:
+    """
+    Parameters
+    ----------
+    path : str
+        SQLite file holding the cache.
+    embed : async callable
+        Returns the embedding of a text.
+    threshold : float
+        Min. cosine similarity for two questions to count as the same.
+    max_age : float
+        Seconds an answer's sources stay fresh.
+    max_entries : int
+        Max. number of stored answers; the oldest are dropped beyond it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embed: Callable[[str], Awaitable[List[float]]],
+        threshold: float = 0.92,
+        max_age: float = 24 * 3600,
+        max_entries: int = 2000,
+    ):
+        self.path = path
+        self.embed = embed
+        self.threshold = threshold
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY AUTOINCREMENT, question TEXT NOT NULL, "
+            "embedding BLOB NOT NULL, answer TEXT NOT NULL, sources TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        # id -> normalized embedding; rows written by other workers are loaded on the next lookup
+        self._vectors: Dict[int, array] = {}
+        self._last_id = 0
+
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+
+    def match(self, embedding: List[float]) -> Optional[CachedAnswer]:
+        """Most similar stored answer above the threshold (fresh or not), or None."""
+        query = _normalize(embedding)
+        with self._lock:
+            self._sync()
+            best_id, best = None, self.threshold
+            for row_id, vector in self._vectors.items():
+                similarity = sum(map(float.__mul__, query, vector))
+                if similarity >= best:
+                    best_id, best = row_id, similarity
+            if best_id is None:
+                return None
+            row = self._db.execute(
+                "SELECT question, answer, sources FROM answers WHERE id = ?", (best_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return CachedAnswer(row[0], row[1], json.loads(row[2]), best)
+
+    async def match_async(self, embedding: List[float]) -> Optional[CachedAnswer]:
+        return await asyncio.to_thread(self.match, embedding)
+
+    def put(self, question: str, embedding: List[float], answer: str, sources: List[Dict[str, Any]]) -> None:
+        vector = _normalize(embedding)
+        with self._lock:
+            # A fresh answer supersedes the (stale) entries it is a near duplicate of
+            self._sync()
+            for row_id, stored in list(self._vectors.items()):
+                if sum(map(float.__mul__, vector, stored)) >= self.threshold:
+                    self._db.execute("DELETE FROM answers WHERE id = ?", (row_id,))
+                    del self._vectors[row_id]
+            self._db.execute(
+                "INSERT INTO answers (question, embedding, answer, sources, created_at) VALUES (?, ?, ?, ?, ?)",
+                (question, vector.tobytes(), answer, json.dumps(sources), time.time()),
+            )
+            for (row_id,) in self._db.execute(
+                "SELECT id FROM answers ORDER BY id DESC LIMIT -1 OFFSET ?", (self.max_entries,)
+            ).fetchall():
+                self._db.execute("DELETE FROM answers WHERE id = ?", (row_id,))
+                self._vectors.pop(row_id, None)
+            self._sync()
+
+    async def put_async(self, question: str, embedding: List[float], answer: str,
+                        sources: List[Dict[str, Any]]) -> None:
+        await asyncio.to_thread(self.put, question, embedding, answer, sources)
+
+    # ------------- metrics ------------------
+    def record(self, outcome: str) -> None:
+        """Count a lookup outcome: 'hit', 'stale' or 'miss'."""
+        if outcome == "hit":
+            self.hits += 1
+        elif outcome == "stale":
+            self.stale += 1
+        else:
+            self.misses += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale + self.misses
+        return {
+            "entries": len(self._vectors),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "stale": self.stale,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _sync(self) -> None:
+        for row_id, blob in self._db.execute(
+            "SELECT id, embedding FROM answers WHERE id > ? ORDER BY id", (self._last_id,)
+        ).fetchall():
+            vector = array("f")
+            vector.frombytes(blob)
+            self._vectors[row_id] = vector
+            self._last_id = row_id
+        # Drop rows other workers deleted (superseded / trimmed)
+        if len(self._vectors) > self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]:
+            live = {row_id for (row_id,) in self._db.execute("SELECT id FROM answers").fetchall()}
+            self._vectors = {k: v for k, v in self._vectors.items() if k in live}
@@ -1,21 +1,67 @@
 import asyncio  
+import json
+import zlib
 import uvicorn  
-from fastapi import FastAPI, Request  
+from contextlib import AsyncExitStack
+from fastapi import FastAPI, Header, HTTPException, Request, Response  
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel  
 import pickle  
 import os
-from typing import List, Dict  
+from typing import List, Dict, Optional, Tuple  
 from dotenv import load_dotenv
 import importlib
 load_dotenv()  # Load environment variables from .env file if needed
 import sys
 from pathlib import Path
 # Add parent directory (contoso_internet) to the python path  
-from loop_agent import Agent
+from admission import AdmissionController, Overloaded
+from agent_pool import AgentPool
+from answer_cache import AnswerCache
+from loop_agent import (
+    BROWSER_POOL,
+    PAGE_CACHE,
+    PASSAGE_EXTRACTOR,
+    SEARCH_CACHE,
+    answer_sources,
+    embed_text,
+    get_http_client,
+    logger,
+)
+from session_store import SessionStore
 
 
-# In-memory session store (use Redis/DB for production)  
-SESSION_STORE = {}  
+# Size/TTL-bounded session store; set SESSION_STORE_SQLITE_PATH to spill to disk and share it across workers  
+# (memory only, sessions evicted beyond SESSION_STORE_MAX_BYTES are lost)  
+SESSION_STORE = SessionStore(  
+    max_bytes=int(os.getenv("SESSION_STORE_MAX_BYTES", str(64 * 1024 * 1024))),  
+    ttl=float(os.getenv("SESSION_STORE_TTL", str(24 * 3600))),  
+    sqlite_path=os.getenv("SESSION_STORE_SQLITE_PATH"),  
+)  
+# Live agents keyed by session, all sharing one model client  
+AGENT_POOL = AgentPool(  
+    SESSION_STORE,  
+    max_sessions=int(os.getenv("AGENT_POOL_MAX_SESSIONS", "100")),  
+    idle_ttl=float(os.getenv("AGENT_POOL_IDLE_TTL", "1800")),  
+    purge_interval=float(os.getenv("SESSION_STORE_PURGE_INTERVAL", "300")),  
+)  
+# Global cap on concurrent agent runs with a bounded wait queue; beyond it requests get a 429  
+ADMISSION = AdmissionController(  
+    max_concurrent=int(os.getenv("CHAT_MAX_CONCURRENT", "4")),  
+    max_queue=int(os.getenv("CHAT_MAX_QUEUE", "16")),  
+    queue_timeout=float(os.getenv("CHAT_QUEUE_TIMEOUT", "30")),  
+)  
+# Answers to opening questions, reused for near-duplicate questions while their sources are fresh  
+# (needs an embedding deployment; disabled without one)  
+ANSWER_CACHE = AnswerCache(  
+    os.getenv("ANSWER_CACHE_PATH", "answer_cache.sqlite"),  
+    embed=embed_text,  
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92")),  
+    max_age=float(os.getenv("ANSWER_CACHE_MAX_AGE", str(PAGE_CACHE.max_age))),  
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000")),  
+) if os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT") else None  
+# Requests of one session run one after another; at most this many may be running/waiting at once  
+SESSION_MAX_QUEUED = int(os.getenv("SESSION_MAX_QUEUED", "2"))  
   
 app = FastAPI()  
   
@@ -29,29 +75,200 @@ class ChatResponse(BaseModel):
 class ConversationHistoryResponse(BaseModel):  
     session_id: str  
     history: List[Dict[str, str]]  
+    # Index of history[0] in the full conversation, total length, and whether the  
+    # client's copy was stale (e.g. the session was reset) so this is the full history  
+    start: int = 0  
+    total: int = 0  
+    reset: bool = False  
 class SessionResetRequest(BaseModel):  
     session_id: str  
+
+class ReleasingStreamingResponse(StreamingResponse):  
+    """  
+    Streaming response that closes `stack` (session lock, run slot) once it is done  
+    sending, however that ends: a generator that never started (client gone before  
+    the first chunk), a disconnect or a cancelled request would otherwise keep both.  
+    """  
+    def __init__(self, content, stack: AsyncExitStack, **kwargs):  
+        super().__init__(content, **kwargs)  
+        self.stack = stack  
+
+    async def __call__(self, scope, receive, send):  
+        try:  
+            await super().__call__(scope, receive, send)  
+        finally:  
+            await self.stack.aclose()  
   
+async def admit(session_id: str):  
+    """  
+    Take the session lock, then a global run slot. Returns the agent and the  
+    stack that releases both, or raises a 429 with a Retry-After hint.  
+    """  
+    if AGENT_POOL.queued(session_id) >= SESSION_MAX_QUEUED:  
+        raise HTTPException(  
+            status_code=429,  
+            detail="A request for this session is already in progress",  
+            headers={"Retry-After": str(ADMISSION.retry_after())},  
+        )  
+    stack = AsyncExitStack()  
+    try:  
+        # Waiting for our own session does not hold a global slot  
+        agent = await stack.enter_async_context(AGENT_POOL.acquire(session_id))  
+        await stack.enter_async_context(ADMISSION.admit())  
+    except Overloaded as e:  
+        await stack.aclose()  
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})  
+    except BaseException:  
+        await stack.aclose()  
+        raise  
+    return agent, stack  
+
+async def cached_answer(session_id: str, prompt: str) -> Tuple[Optional[str], Optional[List[float]]]:  
+    """  
+    Answer the opening question of a session from the answer cache. Returns the  
+    answer (None on a miss) and the question embedding, to store the agent's answer  
+    under. Follow-up questions depend on the conversation and are never cached.  
+    """  
+    history_key = f"{session_id}_chat_history"  
+    history = SESSION_STORE.get(history_key, [])  
+    if ANSWER_CACHE is None or history:  
+        return None, None  
+    try:  
+        embedding = await ANSWER_CACHE.embed(prompt)  
+    except Exception as e:  
+        logger.warning(f"Answer cache lookup skipped: {e}")  
+        return None, None  
+    hit = await ANSWER_CACHE.match_async(embedding)  
+    if hit is None:  
+        ANSWER_CACHE.record("miss")  
+        return None, embedding  
+    if not hit.is_fresh(ANSWER_CACHE.max_age):  
+        ANSWER_CACHE.record("stale")  
+        return None, embedding  
+    # Re-check and append under the session lock: a concurrent request of the session may have  
+    # written the history since it was read above (no run slot needed, no agent is run)  
+    async with AGENT_POOL.lock(session_id):  
+        history = SESSION_STORE.get(history_key, [])  
+        if history:  
+            ANSWER_CACHE.record("miss")  
+            return None, None  
+        ANSWER_CACHE.record("hit")  
+        SESSION_STORE[history_key] = history + [  
+            {"role": "user", "content": prompt},  
+            {"role": "assistant", "content": hit.answer},  
+        ]  
+    return hit.answer, embedding  
+
+async def cache_answer(prompt: str, embedding: Optional[List[float]], answer: str) -> None:  
+    if embedding is None:  
+        return  
+    sources = answer_sources(answer)  
+    # Only answers backed by fetched veeam.com pages can be checked for freshness later  
+    if sources:  
+        await ANSWER_CACHE.put_async(prompt, embedding, answer, sources)  
+
 @app.post("/chat", response_model=ChatResponse)  
 async def chat(req: ChatRequest):  
-    # Lookup or create agent for this session  
-    agent = Agent(SESSION_STORE, req.session_id)  
-    # Run chat  
-    answer = await agent.chat_async(req.prompt)  
+    answer, embedding = await cached_answer(req.session_id, req.prompt)  
+    if answer is not None:  
+        return ChatResponse(response=answer)  
+
+    agent, stack = await admit(req.session_id)  
+    async with stack:  
+        # Run chat  
+        answer = await agent.chat_async(req.prompt)  
   
+    await cache_answer(req.prompt, embedding, answer)  
     return ChatResponse(response=answer)  
+
+@app.post("/chat/stream")  
+async def chat_stream(req: ChatRequest):  
+    answer, embedding = await cached_answer(req.session_id, req.prompt)  
+    if answer is not None:  
+        done = json.dumps({"response": answer, "cached": True})  
+        return StreamingResponse(iter([f"event: done\ndata: {done}\n\n"]), media_type="text/event-stream")  
+
+    # Admission happens before the response starts, so an overloaded server still answers 429  
+    agent, stack = await admit(req.session_id)  
+
+    async def events():  
+        try:  
+            async for event in agent.chat_stream(req.prompt):  
+                if event["event"] == "done":  
+                    await cache_answer(req.prompt, embedding, event["data"]["response"])  
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"  
+        except Exception as e:  
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"  
+        finally:  
+            # Release as soon as the run ends, not only once the response is torn down  
+            await stack.aclose()  
+
+    return ReleasingStreamingResponse(  
+        events(),  
+        stack,  
+        media_type="text/event-stream",  
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  
+    )  
 @app.post("/reset_session")
 async def reset_session(req: SessionResetRequest):
     # Reset the session by removing the chat history from SESSION_STORE
+    AGENT_POOL.evict(req.session_id)
     if req.session_id in SESSION_STORE:
         del SESSION_STORE[req.session_id]
     if f"{req.session_id}_chat_history" in SESSION_STORE:
             del SESSION_STORE[f"{req.session_id}_chat_history"]
 
+def history_etag(history: List[Dict[str, str]], length: int) -> str:  
+    """ETag of the first `length` messages: their count plus a checksum of the last one."""  
+    last = json.dumps(history[length - 1], sort_keys=True).encode("utf-8") if length else b""  
+    return f'W/"{length}-{zlib.crc32(last):08x}"'  
+
 @app.get("/history/{session_id}", response_model=ConversationHistoryResponse)  
-async def get_conversation_history(session_id: str):  
+async def get_conversation_history(  
+    session_id: str,  
+    response: Response,  
+    since: int = 0,  
+    if_none_match: Optional[str] = Header(None),  
+):  
+    """  
+    Messages after index `since`. Clients keeping a local copy pass its length as  
+    `since` and its ETag as If-None-Match: an unchanged history costs a bodyless 304,  
+    otherwise only the new messages are sent. A copy that no longer is a prefix of the  
+    stored history (session reset) gets the full history with `reset` set.  
+    """  
     # Retrieve chat history list from SESSION_STORE using the correct key  
     history = SESSION_STORE.get(f"{session_id}_chat_history", [])  
-    return ConversationHistoryResponse(session_id=session_id, history=history)  
+    etag = history_etag(history, len(history))  
+    if if_none_match == etag:  
+        return Response(status_code=304, headers={"ETag": etag})  
+    response.headers["ETag"] = etag  
+
+    reset = since > 0 and (  
+        since > len(history) or (if_none_match is not None and if_none_match != history_etag(history, since))  
+    )  
+    start = 0 if reset else since  
+    return ConversationHistoryResponse(  
+        session_id=session_id, history=history[start:], start=start, total=len(history), reset=reset  
+    )  
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "admission": ADMISSION.stats(),
+        "agent_pool": AGENT_POOL.stats(),
+        "session_store": SESSION_STORE.stats(),
+        "page_cache": PAGE_CACHE.stats(),
+        "browser_pool": BROWSER_POOL.stats(),
+        "passages": PASSAGE_EXTRACTOR.stats(),
+        "search_cache": SEARCH_CACHE.stats(),
+        "answer_cache": ANSWER_CACHE.stats() if ANSWER_CACHE else None,
+    }
+
+@app.on_event("shutdown")
+async def shutdown():
+    await AGENT_POOL.close()
+    BROWSER_POOL.close()
+    await get_http_client().aclose()
+
 if __name__ == "__main__":  
     uvicorn.run(app, host="0.0.0.0", port=7000)  
\ No newline at end of file
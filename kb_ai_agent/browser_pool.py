@@ -0,0 +1,124 @@
+"""
+Pool of warm headless-Chromium contexts for rendering JavaScript-heavy pages.
+
+`r.html.render()` from requests_html launches a fresh Chromium for every
+HTMLSession – seconds of start-up and hundreds of MB of RSS per tool call.
+The pool launches ONE browser (through pyppeteer, the library requests_html
+uses itself) on a private event loop thread and keeps a fixed number of
+incognito contexts warm. The number of contexts is the concurrency cap;
+callers beyond it wait for a free one. After `max_pages` renders the
+browser is closed and relaunched (once idle), which bounds Chromium's
+memory growth.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import pyppeteer
+from requests_html import HTML
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class BrowserPool:
+    """
+    Parameters
+    ----------
+    size : int
+        Number of warm browser contexts = max. concurrent renders.
+    max_pages : int
+        Renders after which the browser is recycled.
+    timeout : float
+        Navigation timeout per page in seconds.
+    """
+
+    def __init__(self, size: int = 2, max_pages: int = 50, timeout: float = 20.0):
+        self.size = size
+        self.max_pages = max_pages
+        self.timeout = timeout
+
+        self._browser = None
+        self._idle_contexts: List[Any] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._launch_lock: Optional[asyncio.Lock] = None
+        self._in_flight = 0
+        self._pages_since_launch = 0
+        self.renders = 0
+        self.launches = 0
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="browser-pool", daemon=True)
+        self._thread.start()
+
+    # ------------- public API (callable from any thread / loop) ------------------
+    def render_text(self, url: str) -> str:
+        """Render `url` in a warm context and return its visible text (blocking)."""
+        return asyncio.run_coroutine_threadsafe(self._render_text(url), self._loop).result()
+
+    async def render_text_async(self, url: str) -> str:
+        """Awaitable variant of `render_text` for callers running on another event loop."""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._render_text(url), self._loop))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "renders": self.renders,
+            "launches": self.launches,
+            "pages_since_launch": self._pages_since_launch,
+        }
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._close_browser(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    # ------------- coroutines on the pool loop ------------------
+    async def _render_text(self, url: str) -> str:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.size)
+            self._launch_lock = asyncio.Lock()
+        async with self._semaphore:
+            await self._ensure_browser()
+            context = self._idle_contexts.pop()
+            self._in_flight += 1
+            page = None
+            try:
+                page = await context.newPage()
+                await page.goto(url, timeout=int(self.timeout * 1000), waitUntil="networkidle2")
+                html = await page.content()
+            finally:
+                if page is not None:
+                    await page.close()
+                self._idle_contexts.append(context)
+                self._in_flight -= 1
+                self._pages_since_launch += 1
+                self.renders += 1
+        # Same visible-text extraction as requests_html's r.html.text
+        return HTML(html=html, url=url).text
+
+    async def _ensure_browser(self) -> None:
+        async with self._launch_lock:
+            # Recycling only happens while no render is in flight; under constant load it is
+            # deferred to the next idle moment rather than blocking callers.
+            due = self._pages_since_launch >= self.max_pages and self._in_flight == 0
+            if self._browser is not None and not due:
+                return
+            if self._browser is not None:
+                logger.info(f"Recycling browser after {self._pages_since_launch} pages")
+                await self._close_browser()
+
+            self._browser = await pyppeteer.launch(
+                headless=True, handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False, args=["--no-sandbox"]
+            )
+            self._idle_contexts = [await self._browser.createIncognitoBrowserContext() for _ in range(self.size)]
+            self._pages_since_launch = 0
+            self.launches += 1
+
+    async def _close_browser(self) -> None:
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+            self._idle_contexts = []
@@ -1,8 +1,9 @@
 import streamlit as st  
-import requests, uuid, os  
+import requests, uuid, os, json  
   
 BASE_BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:7000")  
 CHAT_URL = f"{BASE_BACKEND_URL}/chat"  
+CHAT_STREAM_URL = f"{BASE_BACKEND_URL}/chat/stream"  
 HISTORY_URL = f"{BASE_BACKEND_URL}/history" 
 SESSION_RESET_URL = f"{BASE_BACKEND_URL}/reset_session" 
   
@@ -14,6 +15,8 @@ with st.sidebar:
             SESSION_RESET_URL,  
             json={"session_id": st.session_state["session_id"]},  
         )  
+        st.session_state.pop("history", None)  
+        st.session_state.pop("history_etag", None)  
 
 # ───────────────── Page title ────────────────    
 st.markdown(  
@@ -24,12 +27,23 @@ st.markdown(
 # ───────────── Load or initialize session ────────────────    
 if "session_id" not in st.session_state:  
     st.session_state["session_id"] = str(uuid.uuid4())  
-conversation_history =[] 
-# Fetch existing history from backend  
-response = requests.get(f"{HISTORY_URL}/{st.session_state['session_id']}")  
+if "history" not in st.session_state:  
+    st.session_state["history"] = []  
+    st.session_state["history_etag"] = None  
+conversation_history = st.session_state["history"]  
+# Fetch only the messages added since the local copy was synced (304 when unchanged)  
+headers = {"If-None-Match": st.session_state["history_etag"]} if st.session_state["history_etag"] else {}  
+response = requests.get(  
+    f"{HISTORY_URL}/{st.session_state['session_id']}",  
+    params={"since": len(conversation_history)},  
+    headers=headers,  
+)  
 if response.status_code == 200:  
     history_data = response.json()  
-    conversation_history = history_data.get("history", [])  
+    if history_data.get("reset"):  
+        conversation_history.clear()  
+    conversation_history.extend(history_data.get("history", []))  
+    st.session_state["history_etag"] = response.headers.get("ETag")  
   
 # ───────────────── Chat history ─────────────    
 for msg in conversation_history:  
@@ -42,14 +56,47 @@ if prompt:
     with st.chat_message("user"):  
         st.markdown(prompt)  
   
-    with st.spinner("Assistant is thinking..."):  
-        r = requests.post(  
-            CHAT_URL,  
-            json={"session_id": st.session_state["session_id"], "prompt": prompt},  
-        )  
-        r.raise_for_status()  
-        answer = r.json()["response"]  
+    def sse_events(response):  
+        """Parse a text/event-stream response into (event, data) pairs."""  
+        event, data = "message", []  
+        for line in response.iter_lines(decode_unicode=True):  
+            if line.startswith("event:"):  
+                event = line[len("event:"):].strip()  
+            elif line.startswith("data:"):  
+                data.append(line[len("data:"):].strip())  
+            elif not line and data:  
+                yield event, json.loads("\n".join(data))  
+                event, data = "message", []  
   
+    r = requests.post(  
+        CHAT_STREAM_URL,  
+        json={"session_id": st.session_state["session_id"], "prompt": prompt},  
+        stream=True,  
+    )  
+    if r.status_code == 429:  
+        st.warning(  
+            f"{r.json().get('detail', 'The assistant is busy')} – please retry in "  
+            f"{r.headers.get('Retry-After', 'a few')} seconds."  
+        )  
+        st.stop()  
+    r.raise_for_status()  
   
     with st.chat_message("assistant"):  
-        st.markdown(answer)  
\ No newline at end of file
+        activity = st.status("Assistant is researching...", expanded=False)  
+        answer_box = st.empty()  
+        answer = ""  
+        for event, data in sse_events(r):  
+            if event == "tool_call":  
+                activity.write(f"🔧 `{data['name']}` {data['arguments']}")  
+            elif event == "tool_result":  
+                activity.write(f"{'⚠️' if data['is_error'] else '✅'} `{data['name']}` returned {data['chars']} chars")  
+            elif event == "token":  
+                answer += data["content"]  
+                answer_box.markdown(answer)  
+            elif event == "done":  
+                answer = data["response"]  
+            elif event == "error":  
+                st.error(data["detail"])  
+        activity.update(label="Research complete", state="complete")  
+        # Tokens of intermediate model turns were shown too; settle on the final answer  
+        answer_box.markdown(answer)  
\ No newline at end of file
@@ -2,24 +2,39 @@
 Agent implementation that uses  
  • Autogen agents/teams  
  • A Google Custom Search tool that is HARD‑WIRED to “site:veeam.com …”  
-The agent state (chat history) is still kept in the in‑memory SESSION_STORE  
-dict that the FastAPI backend supplies.  
+The backend keeps live agents in an AgentPool (agent_pool.py) that shares one  
+model client; the agent state (team state and chat history) lives in the  
+SessionStore (session_store.py) the backend supplies – bounded in memory,  
+optionally backed by SQLite – and is reloaded when an evicted session returns.  
 """  
 from __future__ import annotations  
   
 import asyncio  
 import logging  
 import os  
-from typing import Any, Dict, List, Optional  
+from typing import Any, AsyncIterator, Dict, List, Optional  
 from autogen_core import CancellationToken  
-from requests_html import HTMLSession  
+from requests_html import HTML  
 import re
   
 import httpx  
 from dotenv import load_dotenv  
   
+from browser_pool import BrowserPool  
+from page_cache import PageCache  
+from passages import PassageExtractor  
+from search_cache import SearchCache  
+from state_compaction import compact_state  
+  
 # ─────────────────── Autogen imports ────────────────────  
 from autogen_agentchat.agents import AssistantAgent  
+from autogen_agentchat.base import TaskResult  
+from autogen_agentchat.messages import (  
+    ModelClientStreamingChunkEvent,  
+    TextMessage,  
+    ToolCallExecutionEvent,  
+    ToolCallRequestEvent,  
+)  
 from autogen_agentchat.conditions import TextMessageTermination  
 from autogen_agentchat.teams import RoundRobinGroupChat  
 from autogen_ext.models.openai import AzureOpenAIChatCompletionClient  
@@ -29,10 +44,81 @@ load_dotenv()
 logger = logging.getLogger(__name__)  
 logger.setLevel(logging.INFO)  
   
-  
+# Shared on-disk cache of fetched veeam.com pages (all sessions and workers)  
+PAGE_CACHE = PageCache(  
+    os.getenv("PAGE_CACHE_PATH", "page_cache.sqlite"),  
+    max_age=float(os.getenv("PAGE_CACHE_MAX_AGE", str(24 * 3600))),  
+    max_bytes=int(os.getenv("PAGE_CACHE_MAX_BYTES", str(200 * 1024 * 1024))),  
+)  
+  
+  
+# Warm headless Chromium contexts, used only for pages whose static HTML lacks the content  
+BROWSER_POOL = BrowserPool(  
+    size=int(os.getenv("BROWSER_POOL_SIZE", "2")),  
+    max_pages=int(os.getenv("BROWSER_POOL_MAX_PAGES", "50")),  
+)  
+# Static pages with at least this much visible text are used without rendering  
+STATIC_MIN_CHARS = int(os.getenv("STATIC_MIN_CHARS", "1500"))  
+# Only the passages most relevant to the question are handed to the agent  
+PASSAGE_EXTRACTOR = PassageExtractor(token_budget=int(os.getenv("PASSAGE_TOKEN_BUDGET", "1500")))  
+# Persisted team state: tool results longer than this are reduced to a digest,  
+# and the model context is summarized past the token threshold (keeping the last turns)  
+STATE_TOOL_RESULT_MAX_CHARS = int(os.getenv("STATE_TOOL_RESULT_MAX_CHARS", "400"))  
+STATE_SUMMARY_TOKEN_THRESHOLD = int(os.getenv("STATE_SUMMARY_TOKEN_THRESHOLD", "6000"))  
+STATE_KEEP_TURNS = int(os.getenv("STATE_KEEP_TURNS", "2"))  
+# Custom Search results shared by all sessions (saves latency and paid quota)  
+SEARCH_CACHE = SearchCache(  
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", "3600")),  
+    max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1000")),  
+)  
+  
+  
+# ─────────────────── Pooled HTTP client ─────────────────  
+_http_client: Optional[httpx.AsyncClient] = None  
+  
+  
+def get_http_client() -> httpx.AsyncClient:  
+    """One keep‑alive connection pool shared by every tool call (created on first use)."""  
+    global _http_client  
+    if _http_client is None:  
+        _http_client = httpx.AsyncClient(  
+            timeout=20,  
+            follow_redirects=True,  
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),  
+        )  
+    return _http_client  
+  
+  
+# ─────────────────── Answer cache helpers ───────────────  
+async def embed_text(text: str) -> List[float]:  
+    """Embedding of `text` from the Azure OpenAI embedding deployment."""  
+    url = (  
+        f"{os.getenv('AZURE_OPENAI_ENDPOINT')}/openai/deployments/{os.getenv('AZURE_OPENAI_EMB_DEPLOYMENT')}"  
+        f"/embeddings?api-version={os.getenv('AZURE_OPENAI_API_VERSION')}"  
+    )  
+    resp = await get_http_client().post(  
+        url, headers={"api-key": os.getenv("AZURE_OPENAI_API_KEY")}, json={"input": text}  
+    )  
+    resp.raise_for_status()  
+    return resp.json()["data"][0]["embedding"]  
+
+
+def answer_sources(answer: str) -> List[Dict[str, Any]]:  
+    """  
+    veeam.com URLs cited in an answer with the time their content was fetched. Pages only  
+    seen as search snippets have no fetch time and are left out of the freshness check.  
+    """  
+    sources = []  
+    for url in dict.fromkeys(re.findall(r"https?://(?:[\w-]+\.)*veeam\.com[^\s)\]>\"']*", answer)):  
+        url = url.rstrip(".,;:")  
+        fetched_at = PAGE_CACHE.fetched_at(url)  
+        if fetched_at is not None:  
+            sources.append({"url": url, "fetched_at": fetched_at})  
+    return sources  
+
+
 # ─────────────────── Google search tool ─────────────────  
-def veeam_google_search(query: str, num_results: int = 6) -> List[Dict[str, str]]:  
-    print(f"veeam_google_search: {query}")
+async def veeam_google_search(query: str, num_results: int = 6) -> List[Dict[str, str]]:  
     """  
     Search ONLY the veeam.com domain by means of Google Custom Search.  
   
@@ -48,6 +134,7 @@ def veeam_google_search(query: str, num_results: int = 6) -> List[Dict[str, str]
     List[dict]  
         Each list item has keys: title, link, snippet  
     """  
+    print(f"veeam_google_search: {query}")
     api_key = os.getenv("GOOGLE_API_KEY")  
     cse_id = os.getenv("GOOGLE_CSE_ID")  
     if not api_key or not cse_id:  
@@ -55,57 +142,134 @@ def veeam_google_search(query: str, num_results: int = 6) -> List[Dict[str, str]
             "GOOGLE_API_KEY and GOOGLE_CSE_ID env variables must be configured!"  
         )  
   
-    #   Use the Custom Search REST endpoint  
-    url = "https://www.googleapis.com/customsearch/v1"  
-    params = {  
-        "key": api_key,  
-        "cx": cse_id,  
-        "q": f"site:veeam.com {query}",  
-        "num": max(1, min(num_results, 10)),  
-    }  
-  
-    with httpx.Client(timeout=15) as client:  
-        r = client.get(url, params=params)  
+    num_results = max(1, min(num_results, 10))  
+  
+    async def search() -> List[Dict[str, str]]:  
+        #   Use the Custom Search REST endpoint  
+        url = "https://www.googleapis.com/customsearch/v1"  
+        params = {  
+            "key": api_key,  
+            "cx": cse_id,  
+            "q": f"site:veeam.com {query}",  
+            "num": num_results,  
+        }  
+  
+        r = await get_http_client().get(url, params=params, timeout=15)  
         r.raise_for_status()  
         data = r.json()  
   
-    items: list[dict] = data.get("items", [])  
-    results: List[Dict[str, str]] = [  
-        {"title": it["title"], "link": it["link"], "snippet": it.get("snippet", "")}  
-        for it in items  
-    ]  
-    return results  
-def fetch_url_content(url: str, max_chars: int = 28000) -> str:  
-    print(f"fetch_url: {url}")
+        items: list[dict] = data.get("items", [])  
+        return [  
+            {"title": it["title"], "link": it["link"], "snippet": it.get("snippet", "")}  
+            for it in items  
+        ]  
+  
+    # Identical (normalized) queries from any session share one cached / in-flight API call  
+    return await SEARCH_CACHE.get_or_fetch(query, num_results, search)  
+  
+  
+def needs_rendering(static_text: str) -> bool:  
+    """Heuristic: the static HTML is a JS shell if it carries almost no visible text or asks for JavaScript."""  
+    if len(static_text) < STATIC_MIN_CHARS:  
+        return True  
+    return bool(re.search(r"(enable|requires?) javascript", static_text[:2000], re.I))  
+  
+  
+async def get_page_text(url: str) -> str:  
+    """Full visible text of a veeam.com page, served from the page cache where possible."""  
+    if not re.match(r"^https?://([a-z0-9.-]*\.)?veeam\.com", url, re.I):  
+        raise ValueError("fetch_url_content: Only veeam.com domain is allowed")  
+  
+    # Fresh cache entries skip the network entirely; stale ones are revalidated below  
+    cached = PAGE_CACHE.get(url)  
+    if cached and cached.is_fresh(PAGE_CACHE.max_age):  
+        PAGE_CACHE.record("hit")  
+        return cached.text  
+  
+    r = await get_http_client().get(url, headers=cached.conditional_headers() if cached else None)  
+    if r.status_code == 304 and cached:  
+        PAGE_CACHE.mark_revalidated(url)  
+        PAGE_CACHE.record("revalidated")  
+        return cached.text  
+    r.raise_for_status()  
+    PAGE_CACHE.record("miss")  
+  
+    text = HTML(html=r.text, url=url).text  # Visible text of the static HTML  
+    # ⚠️ Some pages may require JS rendering – only those go through the warm browser pool.  
+    if needs_rendering(text):  
+        text = await BROWSER_POOL.render_text_async(url)  
+    PAGE_CACHE.put(url, text, etag=r.headers.get("ETag"), last_modified=r.headers.get("Last-Modified"))  
+    return text  
+  
+  
+async def fetch_url_content(url: str, question: str = "", max_chars: int = 28000) -> str:  
     """  
-    Returns the text content of the given veeam.com URL.  
+    Returns the passages of the given veeam.com URL that are most relevant to the question.  
   
     Parameters  
     ----------  
     url : str  
         Target URL (must be from the veeam.com domain)  
+    question : str  
+        What you are looking for on this page; used to rank the page's passages  
     max_chars : int  
         Maximum number of characters to return to prevent LLM token overflow  
     """  
-    if not re.match(r"^https?://([a-z0-9.-]*\.)?veeam\.com", url, re.I):  
-        raise ValueError("fetch_url_content: Only veeam.com domain is allowed")  
+    print(f"fetch_url: {url}")
+    text = await get_page_text(url)  
+    extract, report = PASSAGE_EXTRACTOR.extract(text, question)  
+    if len(extract) > max_chars:  
+        extract = extract[:max_chars] + "\n...[truncated]"  
+    print(  
+        f"fetch_url_content: {report['chunks_selected']}/{report['chunks_total']} passages, "  
+        f"~{report['tokens_out']} of ~{report['tokens_in']} tokens"  
+    )
+    return extract  
+  
+  
+async def veeam_search_and_fetch(query: str, top_k: int = 3) -> List[Dict[str, str]]:  
+    """  
+    Search veeam.com and fetch the content of the top results concurrently, in ONE tool call.  
   
-    session = HTMLSession()  
-    r = session.get(url, timeout=20)  
+    Parameters  
+    ----------  
+    query : str  
+        The user question WITHOUT the “site:” restriction.  
+    top_k : int, optional  
+        Number of top results whose pages are fetched (<= 5), by default 3.  
   
-    # ⚠️ Some pages may require JS rendering.  
-    r.html.render(headless=True)  # Uncomment if needed  
+    Returns  
+    -------  
+    List[dict]  
+        Each list item has keys: title, link, snippet, content  
+        (content is an error message when that page could not be fetched)  
+    """  
+    results = await veeam_google_search(query, num_results=max(top_k, 6))  
+    top = results[: max(1, min(top_k, 5))]  
+    pages = await asyncio.gather(  
+        *(fetch_url_content(it["link"], question=query) for it in top), return_exceptions=True  
+    )  
+    for item, page in zip(top, pages):  
+        item["content"] = f"[could not fetch page: {page}]" if isinstance(page, Exception) else page  
+    # The remaining hits are returned as plain search results for follow-up fetches  
+    return top + results[len(top):]  
+  
+# ─────────────────── Model client ───────────────────────  
+def create_model_client() -> AzureOpenAIChatCompletionClient:  
+    """Set up the OpenAI/Azure model client from the environment."""  
+    return AzureOpenAIChatCompletionClient(  
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),  
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),  
+        azure_deployment=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT"),  
+        model=os.getenv("OPENAI_MODEL_NAME"),  
+    )  
   
-    text = r.html.text  # Visible text  
-    # if len(text) > max_chars:  
-    #     text = text[:max_chars] + "\n...[truncated]"  
-    print("fetch_url_content:\n ", text)
-    return text  
   
 # ─────────────────── Stateful Base class ────────────────  
 class BaseAgent:  
     """  
-    Keeps the chat history and arbitrary state in the supplied dict (SESSION_STORE).  
+    Keeps the chat history and arbitrary state in the supplied dict-like store (SESSION_STORE).  
     NOT responsible for the actual language‑model call; that is done by the concrete class.  
     """  
   
@@ -121,6 +285,8 @@ class BaseAgent:
   
     # ------------- convenience helpers ------------------  
     def append_to_chat_history(self, messages: List[Dict[str, str]]) -> None:  
+        # Re-read first: another worker sharing the store may have appended since  
+        self.chat_history = self.state_store.get(f"{self.session_id}_chat_history", [])  
         self.chat_history.extend(messages)  
         self.state_store[f"{self.session_id}_chat_history"] = self.chat_history  
   
@@ -136,16 +302,19 @@ class Agent(BaseAgent):
     whenever it needs external knowledge.  
     """  
   
-    def __init__(self, state_store: Dict[str, Any], session_id: str):  
+    def __init__(  
+        self,  
+        state_store: Dict[str, Any],  
+        session_id: str,  
+        model_client: Optional[AzureOpenAIChatCompletionClient] = None,  
+    ):  
         super().__init__(state_store, session_id)  
-          # Set up the OpenAI/Azure model client  
-        self.model_client = AzureOpenAIChatCompletionClient(  
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),  
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),  
-            azure_deployment=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT"),  
-            model=os.getenv("OPENAI_MODEL_NAME"),  
-        )  
+        # Reuse a shared model client (see AgentPool) when given, otherwise own one  
+        self._owns_model_client = model_client is None  
+        self.model_client = model_client or create_model_client()  
+        self._saved_state: Optional[Any] = None  
+        # Set when a streamed run was abandoned midway; the team is then rebuilt from the store  
+        self._interrupted = False  
 
         # --- the autogen assistant with the Google tool attached ---  
         prompt = """  
@@ -153,11 +322,14 @@ You are a **research‑focused AI assistant** specializing in **Veeam products**
   
 ### TOOLS AVAILABLE  
   
+- `veeam_search_and_fetch(query, top_k)`    
+    *Google Custom Search restricted to veeam.com PLUS the full text of the top_k result pages, fetched in parallel. Prefer this for a new sub‑topic.*  
+  
 - `veeam_google_search(query)`    
     *Google Custom Search restricted to veeam.com.*  
   
-- `fetch_url_content(url)`    
-    *Fetch the plain textual content of a given veeam.com URL.*  
+- `fetch_url_content(url, question)`    
+    *Fetch the passages of a given veeam.com URL that are most relevant to `question` (always pass what you are looking for).*  
   
 ---  
   
@@ -168,8 +340,8 @@ You are a **research‑focused AI assistant** specializing in **Veeam products**
     - When your initial search does not yield good results, creatively invent new search queries—rephrase, broaden, narrow, or switch out keywords to surface relevant information.  
     - Think like a researcher. Use synonyms, related concepts, or even ask the question in a different way.  
     - Be patient—retry until you are confident you have found the best possible answer based on available information.  
-3. **veeam_google_search** each sub-topic, **carefully review snippets** for relevance.  
-4. If a result looks promising, **fetch_url_content** from that URL to read its full text (you may “double‑click” and check several links for thoroughness).  
+3. **veeam_search_and_fetch** each sub-topic (or **veeam_google_search** when snippets are enough), **carefully review** the results for relevance. Independent sub‑topics can be searched with parallel tool calls.  
+4. If another result looks promising, **fetch_url_content** from that URL to read its full text (you may “double‑click” and check several links for thoroughness).  
 5. **Iterate:** Cross‑check information from multiple sources, compare findings, and synthesize a clear, complete answer.  
 6. **If information is unclear or insufficient:**    
     - Ask relevant follow‑up questions to clarify the user’s intent.  
@@ -184,7 +356,8 @@ You are a **research‑focused AI assistant** specializing in **Veeam products**
         self._assistant = AssistantAgent(  
             "veeam_search_assistant",  
             model_client=self.model_client,  
-            tools=[veeam_google_search,fetch_url_content],  
+            tools=[veeam_search_and_fetch, veeam_google_search, fetch_url_content],  
+            model_client_stream=True,  # token chunks for chat_stream; run() still returns whole messages  
             system_message=(  prompt
             ),  
         )  
@@ -200,23 +373,99 @@ You are a **research‑focused AI assistant** specializing in **Veeam products**
 
     async def chat_async(self, prompt: str) -> str:  
         """Ensure agent/tools are ready and process the prompt."""  
-        if self.state:  
-            await self._team.load_state(self.state)  
+        await self._prepare_turn()  
 
-        response = await self._team.run(task=prompt, cancellation_token=CancellationToken())  
+        response = await self._team.run(task=self._task(prompt), cancellation_token=CancellationToken())  
         assistant_response = response.messages[-1].content  
-  
+
+        await self._finish_turn(prompt, assistant_response)  
+        return assistant_response  
+
+    async def chat_stream(self, prompt: str) -> AsyncIterator[Dict[str, Any]]:  
+        """  
+        Process the prompt and yield progress events as they happen:  
+        `tool_call` / `tool_result` for every tool invocation, `token` for chunks  
+        of the model output and a final `done` event carrying the whole answer.  
+        """  
+        await self._prepare_turn()  
+
+        cancellation_token = CancellationToken()  
+        assistant_response = ""  
+        try:  
+            async for item in self._team.run_stream(task=self._task(prompt), cancellation_token=cancellation_token):  
+                if isinstance(item, TaskResult):  
+                    assistant_response = item.messages[-1].content  
+                elif isinstance(item, ModelClientStreamingChunkEvent):  
+                    yield {"event": "token", "data": {"content": item.content}}  
+                elif isinstance(item, ToolCallRequestEvent):  
+                    for call in item.content:  
+                        yield {"event": "tool_call", "data": {"name": call.name, "arguments": call.arguments}}  
+                elif isinstance(item, ToolCallExecutionEvent):  
+                    for result in item.content:  
+                        yield {  
+                            "event": "tool_result",  
+                            "data": {  
+                                "name": getattr(result, "name", ""),  
+                                "is_error": bool(result.is_error),  
+                                "chars": len(result.content),  
+                            },  
+                        }  
+        except BaseException:  
+            # Client went away (or the run failed): stop the run and discard the half-finished team state  
+            cancellation_token.cancel()  
+            self._interrupted = True  
+            raise  
+
+        await self._finish_turn(prompt, assistant_response)  
+        yield {"event": "done", "data": {"response": assistant_response}}  
+
+    async def _prepare_turn(self) -> None:  
+        # A pooled agent keeps its team in memory; state is only reloaded when the  
+        # store holds something other than what this agent saved (new agent, other worker)  
+        self.state = self.state_store.get(self.session_id)  
+        if self._interrupted:  
+            await self._team.reset()  
+            self._interrupted = False  
+            self._saved_state = None  
+        if self.state and self.state != self._saved_state:  
+            await self._team.load_state(self.state)  
+
+    def _task(self, prompt: str) -> Any:  
+        """  
+        The prompt, preceded by the chat history when the team has no saved state for it  
+        (the session was answered from the answer cache so far).  
+        """  
+        history = self.state_store.get(f"{self.session_id}_chat_history", [])  
+        if self.state or not history:  
+            return prompt  
+        context = [  
+            TextMessage(content=m["content"], source="user" if m["role"] == "user" else "veeam_search_assistant")  
+            for m in history  
+        ]  
+        return context + [TextMessage(content=prompt, source="user")]  
+
+    async def _finish_turn(self, prompt: str, assistant_response: str) -> None:  
         messages = [  
             {"role": "user", "content": prompt},  
             {"role": "assistant", "content": assistant_response}  
         ]  
         self.append_to_chat_history(messages)  
-  
-        # Update/store latest agent state  
-        new_state = await self._team.save_state()  
+
+        # Update/store latest agent state, compacted so its size stays flat across turns  
+        new_state = await compact_state(  
+            await self._team.save_state(),  
+            self.model_client,  
+            tool_result_max_chars=STATE_TOOL_RESULT_MAX_CHARS,  
+            token_threshold=STATE_SUMMARY_TOKEN_THRESHOLD,  
+            keep_turns=STATE_KEEP_TURNS,  
+        )  
+        # The pooled team continues from the compacted state too, keeping its memory bounded  
+        await self._team.load_state(new_state)  
         self.state_store[self.session_id] = new_state  
-  
-        return assistant_response  
+        # Keep the stored (round-tripped) form so the next turn's comparison is like for like  
+        self._saved_state = self.state_store.get(self.session_id)  
+
     # Optional – close the client when the process terminates  
     async def __aexit__(self, *exc):  
-        await self.model_client.close()  
\ No newline at end of file
+        if self._owns_model_client:  
+            await self.model_client.close()  
\ No newline at end of file
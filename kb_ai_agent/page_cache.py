@@ -0,0 +1,134 @@
+"""
+Persistent page cache for `fetch_url_content`.
+
+Keyed by URL, each entry keeps the extracted page text together with the
+ETag / Last-Modified validators of the response. Entries younger than
+`max_age` are served straight from disk; older ones are revalidated with a
+conditional GET, so an unchanged KB article costs a 304 instead of a full
+download + render. The file is SQLite (WAL), so it is shared by all
+sessions and by every worker process on the host.
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class CachedPage:
+    url: str
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+    def is_fresh(self, max_age: float) -> bool:
+        return time.time() - self.fetched_at < max_age
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class PageCache:
+    """
+    Parameters
+    ----------
+    path : str
+        SQLite file holding the cache.
+    max_age : float
+        Seconds an entry is served without revalidation.
+    max_bytes : int
+        Size limit of the stored (compressed) texts; least recently used pages are dropped beyond it.
+    """
+
+    def __init__(self, path: str, max_age: float = 24 * 3600, max_bytes: int = 200 * 1024 * 1024):
+        self.path = path
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, text BLOB NOT NULL, etag TEXT, "
+            "last_modified TEXT, fetched_at REAL NOT NULL, last_access REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT text, etag, last_modified, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE pages SET last_access = ? WHERE url = ?", (time.time(), url))
+        text, etag, last_modified, fetched_at = row
+        return CachedPage(url, zlib.decompress(text).decode("utf-8"), etag, last_modified, fetched_at)
+
+    def fetched_at(self, url: str) -> Optional[float]:
+        """When the cached text of `url` was last fetched or revalidated (None if not cached)."""
+        with self._lock:
+            row = self._db.execute("SELECT fetched_at FROM pages WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, url: str, text: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        blob = zlib.compress(text.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages (url, text, etag, last_modified, fetched_at, last_access, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, blob, etag, last_modified, now, now, len(blob)),
+            )
+            self._enforce_size()
+
+    def mark_revalidated(self, url: str) -> None:
+        """The origin answered 304 – the cached text is fresh again."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("UPDATE pages SET fetched_at = ?, last_access = ? WHERE url = ?", (now, now, url))
+
+    # ------------- metrics ------------------
+    def record(self, outcome: str) -> None:
+        """Count a lookup outcome: 'hit', 'revalidated' or 'miss'."""
+        if outcome == "hit":
+            self.hits += 1
+        elif outcome == "revalidated":
+            self.revalidated += 1
+        else:
+            self.misses += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        lookups = self.hits + self.revalidated + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.revalidated) / lookups if lookups else 0.0,
+        }
+
+    def _enforce_size(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, size in self._db.execute("SELECT url, size FROM pages ORDER BY last_access").fetchall():
+            self._db.execute("DELETE FROM pages WHERE url = ?", (url,))
+            total -= size
+            if total <= self.max_bytes:
+                break
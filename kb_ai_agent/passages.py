@@ -0,0 +1,128 @@
+"""
+Relevance-ranked passage extraction for fetched pages.
+
+A veeam.com page easily carries several thousand tokens of navigation,
+release notes and unrelated sections. Instead of handing the whole text to
+the agent, the page is split into overlapping word chunks, the chunks are
+scored against the question with Okapi BM25 (computed locally over the
+page's own chunks, no extra service or model call) and only the best
+chunks that fit a token budget are returned, in page order.
+"""
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9._-]*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it of on or that the this to what when "
+    "where which who why will with you your".split()
+)
+
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return max(1, len(text) // 4)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def chunk_text(text: str, chunk_words: int = 120, overlap: int = 20) -> List[str]:
+    """Split text into chunks of about `chunk_words` words, keeping paragraphs together where possible."""
+    chunks: List[str] = []
+    current: List[str] = []
+    for paragraph in (p.strip() for p in text.splitlines()):
+        if not paragraph:
+            continue
+        words = paragraph.split()
+        if current and len(current) + len(words) > chunk_words:
+            chunks.append(" ".join(current))
+            current = current[-overlap:] if overlap else []
+        current.extend(words)
+        while len(current) > chunk_words:
+            chunks.append(" ".join(current[:chunk_words]))
+            current = current[chunk_words - overlap:]
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def bm25_scores(query: List[str], docs: List[List[str]], k1: float = 1.5, b: float = 0.75) -> List[float]:
+    n = len(docs)
+    avg_len = sum(len(d) for d in docs) / n if n else 0.0
+    doc_freq = Counter(term for d in docs for term in set(d))
+    scores = []
+    for d in docs:
+        tf = Counter(d)
+        score = 0.0
+        for term in set(query):
+            if term not in tf:
+                continue
+            idf = math.log(1 + (n - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * tf[term] * (k1 + 1) / (tf[term] + k1 * (1 - b + b * len(d) / (avg_len or 1)))
+        scores.append(score)
+    return scores
+
+
+class PassageExtractor:
+    """
+    Parameters
+    ----------
+    token_budget : int
+        Max. (approximate) tokens returned per page.
+    chunk_words : int
+        Target chunk size in words.
+    """
+
+    def __init__(self, token_budget: int = 1500, chunk_words: int = 120):
+        self.token_budget = token_budget
+        self.chunk_words = chunk_words
+        self.pages = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    def extract(self, text: str, question: str) -> Tuple[str, Dict[str, int]]:
+        """Return the top passages of `text` for `question` and a report of the token reduction."""
+        chunks = chunk_text(text, self.chunk_words, overlap=self.chunk_words // 6)
+        tokens_in = approx_tokens(text)
+        if tokens_in <= self.token_budget or not chunks:
+            selected = list(range(len(chunks)))
+            extract = text
+        else:
+            scores = bm25_scores(tokenize(question), [tokenize(c) for c in chunks])
+            if any(scores):
+                ranked = sorted((i for i in range(len(chunks)) if scores[i] > 0), key=lambda i: scores[i], reverse=True)
+            else:
+                ranked = list(range(len(chunks)))  # nothing matched: keep the beginning of the page
+            selected, used = [], 0
+            for i in ranked:
+                cost = approx_tokens(chunks[i])
+                if used + cost > self.token_budget:
+                    continue
+                selected.append(i)
+                used += cost
+            selected.sort()  # page order reads better than score order
+            extract = "\n...\n".join(chunks[i] for i in selected)
+
+        report = {
+            "chunks_total": len(chunks),
+            "chunks_selected": len(selected),
+            "tokens_in": tokens_in,
+            "tokens_out": approx_tokens(extract),
+        }
+        self.pages += 1
+        self.tokens_in += report["tokens_in"]
+        self.tokens_out += report["tokens_out"]
+        return extract, report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pages": self.pages,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "reduction": 1 - self.tokens_out / self.tokens_in if self.tokens_in else 0.0,
+        }
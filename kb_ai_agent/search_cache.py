@@ -0,0 +1,112 @@
+"""
+Shared result cache for `veeam_google_search`.
+
+Sessions often issue the same (or trivially different) Custom Search
+queries within seconds of each other. Results are cached per normalized
+query with a TTL and an LRU bound, and concurrent lookups of the same key
+are coalesced: only the first caller hits the API, the others await its
+result (single flight). When that first caller is cancelled (its client went
+away), a waiting caller takes over the fetch instead of failing with it.
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+
+def normalize_query(query: str) -> str:
+    """Case-, whitespace- and trailing-punctuation-insensitive cache key."""
+    return re.sub(r"\s+", " ", query).strip().strip("?!.").strip().lower()
+
+
+def _cancelling() -> bool:
+    """True when the current task itself is being cancelled."""
+    task = asyncio.current_task()
+    return task is not None and task.cancelling() > 0
+
+
+class SearchCache:
+    """
+    Parameters
+    ----------
+    ttl : float
+        Seconds a result set stays valid.
+    max_entries : int
+        Max. number of cached queries; least recently used ones are dropped beyond it.
+    """
+
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[float, List[Dict[str, str]]]]" = OrderedDict()
+        self._in_flight: Dict[Tuple[str, int], asyncio.Future] = {}
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    async def get_or_fetch(
+        self,
+        query: str,
+        num_results: int,
+        fetch: Callable[[], Awaitable[List[Dict[str, str]]]],
+    ) -> List[Dict[str, str]]:
+        key = (normalize_query(query), num_results)
+        while True:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._copy(entry[1])
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+            try:
+                results = await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                # The leading caller was cancelled, not this one: look again and lead the fetch if needed
+                if in_flight.cancelled() and not _cancelling():
+                    continue
+                raise
+            self.coalesced += 1
+            return self._copy(results)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            results = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del self._in_flight[key]
+        future.set_result(results)
+
+        self._entries[key] = (time.monotonic(), results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return self._copy(results)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+    @staticmethod
+    def _copy(results: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        # Callers annotate result dicts (e.g. with fetched content); never hand out the cached ones
+        return [dict(item) for item in results]
@@ -0,0 +1,190 @@
+"""
+Bounded session store for the kb_ai_agent backend.
+
+Drop-in replacement for the plain `SESSION_STORE` dict (supports `get`,
+`[]`, `in` and `del`) with
+
+ • an in-memory tier bounded by total bytes and by a per-entry TTL,
+ • compact serialization (compact JSON + zlib) – the memory accounting is
+   simply the size of the stored blobs,
+ • an optional SQLite file that entries spill to when the memory tier is
+   full. When configured, SQLite is the source of truth (write-through,
+   WAL mode), so several uvicorn workers on one host can share sessions;
+   the memory tier then only caches blobs whose version still matches.
+
+Without SQLite the memory tier is the only copy: a session evicted to stay
+within `max_bytes` is lost, and its next request starts a new conversation.
+Expired entries are dropped when read and by purge_expired(), which the agent
+pool runs from its idle sweep.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_MISSING = object()
+
+
+def serialize(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":"), default=str).encode("utf-8"))
+
+
+def deserialize(blob: bytes) -> Any:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class SessionStore:
+    """
+    Parameters
+    ----------
+    max_bytes : int
+        Budget for the serialized blobs held in memory (per worker).
+    ttl : float
+        Seconds after the last write before an entry expires (0 = never).
+    sqlite_path : str, optional
+        SQLite file used as spill tier / shared store. Memory only when omitted.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 24 * 3600, sqlite_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sqlite_path = sqlite_path
+
+        # key -> (blob, version, expires_at)
+        self._memory: "OrderedDict[str, Tuple[bytes, float, float]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        self._db: Optional[sqlite3.Connection] = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, version REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+        self.expirations = 0
+
+    # ------------- dict interface ------------------
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self._load(key)
+        return default if value is _MISSING else value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._load(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        blob = serialize(value)
+        version = time.time()
+        expires_at = version + self.ttl if self.ttl else float("inf")
+        with self._lock:
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sessions (key, value, version, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, blob, version, expires_at),
+                )
+            self._put_memory(key, blob, version, expires_at)
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            found = self._drop_memory(key)
+            if self._db is not None:
+                found = self._db.execute("DELETE FROM sessions WHERE key = ?", (key,)).rowcount > 0 or found
+        if not found:
+            raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return self._load(key) is not _MISSING
+
+    # ------------- accounting ------------------
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "spills": self.spills,
+                "expirations": self.expirations,
+            }
+            if self._db is not None:
+                count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM sessions").fetchone()
+                stats.update({"sqlite_entries": count, "sqlite_bytes": size})
+        return stats
+
+    def purge_expired(self) -> None:
+        """Drop expired entries that are never read again, from memory and SQLite."""
+        now = time.time()
+        with self._lock:
+            for key, (_, _, expires_at) in list(self._memory.items()):
+                if expires_at <= now:
+                    self._drop_memory(key)
+                    self.expirations += 1
+            if self._db is not None:
+                self._db.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+    # ------------- internals ------------------
+    def _load(self, key: str) -> Any:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if self._db is not None:
+                # SQLite is authoritative: only trust memory if another worker has not written since.
+                row = self._db.execute("SELECT version, expires_at FROM sessions WHERE key = ?", (key,)).fetchone()
+                if row is None or row[1] <= now:
+                    self._drop_memory(key)
+                    self.misses += 1
+                    return _MISSING
+                if entry is None or entry[1] != row[0]:
+                    blob, version, expires_at = self._db.execute(
+                        "SELECT value, version, expires_at FROM sessions WHERE key = ?", (key,)
+                    ).fetchone()
+                    self._put_memory(key, blob, version, expires_at)
+                    entry = (blob, version, expires_at)
+            elif entry is None or entry[2] <= now:
+                if entry is not None:
+                    self._drop_memory(key)
+                    self.expirations += 1
+                self.misses += 1
+                return _MISSING
+
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return deserialize(entry[0])
+
+    def _put_memory(self, key: str, blob: bytes, version: float, expires_at: float) -> None:
+        self._drop_memory(key)
+        self._memory[key] = (blob, version, expires_at)
+        self._memory_bytes += len(blob)
+        # Evict least recently used blobs beyond the byte budget. With SQLite configured the
+        # entry is already persisted there; without it, eviction means the session is gone.
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            old_key, (old_blob, _, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_blob)
+            if self._db is not None:
+                self.spills += 1
+            else:
+                logger.warning(f"Session store full; dropped '{old_key}'")
+
+    def _drop_memory(self, key: str) -> bool:
+        entry = self._memory.pop(key, None)
+        if entry is None:
+            return False
+        self._memory_bytes -= len(entry[0])
+        return True
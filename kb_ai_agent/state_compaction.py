@@ -0,0 +1,157 @@
+"""
+Compaction of the autogen team state persisted after every turn.
+
+`team.save_state()` contains every tool result of the session – whole
+search result lists and fetched page passages – in both the assistant's
+model context and the group chat manager's message thread. Left alone,
+state size and `load_state()` time grow with every turn. After each turn:
+
+ • tool results are replaced by a short digest plus a reference to the
+   call (`fetch_url_content(url=...)`); re-running the call is cheap because
+   pages and searches are served from the page / search caches,
+ • once the model context exceeds a token threshold, all but the last
+   turns are folded into one summary message written by the model itself.
+"""
+from __future__ import annotations
+
+import json
+import logging
+from typing import Any, Dict, List
+
+from autogen_core.models import ChatCompletionClient, SystemMessage, UserMessage
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+TOOL_RESULT_TYPES = ("FunctionExecutionResultMessage", "ToolCallExecutionEvent")
+
+
+def approx_tokens(obj: Any) -> int:
+    return len(json.dumps(obj, default=str)) // 4
+
+
+def _call_references(node: Any, refs: Dict[str, str]) -> None:
+    """Map tool call ids to a readable `name(arguments)` reference."""
+    if isinstance(node, dict):
+        if {"id", "name", "arguments"} <= node.keys():
+            refs[node["id"]] = f"{node['name']}({node['arguments']})"
+        for value in node.values():
+            _call_references(value, refs)
+    elif isinstance(node, list):
+        for value in node:
+            _call_references(value, refs)
+
+
+def _compact_results(node: Any, refs: Dict[str, str], max_chars: int) -> int:
+    saved = 0
+    if isinstance(node, dict):
+        if node.get("type") in TOOL_RESULT_TYPES and isinstance(node.get("content"), list):
+            for result in node["content"]:
+                text = result.get("content")
+                if isinstance(text, str) and len(text) > max_chars:
+                    ref = refs.get(result.get("call_id"), result.get("name", "tool"))
+                    result["content"] = (
+                        f"{text[:max_chars]}\n...[compacted {len(text)} chars of {ref}; call it again to re-read]"
+                    )
+                    saved += len(text) - len(result["content"])
+        elif node.get("type") == "ToolCallSummaryMessage" and isinstance(node.get("content"), str):
+            text = node["content"]
+            if len(text) > max_chars:
+                node["content"] = f"{text[:max_chars]}\n...[compacted {len(text)} chars of tool output]"
+                saved += len(text) - len(node["content"])
+        for value in node.values():
+            saved += _compact_results(value, refs, max_chars)
+    elif isinstance(node, list):
+        for value in node:
+            saved += _compact_results(value, refs, max_chars)
+    return saved
+
+
+def compact_tool_results(state: Dict[str, Any], max_chars: int = 400) -> int:
+    """Shrink tool results in place; returns the number of characters removed."""
+    refs: Dict[str, str] = {}
+    _call_references(state, refs)
+    return _compact_results(state, refs, max_chars)
+
+
+def _message_lists(state: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
+    """
+    The `llm_context.messages` lists of every agent in a team state. `BaseGroupChat.save_state`
+    wraps each agent's state in a ChatAgentContainerState (`agent_state`, `message_buffer`);
+    a bare agent state (flat `llm_context`) is accepted too.
+    """
+    lists = []
+    for entry in state.get("agent_states", {}).values():
+        if not isinstance(entry, dict):
+            continue
+        agent_state = entry.get("agent_state") if isinstance(entry.get("agent_state"), dict) else entry
+        llm_context = agent_state.get("llm_context")
+        messages = llm_context.get("messages") if isinstance(llm_context, dict) else None
+        if isinstance(messages, list):
+            lists.append(messages)
+    return lists
+
+
+def _transcript(messages: List[Dict[str, Any]]) -> str:
+    lines = []
+    for m in messages:
+        content = m.get("content")
+        if not isinstance(content, str):
+            content = json.dumps(content, default=str)[:300]
+        lines.append(f"{m.get('type', 'Message')}: {content}")
+    return "\n".join(lines)
+
+
+async def summarize_history(
+    state: Dict[str, Any],
+    model_client: ChatCompletionClient,
+    token_threshold: int = 6000,
+    keep_turns: int = 2,
+) -> bool:
+    """Fold old turns of each model context into one summary message once it exceeds `token_threshold`."""
+    changed = False
+    for messages in _message_lists(state):
+        if approx_tokens(messages) <= token_threshold:
+            continue
+        # Cut only at the start of a user turn so tool calls stay paired with their results
+        user_turns = [i for i, m in enumerate(messages) if m.get("type") == "UserMessage"]
+        if len(user_turns) <= keep_turns:
+            continue
+        cut = user_turns[-keep_turns]
+        head = [m for m in messages[:cut] if m.get("type") == "SystemMessage"]
+        old = [m for m in messages[:cut] if m.get("type") != "SystemMessage"]
+
+        result = await model_client.create(
+            [
+                SystemMessage(
+                    content="Summarize this earlier part of a Veeam research conversation in under 250 words. "
+                    "Keep the user's questions, the key facts found and every veeam.com source URL."
+                ),
+                UserMessage(content=_transcript(old), source="user"),
+            ]
+        )
+        summary = {
+            "type": "UserMessage",
+            "source": "user",
+            "content": f"Summary of the earlier conversation:\n{result.content}",
+        }
+        messages[:] = head + [summary] + messages[cut:]
+        changed = True
+    return changed
+
+
+async def compact_state(
+    state: Dict[str, Any],
+    model_client: ChatCompletionClient,
+    tool_result_max_chars: int = 400,
+    token_threshold: int = 6000,
+    keep_turns: int = 2,
+) -> Dict[str, Any]:
+    before = approx_tokens(state)
+    compact_tool_results(state, tool_result_max_chars)
+    try:
+        await summarize_history(state, model_client, token_threshold, keep_turns)
+    except Exception as e:  # compaction must never fail the turn
+        logger.warning(f"History summarization skipped: {e}")
+    logger.info(f"Compacted team state from ~{before} to ~{approx_tokens(state)} tokens")
+    return state
@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+# The apps import their sibling modules as top-level modules (utils/ scripts, kb_ai_agent,
+# MCP_application) and the servers import "utils.<module>" from the repository root
+ROOT = Path(__file__).resolve().parent.parent
+for path in (ROOT, ROOT / "utils", ROOT / "kb_ai_agent", ROOT / "MCP_application"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
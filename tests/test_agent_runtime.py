@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+pytest.importorskip("semantic_kernel")
+pytest.importorskip("dotenv")
+
+import agent_runtime  # noqa: E402
+
+
+class FakeService:
+    def __init__(self, **kwargs):
+        pass
+
+
+class FakeAgent:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def runtime(monkeypatch):
+    monkeypatch.setattr(agent_runtime, "AzureChatCompletion", FakeService)
+    runtime = agent_runtime.AgentRuntime(keepalive_interval=3600, session_idle_timeout=60)
+    yield runtime
+    runtime.shutdown()
+
+
+def add_session(runtime, session_id, last_used):
+    agent = FakeAgent()
+    runtime._agents[session_id] = agent
+    runtime._last_used[session_id] = last_used
+    runtime._state_store.set(session_id, {"thread": f"history of {session_id}"})
+    return agent
+
+
+def test_idle_sweep_drops_the_session_state(runtime):
+    idle = add_session(runtime, "idle", last_used=time.monotonic() - 120)
+    active = add_session(runtime, "active", last_used=time.monotonic())
+
+    runtime._submit(runtime._evict_idle()).result()
+
+    assert idle.closed and not active.closed
+    assert list(runtime._state_store._store) == ["active"]
+    runtime.reset_session("active")
+    assert runtime._state_store._store == {}
+
+
+def test_reset_drops_the_session_state(runtime):
+    agent = add_session(runtime, "s", last_used=time.monotonic())
+
+    runtime.reset_session("s")
+
+    assert agent.closed
+    assert runtime._state_store._store == {}
+    assert runtime._agents == {} and runtime._last_used == {}
@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip("azure.cosmos")
+pytest.importorskip("dotenv")
+
+from cosmos_partitioning import STRATEGIES, Layout  # noqa: E402
+
+
+def month_layout():
+    return Layout(paths=list(STRATEGIES["month"]))
+
+
+def test_iso_date_range_is_routed_to_its_months():
+    route = month_layout().route("c.sent_time >= '2025-06-01' AND c.sent_time <= '2025-07-01'")
+    assert route.predicate == "c.pk_month IN ('2025-06', '2025-07')"
+    assert route.partitions == 2
+
+
+@pytest.mark.parametrize("filter_str", [
+    "c.sent_time >= '2025-6-1' AND c.sent_time <= '2025-07-01'",
+    "c.sent_time BETWEEN '2025-06-01' AND '2025-7-1'",
+    "c.sent_time = 'June 2025'",
+])
+def test_non_iso_date_fans_out_instead_of_failing(filter_str):
+    route = month_layout().route(filter_str)
+    assert route.partition_key is None and route.predicate == ""
+    assert route.query_kwargs() == {"enable_cross_partition_query": True}
+    assert route.where(filter_str) == f"WHERE {filter_str}"
+
+
+def test_or_terms_fan_out():
+    route = month_layout().route("c.sent_time >= '2025-06-01' AND c.sent_time <= '2025-06-30' OR c.important = 1")
+    assert route.description == "all partitions"
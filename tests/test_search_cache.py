@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from search_cache import SearchCache
+
+
+def test_waiter_takes_over_when_the_leader_is_cancelled():
+    async def run():
+        cache = SearchCache()
+        calls = []
+        release = asyncio.Event()
+
+        async def fetch():
+            calls.append(len(calls))
+            await release.wait()
+            return [{"link": f"https://www.veeam.com/{len(calls)}"}]
+
+        leader = asyncio.create_task(cache.get_or_fetch("backup copy", 6, fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_fetch("Backup copy?", 6, fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter, calls, cache
+
+    results, calls, cache = asyncio.run(run())
+    assert results == [{"link": "https://www.veeam.com/2"}]
+    assert calls == [0, 1]
+    assert cache.stats()["entries"] == 1
+
+
+def test_cancelled_waiter_does_not_cancel_the_fetch():
+    async def run():
+        cache = SearchCache()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return [{"link": "https://www.veeam.com/kb"}]
+
+        leader = asyncio.create_task(cache.get_or_fetch("restore", 6, fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_fetch("restore", 6, fetch))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        release.set()
+        return await leader
+
+    assert asyncio.run(run()) == [{"link": "https://www.veeam.com/kb"}]
@@ -0,0 +1,99 @@
+import asyncio
+import copy
+
+import pytest
+
+pytest.importorskip("autogen_core")
+
+from state_compaction import approx_tokens, compact_state  # noqa: E402
+
+
+class SummaryClient:
+    """Stands in for the model client: records the summarization calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, messages):
+        self.calls += 1
+        return type("Result", (), {"content": "the user asked about backups; see https://www.veeam.com/kb1.html"})()
+
+
+def turn(i):
+    return [
+        {"content": f"question {i} " + "about retention " * 40, "source": "user", "type": "UserMessage"},
+        {"content": f"answer {i} " + "keep seven restore points " * 60, "thought": None, "source": "assistant",
+         "type": "AssistantMessage"},
+    ]
+
+
+def team_state(turns):
+    """Layout of RoundRobinGroupChat.save_state() in autogen-agentchat 0.4.x (TeamState of container states)."""
+    messages = [m for i in range(turns) for m in turn(i)]
+    return {
+        "type": "TeamState",
+        "version": "1.0.0",
+        "agent_states": {
+            "veeam_assistant": {
+                "type": "ChatAgentContainerState",
+                "version": "1.0.0",
+                "agent_state": {
+                    "type": "AssistantAgentState",
+                    "version": "1.0.0",
+                    "llm_context": {"messages": messages},
+                },
+                "message_buffer": [],
+            },
+            "RoundRobinGroupChatManager": {
+                "type": "RoundRobinManagerState",
+                "version": "1.0.0",
+                "message_thread": [],
+                "current_turn": turns,
+                "next_speaker_index": 0,
+            },
+        },
+    }
+
+
+def test_team_history_is_summarized():
+    state = team_state(turns=12)
+    before = approx_tokens(state)
+    client = SummaryClient()
+    asyncio.run(compact_state(state, client, token_threshold=1000, keep_turns=2))
+
+    messages = state["agent_states"]["veeam_assistant"]["agent_state"]["llm_context"]["messages"]
+    assert client.calls == 1
+    assert messages[0]["content"].startswith("Summary of the earlier conversation:")
+    assert messages[1:] == turn(10) + turn(11)
+    assert approx_tokens(state) < before / 3
+
+
+def test_flat_agent_state_is_still_summarized():
+    state = team_state(turns=12)
+    container = state["agent_states"]["veeam_assistant"]
+    state["agent_states"]["veeam_assistant"] = copy.deepcopy(container["agent_state"])
+    asyncio.run(compact_state(state, SummaryClient(), token_threshold=1000, keep_turns=2))
+    assert len(state["agent_states"]["veeam_assistant"]["llm_context"]["messages"]) == 5
+
+
+def test_saved_team_state_is_compacted():
+    pytest.importorskip("autogen_agentchat")
+    replay = pytest.importorskip("autogen_ext.models.replay")
+    from autogen_agentchat.agents import AssistantAgent
+    from autogen_agentchat.conditions import MaxMessageTermination
+    from autogen_agentchat.teams import RoundRobinGroupChat
+
+    async def run():
+        answers = [f"answer {i} " + "keep seven restore points " * 60 for i in range(8)]
+        agent = AssistantAgent("veeam_assistant", model_client=replay.ReplayChatCompletionClient(answers))
+        team = RoundRobinGroupChat([agent], termination_condition=MaxMessageTermination(2))
+        for i in range(8):
+            await team.run(task=f"question {i} " + "about retention " * 40)
+        state = await team.save_state()
+        await compact_state(state, SummaryClient(), token_threshold=1000, keep_turns=2)
+        return state
+
+    state = asyncio.run(run())
+    messages = state["agent_states"]["veeam_assistant"]["agent_state"]["llm_context"]["messages"]
+    assert messages[0]["content"].startswith("Summary of the earlier conversation:")
+    assert sum(m["type"] == "UserMessage" for m in messages) == 3
@@ -0,0 +1,90 @@
+# Pointer to the live AI Search index / Cosmos DB container
+#
+# Readers used to take the index / container name straight from
+# AZURE_SEARCH_INDEX / COSMOS_CONTAINER_NAME, so a schema change meant dropping
+# and recreating the live store. reindex.py now builds the new store next to the
+# live one and then flips this pointer – a small JSON file replaced atomically
+# (os.replace) – to switch every reader over at once:
+#
+#     {"aisearch": {"name": "vectest-v2", "previous": "vectest", "switched_at": "..."},
+#      "cosmos":   {"name": "emails_v3",  "previous": "emails_v2", "switched_at": "..."}}
+#
+# Readers call active_name() per request; the file is re-read only when its
+# mtime changes. Without a pointer file the environment variable still applies.
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+try:
+    from .settings import getenv
+except ImportError:  # imported as a top-level module by the utils/ scripts
+    from settings import getenv
+
+# Repository root by default, so the Streamlit apps, the MCP servers and utils/ scripts share it
+ACTIVE_STORE_PATH = getenv("ACTIVE_STORE_PATH", str(Path(__file__).resolve().parent.parent / "active_store.json"))
+
+_lock = threading.Lock()
+_cache = {}  # path -> (mtime, pointers)
+
+
+def _load(path):
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    with _lock:
+        cached = _cache.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, "r", encoding="utf-8") as f:
+                cached = _cache[path] = (mtime, json.load(f))
+        return cached[1]
+
+
+def active_name(backend, default=None, path=None):
+    """Name of the live store for `backend` ("aisearch" or "cosmos"), falling back to `default`."""
+    entry = active_entry(backend, path)
+    return entry["name"] if entry else default
+
+
+def active_entry(backend, path=None):
+    """Pointer entry for `backend` ({"name", "previous", "switched_at"}), or None without a pointer."""
+    return _load(path or ACTIVE_STORE_PATH).get(backend)
+
+
+def confirm_recreate(backend, name, path=None):
+    """
+    Before a setup script drops and recreates `name`: when the pointer names a different live
+    store, ask for confirmation (readers and ingestion keep using the pointer's store, so the
+    new one would stay empty and unused). Returns False unless the operator types the name.
+    """
+    live = active_name(backend, path=path)
+    if live is None or live == name:
+        return True
+    print(f"The active-store pointer ({path or ACTIVE_STORE_PATH}) names '{live}' as the live {backend} store, "
+          f"not '{name}'. Readers and ingestion keep using '{live}'; to switch stores use reindex.py switch.")
+    try:
+        answer = input(f"Type '{name}' to drop and recreate it anyway: ")
+    except EOFError:
+        answer = ""
+    return answer.strip() == name
+
+
+def set_active(backend, name, path=None):
+    """Atomically point every reader of `backend` at `name`; returns the previous name."""
+    path = path or ACTIVE_STORE_PATH
+    pointers = dict(_load(path))
+    previous = pointers.get(backend, {}).get("name")
+    pointers[backend] = {
+        "name": name,
+        "previous": previous,
+        "switched_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    # Write next to the target and rename: readers see the old or the new file, never a partial one
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(pointers, f, indent=2)
+    os.replace(tmp_path, path)
+    return previous
@@ -0,0 +1,181 @@
+# Index profiles for the Azure AI Search email index
+#
+# The index stores one or two vectors per email (AZURE_OPENAI_EMB_DIMENSIONS each, see
+# vector_layout.py). With the default
+# HNSW configuration both are kept as full-precision float32 – in the vector
+# index AND as retrievable copies – so index size and query latency grow
+# linearly with the mailbox. A profile bundles the storage/latency/recall
+# trade-offs Azure AI Search offers for vector fields:
+#
+#  • compression   – None, "scalar" (int8, ~4x smaller) or "binary" (1 bit, ~32x smaller)
+#  • rescoring     – re-rank the oversampled compressed candidates with the preserved
+#                    full-precision vectors (keeps recall close to uncompressed)
+#  • vector_type   – "single" (float32) or "half" (float16, half the raw storage)
+#  • stored        – False drops the retrievable copy of the vectors (they are never
+#                    returned to the app anyway; search is unaffected)
+#  • m / ef_construction / ef_search – explicit HNSW graph parameters
+#  • exhaustive    – exact kNN instead of HNSW (the recall baseline of the benchmark)
+#
+# create_aisearch_index.py builds the index from AZURE_SEARCH_INDEX_PROFILE
+# (default "baseline" = the previous behaviour); benchmark_aisearch_profiles.py
+# compares the profiles on real data.
+from azure.search.documents.indexes.models import (
+    BinaryQuantizationCompression,
+    ExhaustiveKnnAlgorithmConfiguration,
+    HnswAlgorithmConfiguration,
+    HnswParameters,
+    RescoringOptions,
+    ScalarQuantizationCompression,
+    ScalarQuantizationParameters,
+    SearchableField,
+    SearchField,
+    SearchFieldDataType,
+    SearchIndex,
+    SemanticConfiguration,
+    SemanticField,
+    SemanticPrioritizedFields,
+    SemanticSearch,
+    SimpleField,
+    VectorSearch,
+    VectorSearchProfile,
+    AzureOpenAIVectorizer,
+    AzureOpenAIVectorizerParameters,
+)
+
+from embedding_dimensions import EMBEDDING_MODEL_NAME
+from vector_layout import vector_fields
+
+PROFILES = {
+    # Previous index: float32, stored, service-default HNSW parameters
+    "baseline": {"compression": None, "vector_type": "single", "stored": True, "m": 4, "ef_construction": 400, "ef_search": 500},
+    # Exact kNN over full-precision vectors – ground truth for recall@k
+    "exhaustive": {"compression": None, "vector_type": "single", "stored": True, "exhaustive": True},
+    # int8 vectors in the graph, originals kept for rescoring, no retrievable copy
+    "scalar": {"compression": "scalar", "rescore": True, "oversampling": 4.0, "vector_type": "single", "stored": False,
+               "m": 4, "ef_construction": 400, "ef_search": 500},
+    # Like "scalar" with float16 originals
+    "scalar_half": {"compression": "scalar", "rescore": True, "oversampling": 4.0, "vector_type": "half", "stored": False,
+                    "m": 4, "ef_construction": 400, "ef_search": 500},
+    # 1-bit vectors in the graph; needs heavier oversampling to recover recall
+    "binary": {"compression": "binary", "rescore": True, "oversampling": 10.0, "vector_type": "half", "stored": False,
+               "m": 4, "ef_construction": 400, "ef_search": 500},
+    # Denser graph / wider build for recall, narrower search beam for latency
+    "scalar_fast": {"compression": "scalar", "rescore": True, "oversampling": 2.0, "vector_type": "half", "stored": False,
+                    "m": 8, "ef_construction": 600, "ef_search": 200},
+}
+
+_VECTOR_TYPES = {"single": SearchFieldDataType.Single, "half": SearchFieldDataType.Half}
+
+
+def build_vector_search(profile_name, openai_endpoint, embedding_deployment, openai_key, model_name=EMBEDDING_MODEL_NAME):
+    """VectorSearch configuration (algorithm, compression, profile, vectorizer) for an index profile."""
+    settings = PROFILES[profile_name]
+    if settings.get("exhaustive"):
+        algorithm = ExhaustiveKnnAlgorithmConfiguration(name="myExhaustiveKnn")
+    else:
+        algorithm = HnswAlgorithmConfiguration(
+            name="myHnsw",
+            parameters=HnswParameters(
+                m=settings["m"],
+                ef_construction=settings["ef_construction"],
+                ef_search=settings["ef_search"],
+                metric="cosine",
+            ),
+        )
+
+    compressions = []
+    if settings["compression"]:
+        rescoring = RescoringOptions(
+            enable_rescoring=settings.get("rescore", False),
+            default_oversampling=settings.get("oversampling"),
+            rescore_storage_method="preserveOriginals",
+        )
+        if settings["compression"] == "scalar":
+            compressions.append(
+                ScalarQuantizationCompression(
+                    compression_name="myCompression",
+                    parameters=ScalarQuantizationParameters(quantized_data_type="int8"),
+                    rescoring_options=rescoring,
+                )
+            )
+        else:
+            compressions.append(BinaryQuantizationCompression(compression_name="myCompression", rescoring_options=rescoring))
+
+    return VectorSearch(
+        algorithms=[algorithm],
+        compressions=compressions,
+        profiles=[
+            VectorSearchProfile(
+                name="myHnswProfile",
+                algorithm_configuration_name=algorithm.name,
+                compression_name="myCompression" if compressions else None,
+                vectorizer_name="myVectorizer",
+            )
+        ],
+        vectorizers=[
+            AzureOpenAIVectorizer(
+                vectorizer_name="myVectorizer",
+                parameters=AzureOpenAIVectorizerParameters(
+                    resource_url=openai_endpoint,
+                    deployment_name=embedding_deployment,
+                    # Query-time vectorization uses the field dimensions; reduced sizes need a text-embedding-3 model
+                    model_name=model_name,
+                    api_key=openai_key,
+                ),
+            )
+        ],
+    )
+
+
+def build_index(index_name, profile_name, dimensions, openai_endpoint, embedding_deployment, openai_key, layout=None):
+    """Complete email index definition (fields, vector search, semantic search) for an index profile and vector layout."""
+    if profile_name not in PROFILES:
+        raise ValueError(f"Unknown index profile '{profile_name}', expected one of {sorted(PROFILES)}")
+    settings = PROFILES[profile_name]
+    vector_type = SearchFieldDataType.Collection(_VECTOR_TYPES[settings["vector_type"]])
+
+    fields = [
+        SimpleField(name="id", type=SearchFieldDataType.String, key=True, sortable=True, filterable=True, facetable=True),
+        SimpleField(name="from", type=SearchFieldDataType.String, filterable=True, facetable=True),  # Sender
+        SearchableField(name="to_list", type=SearchFieldDataType.String),  # Recipient list
+        SearchableField(name="cc_list", type=SearchFieldDataType.String),  # CC list
+        SearchableField(name="subject", type=SearchFieldDataType.String),  # Subject
+        SimpleField(name="important", type=SearchFieldDataType.Int32, filterable=True, facetable=True),  # Importance
+        SearchableField(name="body", type=SearchFieldDataType.String),  # Body
+        SimpleField(name="body_preview", type=SearchFieldDataType.String),  # Precomputed preview, retrieved instead of body
+        SearchableField(name="category", type=SearchFieldDataType.String, filterable=True),  # Category
+        SearchableField(name="attachment_names", type=SearchFieldDataType.Collection(SearchFieldDataType.String)),  # Attachments
+        SimpleField(name="received_time", type=SearchFieldDataType.DateTimeOffset, filterable=True),  # Received time
+        SimpleField(name="sent_time", type=SearchFieldDataType.DateTimeOffset, filterable=True, sortable=True),  # Sent time, filter-only results are ordered by it
+        SimpleField(name="size", type=SearchFieldDataType.Int32, filterable=True, facetable=True),  # Size
+        SimpleField(name="thread_id", type=SearchFieldDataType.String, filterable=True, facetable=True),  # Thread, see email_threads.py
+        SimpleField(name="message_id", type=SearchFieldDataType.String, filterable=True),  # Message-ID header
+        SimpleField(name="duplicate_count", type=SearchFieldDataType.Int32, filterable=True),  # Redundant copies folded into this email
+        SimpleField(name="duplicate_of", type=SearchFieldDataType.String, filterable=True),  # Set on metadata-only copies (no vectors)
+    ] + [
+        SearchField(
+            name=name,
+            type=vector_type,
+            searchable=True,
+            stored=settings["stored"],
+            vector_search_dimensions=dimensions,
+            vector_search_profile_name="myHnswProfile",
+        )
+        for name in vector_fields(layout)
+    ]
+
+    semantic_config = SemanticConfiguration(
+        name="my-semantic-config",
+        prioritized_fields=SemanticPrioritizedFields(
+            title_field=SemanticField(field_name="subject"),  # Use "subject" as the title field
+            keywords_fields=[SemanticField(field_name="category")],  # Use "category" as keywords
+            content_fields=[SemanticField(field_name="body")],  # Use "body" as the main content field
+        ),
+    )
+
+    return SearchIndex(
+        name=index_name,
+        fields=fields,
+        vector_search=build_vector_search(profile_name, openai_endpoint, embedding_deployment, openai_key),
+        semantic_search=SemanticSearch(configurations=[semantic_config]),
+    )
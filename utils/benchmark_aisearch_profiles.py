@@ -0,0 +1,164 @@
+# Benchmark of the Azure AI Search index profiles (see aisearch_profiles.py)
+#
+# For every profile a scratch index "<AZURE_SEARCH_INDEX>-bench-<profile>" is
+# created and loaded with the same emails and embeddings. The script then
+# reports per profile:
+#   • index size (storage and vector index size from the index statistics)
+#   • vector query latency (p50 / p95 over the query set)
+#   • recall@k against exact kNN on full-precision vectors (the "exhaustive" profile)
+#
+# Queries are the subjects of a sample of the emails, embedded once; embeddings
+# of documents and queries are cached in a JSON file so reruns cost no OpenAI calls.
+# Documents are embedded in EMAIL_VECTOR_LAYOUT (vector_layout.py); to compare the
+# layouts themselves use benchmark_vector_layouts.py.
+#
+#     python utils/benchmark_aisearch_profiles.py --profiles baseline scalar binary --k 10
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+import dotenv
+import requests
+from azure.core.credentials import AzureKeyCredential
+from azure.identity import DefaultAzureCredential
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.models import VectorizedQuery
+
+from aisearch_profiles import PROFILES, build_index
+from embedding_dimensions import EMBEDDING_DIMENSIONS, embedding_payload, fit_dimensions
+from vector_layout import EMAIL_VECTOR_LAYOUT, embed_document, query_vector_field, vector_fields
+
+dotenv.load_dotenv()
+
+# Configuration
+endpoint = os.environ["AZURE_SEARCH_SERVICE_ENDPOINT"]
+credential = AzureKeyCredential(os.getenv("AZURE_SEARCH_ADMIN_KEY", "")) if len(os.getenv("AZURE_SEARCH_ADMIN_KEY", "")) > 0 else DefaultAzureCredential()
+base_index_name = os.getenv("AZURE_SEARCH_INDEX", "vectest")
+
+azure_openai_embedding_deployment = os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT")
+azure_openai_key = os.getenv("AZURE_OPENAI_API_KEY")
+azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION")
+azure_openai_embedding_dimensions = EMBEDDING_DIMENSIONS
+
+index_client = SearchIndexClient(endpoint=endpoint, credential=credential)
+
+
+def get_embedding(text):
+    url = f"{azure_openai_endpoint}/openai/deployments/{azure_openai_embedding_deployment}/embeddings?api-version={azure_openai_api_version}"
+    headers = {"Content-Type": "application/json", "api-key": azure_openai_key}
+    response = requests.post(url, headers=headers, json=embedding_payload(text))
+    response.raise_for_status()
+    return fit_dimensions(response.json()["data"][0]["embedding"])
+
+
+def load_corpus(data_path, cache_path, num_queries, seed):
+    """Emails with the vectors of EMAIL_VECTOR_LAYOUT plus (query text, query vector) pairs, cached on disk."""
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        # Caches written before vector layouts existed hold split vectors
+        if cached.get("layout", "split") == EMAIL_VECTOR_LAYOUT:
+            return cached["documents"], cached["queries"]
+
+    with open(data_path, "r") as f:
+        # Metadata-only copies of thread emails (email_threads.py) have no vectors
+        documents = [doc for doc in json.load(f) if not doc.get("duplicate_of")]
+    for doc in documents:
+        embed_document(doc, get_embedding)
+    sample = random.Random(seed).sample(documents, min(num_queries, len(documents)))
+    queries = [{"text": doc["subject"], "vector": doc.get("subjectVector") or get_embedding(doc["subject"])} for doc in sample]
+    with open(cache_path, "w") as f:
+        json.dump({"layout": EMAIL_VECTOR_LAYOUT, "documents": documents, "queries": queries}, f)
+    return documents, queries
+
+
+def load_index(profile, documents):
+    """(Re)create the scratch index of a profile and upload the corpus; returns its SearchClient."""
+    name = f"{base_index_name}-bench-{profile}".lower().replace("_", "-")
+    try:
+        index_client.delete_index(name)
+    except Exception:
+        pass
+    index_client.create_or_update_index(
+        build_index(name, profile, azure_openai_embedding_dimensions, azure_openai_endpoint,
+                    azure_openai_embedding_deployment, azure_openai_key)
+    )
+    client = SearchClient(endpoint=endpoint, index_name=name, credential=credential)
+    for start in range(0, len(documents), 500):
+        client.upload_documents(documents=documents[start:start + 500])
+    # Indexing is asynchronous; wait until every document is searchable
+    deadline = time.time() + 300
+    while client.get_document_count() < len(documents) and time.time() < deadline:
+        time.sleep(2)
+    return name, client
+
+
+def run_queries(client, queries, k, exhaustive=False):
+    """Top-k ids and latency of a pure vector query on the searched vector field for every query."""
+    ids, latencies = [], []
+    for query in queries:
+        vector_query = VectorizedQuery(vector=query["vector"], k_nearest_neighbors=k, fields=query_vector_field(),
+                                       exhaustive=exhaustive)
+        start = time.perf_counter()
+        results = [r["id"] for r in client.search(search_text=None, vector_queries=[vector_query], select=["id"], top=k)]
+        latencies.append(time.perf_counter() - start)
+        ids.append(results)
+    return ids, latencies
+
+
+def index_size(name):
+    # Statistics lag behind indexing by a few seconds to minutes
+    time.sleep(5)
+    stats = index_client.get_index_statistics(name)
+    return stats.get("storage_size", 0), stats.get("vector_index_size", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare index size, latency and recall@k of the AI Search index profiles")
+    parser.add_argument("--profiles", nargs="+", default=[p for p in PROFILES if p != "exhaustive"], choices=sorted(PROFILES))
+    parser.add_argument("--data", default="extracted_emails.json", help="emails produced by process_raw_data.py")
+    parser.add_argument("--cache", default="benchmark_embeddings.json", help="embedding cache file")
+    parser.add_argument("--queries", type=int, default=50, help="number of sampled queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch indexes")
+    args = parser.parse_args()
+
+    documents, queries = load_corpus(args.data, args.cache, args.queries, args.seed)
+    print(f"{len(documents)} documents, {len(queries)} queries, vector fields {', '.join(vector_fields())}")
+
+    # Exact kNN over full-precision vectors is the recall baseline
+    truth_name, truth_client = load_index("exhaustive", documents)
+    truth, _ = run_queries(truth_client, queries, args.k, exhaustive=True)
+    created = [truth_name]
+
+    rows = []
+    for profile in args.profiles:
+        name, client = load_index(profile, documents)
+        created.append(name)
+        run_queries(client, queries[:5], args.k)  # warm-up
+        ids, latencies = run_queries(client, queries, args.k)
+        recall = statistics.mean(
+            len(set(found) & set(expected)) / len(expected) if expected else 1.0 for found, expected in zip(ids, truth)
+        )
+        storage, vector_size = index_size(name)
+        rows.append((profile, storage, vector_size, statistics.median(latencies),
+                     sorted(latencies)[int(0.95 * (len(latencies) - 1))], recall))
+
+    print()
+    print(f"{'profile':<14}{'storage MB':>12}{'vector MB':>11}{'p50 ms':>9}{'p95 ms':>9}{f'recall@{args.k}':>11}")
+    for profile, storage, vector_size, p50, p95, recall in rows:
+        print(f"{profile:<14}{storage / 2**20:>12.2f}{vector_size / 2**20:>11.2f}{p50 * 1000:>9.1f}{p95 * 1000:>9.1f}{recall:>11.3f}")
+
+    if not args.keep:
+        for name in created:
+            index_client.delete_index(name)
+
+
+if __name__ == "__main__":
+    main()
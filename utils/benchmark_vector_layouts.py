@@ -0,0 +1,237 @@
+# Benchmark of the split vs fused vector layouts (see vector_layout.py) on Cosmos DB
+#
+# Each layout gets a scratch container "<COSMOS_CONTAINER_NAME>-bench-<layout>"
+# (partitioning, indexing and full-text policies as in create_cosmosdb_index.py)
+# loaded with the same emails. The script reports per layout:
+#   • ingest cost   – embedding calls and tokens, write RUs, stored data size
+#   • retrieval     – known-item search: hit@k and MRR of the email a query was
+#                     written for, on two query sets:
+#                       subject    – the email's subject (favours the fused layout by
+#                                    construction: the subject is part of its vector)
+#                       paraphrase – a short query an LLM writes from the summary
+#                                    without reusing the subject (the fairer test)
+#   • query cost    – p50 / p95 latency and mean RU of vector-only and hybrid (RRF)
+#                     queries, as run by the apps
+#
+# Embeddings (with their token counts) and generated queries are cached in a JSON
+# file keyed by text, so reruns cost no OpenAI calls; the reported call and token
+# counts are those a fresh ingest makes.
+#
+#     python utils/benchmark_vector_layouts.py --queries 100 --k 10
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import time
+
+import requests
+from azure.cosmos import CosmosClient
+from azure.identity import DefaultAzureCredential
+from dotenv import load_dotenv
+
+from cosmos_partitioning import assign_partition_fields, partition_key_definition
+from create_cosmosdb_index import base_indexing_policy, full_text_policy
+from embedding_dimensions import EMBEDDING_DIMENSIONS, embedding_payload, fit_dimensions
+from result_fields import add_body_preview
+from vector_layout import ALL_VECTOR_FIELDS, LAYOUTS, cosmos_vector_policies, query_vector_field, vector_texts
+
+load_dotenv()
+
+# Configuration
+for name in ("CLIENT_ID", "CLIENT_SECRET", "TENANT_ID"):
+    os.environ[f"AZURE_{name}"] = os.getenv(f"AAD_{name}", "")
+cosmos_client = CosmosClient(os.getenv("COSMOS_URI"), credential=DefaultAzureCredential())
+database = cosmos_client.get_database_client(os.getenv("COSMOS_DB_NAME", "vectordb"))
+base_container_name = os.getenv("COSMOS_CONTAINER_NAME", "vectortest_hybridsearch")
+
+azure_openai_embedding_deployment = os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT")
+azure_openai_chat_deployment = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT")
+azure_openai_key = os.getenv("AZURE_OPENAI_API_KEY")
+azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION")
+
+PARAPHRASE_PROMPT = (
+    "Write the short search query (3 to 8 words) a user would type to find the email below again. "
+    "Do not copy the subject line. Return only the query."
+)
+
+
+def openai_post(deployment, operation, payload):
+    url = f"{azure_openai_endpoint}/openai/deployments/{deployment}/{operation}?api-version={azure_openai_api_version}"
+    headers = {"Content-Type": "application/json", "api-key": azure_openai_key}
+    response = requests.post(url, headers=headers, json=payload)
+    response.raise_for_status()
+    return response.json()
+
+
+class OpenAICache:
+    """Embeddings (with token counts) and paraphrased queries, persisted between runs."""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {"embeddings": {}, "paraphrases": {}}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.data = json.load(f)
+
+    def embed(self, text):
+        key = f"{EMBEDDING_DIMENSIONS}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+        if key not in self.data["embeddings"]:
+            response = openai_post(azure_openai_embedding_deployment, "embeddings", embedding_payload(text))
+            self.data["embeddings"][key] = {
+                "vector": fit_dimensions(response["data"][0]["embedding"]),
+                "tokens": response["usage"]["total_tokens"],
+            }
+        return self.data["embeddings"][key]
+
+    def paraphrase(self, doc):
+        if doc["id"] not in self.data["paraphrases"]:
+            response = openai_post(azure_openai_chat_deployment, "chat/completions", {
+                "messages": [
+                    {"role": "system", "content": PARAPHRASE_PROMPT},
+                    {"role": "user", "content": f"Subject: {doc.get('subject', '')}\n\n{doc.get('body', '')}"},
+                ],
+                "max_tokens": 30,
+                "temperature": 0,
+            })
+            self.data["paraphrases"][doc["id"]] = response["choices"][0]["message"]["content"].strip().strip('"')
+        return self.data["paraphrases"][doc["id"]]
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.data, f)
+
+
+def request_charge(container):
+    return float(container.client_connection.last_response_headers.get("x-ms-request-charge", 0))
+
+
+def storage_kb(container):
+    """Data size of the container; Cosmos DB updates it with a delay of a few seconds to minutes."""
+    container.read(populate_quota_info=True)
+    usage = container.client_connection.last_response_headers.get("x-ms-resource-usage", "")
+    values = dict(part.split("=", 1) for part in usage.split(";") if "=" in part)
+    return float(values.get("documentsSize", 0))
+
+
+def load_layout(layout, documents, cache):
+    """(Re)create the scratch container of a layout and ingest the emails; returns the container and ingest costs."""
+    name = f"{base_container_name}-bench-{layout}"
+    try:
+        database.delete_container(name)
+    except Exception:
+        pass
+    vector_embedding_policy, indexing_policy = cosmos_vector_policies(base_indexing_policy, EMBEDDING_DIMENSIONS, layout)
+    container = database.create_container(
+        id=name,
+        partition_key=partition_key_definition(),
+        vector_embedding_policy=vector_embedding_policy,
+        indexing_policy=indexing_policy,
+        full_text_policy=full_text_policy,
+    )
+    costs = {"calls": 0, "tokens": 0, "write_ru": 0.0}
+    for doc in documents:
+        item = {k: v for k, v in doc.items() if k not in ALL_VECTOR_FIELDS}
+        for field, text in vector_texts(doc, layout).items():
+            embedding = cache.embed(text)
+            item[field] = embedding["vector"]
+            costs["calls"] += 1
+            costs["tokens"] += embedding["tokens"]
+        container.upsert_item(assign_partition_fields(add_body_preview(item)))
+        costs["write_ru"] += request_charge(container)
+    return container, costs
+
+
+def run_queries(container, layout, queries, k, hybrid):
+    """Top-k ids, latency and RU charge of a vector-only or hybrid query for every query."""
+    field = query_vector_field(layout)
+    ids, latencies, charges = [], [], []
+    for query in queries:
+        literal = "[" + ",".join(str(x) for x in query["vector"]) + "]"
+        if hybrid:
+            safe_text = query["text"].replace("'", "\\'")
+            order_by = f"ORDER BY RANK RRF(VectorDistance(c.{field}, {literal}), FullTextScore(c.body, '{safe_text}'))"
+        else:
+            order_by = f"ORDER BY VectorDistance(c.{field}, {literal})"
+        found, charge = [], 0.0
+        start = time.perf_counter()
+        pages = container.query_items(query=f"SELECT TOP {k} c.id FROM c {order_by}", enable_cross_partition_query=True).by_page()
+        for page in pages:
+            found.extend(item["id"] for item in page)
+            charge += request_charge(container)
+        latencies.append(time.perf_counter() - start)
+        charges.append(charge)
+        ids.append(found)
+    return ids, latencies, charges
+
+
+def known_item_scores(ids, queries):
+    """hit@k and MRR of each query's source email."""
+    ranks = [found.index(query["target"]) + 1 if query["target"] in found else None for found, query in zip(ids, queries)]
+    hit = statistics.mean(1.0 if rank else 0.0 for rank in ranks)
+    mrr = statistics.mean(1.0 / rank if rank else 0.0 for rank in ranks)
+    return hit, mrr
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the split and fused vector layouts on Cosmos DB")
+    parser.add_argument("--data", default="extracted_emails.json", help="emails produced by process_raw_data.py")
+    parser.add_argument("--cache", default="benchmark_layout_cache.json", help="embedding / query cache file")
+    parser.add_argument("--queries", type=int, default=50, help="number of sampled emails to write queries for")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch containers")
+    args = parser.parse_args()
+
+    with open(args.data, "r") as f:
+        # Metadata-only copies of thread emails (email_threads.py) have no vectors
+        documents = [doc for doc in json.load(f) if not doc.get("duplicate_of")]
+    cache = OpenAICache(args.cache)
+    sample = random.Random(args.seed).sample(documents, min(args.queries, len(documents)))
+    query_sets = {
+        "subject": [{"target": doc["id"], "text": doc.get("subject") or ""} for doc in sample],
+        "paraphrase": [{"target": doc["id"], "text": cache.paraphrase(doc)} for doc in sample],
+    }
+    for queries in query_sets.values():
+        for query in queries:
+            query["vector"] = cache.embed(query["text"])["vector"]
+    print(f"{len(documents)} documents, {len(sample)} queries per set, {EMBEDDING_DIMENSIONS} dimensions")
+
+    ingest, retrieval, created = [], [], []
+    try:
+        for layout in LAYOUTS:
+            container, costs = load_layout(layout, documents, cache)
+            created.append(container.id)
+            cache.save()
+            for set_name, queries in query_sets.items():
+                for hybrid in (False, True):
+                    run_queries(container, layout, queries[:5], args.k, hybrid)  # warm-up
+                    ids, latencies, charges = run_queries(container, layout, queries, args.k, hybrid)
+                    hit, mrr = known_item_scores(ids, queries)
+                    retrieval.append((layout, set_name, "hybrid" if hybrid else "vector", hit, mrr,
+                                      statistics.median(latencies), sorted(latencies)[int(0.95 * (len(latencies) - 1))],
+                                      statistics.mean(charges)))
+            # Data size statistics lag behind the writes
+            time.sleep(10)
+            ingest.append((layout, costs, storage_kb(container)))
+    finally:
+        cache.save()
+        if not args.keep:
+            for name in created:
+                database.delete_container(name)
+
+    print()
+    print(f"{'layout':<8}{'emb calls':>11}{'emb tokens':>12}{'calls/email':>13}{'write RU':>11}{'RU/email':>10}{'data MB':>9}")
+    for layout, costs, size_kb in ingest:
+        print(f"{layout:<8}{costs['calls']:>11}{costs['tokens']:>12}{costs['calls'] / len(documents):>13.1f}"
+              f"{costs['write_ru']:>11.0f}{costs['write_ru'] / len(documents):>10.2f}{size_kb / 1024:>9.2f}")
+    print()
+    print(f"{'layout':<8}{'queries':<12}{'mode':<8}{f'hit@{args.k}':>8}{'MRR':>7}{'p50 ms':>9}{'p95 ms':>9}{'RU/query':>10}")
+    for layout, set_name, mode, hit, mrr, p50, p95, charge in retrieval:
+        print(f"{layout:<8}{set_name:<12}{mode:<8}{hit:>8.3f}{mrr:>7.3f}{p50 * 1000:>9.1f}{p95 * 1000:>9.1f}{charge:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
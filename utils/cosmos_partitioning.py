@@ -0,0 +1,276 @@
+# Partition layout of the Cosmos DB email container and query routing
+#
+# The container used to be partitioned on /id, so every search needed
+# enable_cross_partition_query=True and fanned out to every physical partition –
+# RU charge and latency grew with the container. COSMOS_PARTITION_STRATEGY picks
+# the layout a new container is created with (create_cosmosdb_index.py,
+# reindex.py):
+#
+#   id            – /id (previous layout; point reads only)
+#   sender        – /pk_sender: lower-cased sender address (mailbox-style queries)
+#   month         – /pk_month: 'YYYY-MM' bucket of sent_time (date-range queries)
+#   month_sender  – hierarchical [/pk_month, /pk_sender]
+#
+# pk_sender / pk_month are derived at ingest (assign_partition_fields) for every
+# layout, so a container can be reindexed into another layout without touching
+# the source. At query time the layout is read from the container itself, and
+# route() extracts partition keys from the translated filter's top-level AND
+# terms (c.from = / IN, c.sent_time ranges, c.id =). One full key becomes a
+# single-partition query; several keys or a hierarchical prefix become an extra
+# pk predicate that Cosmos DB uses to target only the matching partitions.
+# Anything else (OR, functions, open-ended ranges) still fans out.
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from azure.cosmos import PartitionKey
+
+try:
+    from .metadata_index import UnsupportedFilter, tokenize_filter
+    from .settings import getenv
+except ImportError:  # imported as a top-level module by the utils/ scripts
+    from metadata_index import UnsupportedFilter, tokenize_filter
+    from settings import getenv
+
+STRATEGIES = {
+    "id": ["/id"],
+    "sender": ["/pk_sender"],
+    "month": ["/pk_month"],
+    "month_sender": ["/pk_month", "/pk_sender"],
+}
+COSMOS_PARTITION_STRATEGY = getenv("COSMOS_PARTITION_STRATEGY", "id")
+# More target partitions than this and a fan-out is cheaper than a long IN list
+MAX_ROUTED_PARTITIONS = int(getenv("COSMOS_MAX_ROUTED_PARTITIONS", "12"))
+UNKNOWN_MONTH = "unknown"
+# sent_time literals that can be mapped to a pk_month bucket (ISO 8601, zero-padded month)
+_ISO_MONTH = re.compile(r"^\d{4}-(0[1-9]|1[0-2])")
+
+
+def partition_key_definition(strategy: Optional[str] = None) -> PartitionKey:
+    """PartitionKey for creating a container with the given (default: configured) strategy."""
+    strategy = strategy or COSMOS_PARTITION_STRATEGY
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown partition strategy '{strategy}', expected one of {sorted(STRATEGIES)}")
+    paths = STRATEGIES[strategy]
+    if len(paths) == 1:
+        return PartitionKey(path=paths[0])
+    return PartitionKey(path=paths, kind="MultiHash")
+
+
+def _sender_key(value: Any) -> str:
+    return (value or "").strip().lower()
+
+
+def _month_key(value: Any) -> str:
+    return (value or "")[:7] or UNKNOWN_MONTH
+
+
+def assign_partition_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the derived partition key fields (pk_sender, pk_month) to an email document."""
+    doc["pk_sender"] = _sender_key(doc.get("from"))
+    doc["pk_month"] = _month_key(doc.get("sent_time"))
+    return doc
+
+
+def _months(lo: str, hi: str) -> List[str]:
+    """'YYYY-MM' buckets from lo to hi inclusive."""
+    year, month = int(lo[:4]), int(lo[5:7])
+    months = []
+    while f"{year:04d}-{month:02d}" <= hi[:7] and len(months) <= MAX_ROUTED_PARTITIONS:
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def _enclosed(tokens: List[tuple]) -> bool:
+    """True when the whole token list is one parenthesized group."""
+    if len(tokens) < 2 or tokens[0] != ("op", "(") or tokens[-1] != ("op", ")"):
+        return False
+    depth = 0
+    for i, (kind, token) in enumerate(tokens):
+        if kind == "op" and token == "(":
+            depth += 1
+        elif kind == "op" and token == ")":
+            depth -= 1
+            if depth == 0 and i < len(tokens) - 1:
+                return False
+    return True
+
+
+def _split_and(tokens: List[tuple]) -> List[List[tuple]]:
+    """AND terms of a token list; parenthesized AND groups are split in turn, anything else stays one term."""
+    while _enclosed(tokens):
+        tokens = tokens[1:-1]
+    terms, current, depth, between = [], [], 0, False
+    for kind, token in tokens:
+        word = token.upper() if kind == "word" else None
+        if kind == "op" and token == "(":
+            depth += 1
+        elif kind == "op" and token == ")":
+            depth -= 1
+        if depth == 0 and word == "AND" and not between:
+            terms.append(current)
+            current = []
+            continue
+        # The AND of "BETWEEN x AND y" belongs to the term
+        between = word == "BETWEEN" or (between and word != "AND")
+        current.append((kind, token))
+    terms.append(current)
+    if len(terms) == 1:
+        return terms
+    return [t for term in terms for t in _split_and(term)]
+
+
+def _conjuncts(filter_str: str) -> List[List[tuple]]:
+    """
+    AND terms of a filter as token lists. A term with an OR anywhere in it (including a top-level
+    OR, which leaves the whole filter as one term) is dropped: it cannot pin down a partition key.
+    """
+    return [term for term in _split_and(list(tokenize_filter(filter_str)))
+            if not any(kind == "word" and token.upper() == "OR" for kind, token in term)]
+
+
+def _in_literals(term: List[tuple]) -> Optional[List[str]]:
+    """String literals of a term that is exactly `field IN ('a', 'b', ...)`, else None."""
+    inner = term[3:-1]
+    if len(term) < 5 or term[2] != ("op", "(") or term[-1] != ("op", ")") or len(inner) % 2 != 1:
+        return None
+    if any(kind != "string" for kind, _ in inner[::2]) or any(t != ("op", ",") for t in inner[1::2]):
+        return None
+    return [token for _, token in inner[::2]]
+
+
+def _month_literal(value: str) -> str:
+    """A sent_time bound; anything but an ISO date compares differently as a string, so it is not routed."""
+    if not _ISO_MONTH.match(value):
+        raise UnsupportedFilter(f"sent_time literal '{value}' is not an ISO 8601 date")
+    return value
+
+
+def _extract(filter_str: str) -> Dict[str, List[str]]:
+    """Candidate values per derived key ('id', 'pk_sender', 'pk_month') implied by the filter."""
+    keys: Dict[str, List[str]] = {}
+    lo = hi = None
+    for term in _conjuncts(filter_str):
+        if len(term) < 3 or term[0][0] != "field":
+            continue
+        name, (kind, op) = term[0][1], term[1]
+        # Only exact "field op 'literal'" shapes pin down a key
+        literal = term[2][1] if len(term) == 3 and term[2][0] == "string" else None
+        if name == "sent_time" and literal is not None:
+            literal = _month_literal(literal)
+        if name in ("id", "from") and kind == "op" and op == "=" and literal is not None:
+            keys["id" if name == "id" else "pk_sender"] = [literal if name == "id" else _sender_key(literal)]
+        elif name == "from" and kind == "word" and op.upper() == "IN" and _in_literals(term):
+            keys["pk_sender"] = sorted({_sender_key(v) for v in _in_literals(term)})
+        elif name == "sent_time" and kind == "op" and literal is not None:
+            if op == "=":
+                lo = hi = literal
+            elif op in (">", ">="):
+                lo = max(lo or "", literal)
+            elif op in ("<", "<="):
+                hi = min(hi or literal, literal)
+        elif (name == "sent_time" and kind == "word" and op.upper() == "BETWEEN" and len(term) == 5
+              and term[2][0] == term[4][0] == "string" and term[3][0] == "word" and term[3][1].upper() == "AND"):
+            start, end = _month_literal(term[2][1]), _month_literal(term[4][1])
+            lo, hi = max(lo or "", start), min(hi or end, end)
+    if lo and hi and len(lo) >= 7 and len(hi) >= 7:
+        keys["pk_month"] = _months(lo, hi)
+    return keys
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+@dataclass
+class Route:
+    """How to run a query: one partition key, an extra pk predicate, or a fan-out."""
+
+    partition_key: Any = None
+    predicate: str = ""
+    description: str = "all partitions"
+    partitions: Optional[int] = None
+
+    def where(self, filter_str: str) -> str:
+        """WHERE clause for the filter plus the routing predicate (empty string when neither)."""
+        terms = [f"({filter_str})" if filter_str and self.predicate else filter_str, self.predicate]
+        terms = [t for t in terms if t]
+        return f"WHERE {' AND '.join(terms)}" if terms else ""
+
+    def query_kwargs(self) -> Dict[str, Any]:
+        if self.partition_key is not None:
+            return {"partition_key": self.partition_key}
+        return {"enable_cross_partition_query": True}
+
+
+@dataclass
+class Layout:
+    """Partition key paths of a container, with helpers for point reads and routing."""
+
+    paths: List[str] = field(default_factory=lambda: list(STRATEGIES["id"]))
+
+    @property
+    def strategy(self) -> str:
+        return next((name for name, paths in STRATEGIES.items() if paths == self.paths), "custom")
+
+    def partition_value(self, doc: Dict[str, Any]) -> Any:
+        """Partition key value of a document (or metadata index row) for read_item / delete_item."""
+        values = []
+        for path in self.paths:
+            name = path.lstrip("/")
+            if name == "pk_sender":
+                values.append(_sender_key(doc.get("from")))
+            elif name == "pk_month":
+                values.append(_month_key(doc.get("sent_time")))
+            else:
+                values.append(doc.get(name))
+        return values[0] if len(values) == 1 else values
+
+    def route(self, filter_str: str) -> Route:
+        """Target only the partitions the filter can match."""
+        if not filter_str:
+            return Route()
+        try:
+            keys = _extract(filter_str)
+        except (UnsupportedFilter, ValueError):
+            # Routing only narrows a query; a filter it cannot read still runs as a fan-out
+            return Route()
+        names = [path.lstrip("/") for path in self.paths]
+        # Longest prefix of the key paths the filter pins down
+        known = []
+        for name in names:
+            if not keys.get(name) or len(keys[name]) > MAX_ROUTED_PARTITIONS:
+                break
+            known.append(name)
+        if not known:
+            return Route()
+        combinations = 1
+        for name in known:
+            combinations *= len(keys[name])
+        description = ", ".join(f"{name} in {keys[name]}" for name in known)
+        if len(known) == len(names) and combinations == 1:
+            value = keys[names[0]][0] if len(names) == 1 else [keys[name][0] for name in names]
+            return Route(partition_key=value, description=f"single partition ({description})", partitions=1)
+        if combinations > MAX_ROUTED_PARTITIONS:
+            return Route()
+        predicate = " AND ".join(
+            f"c.{name} IN ({', '.join(_literal(v) for v in keys[name])})" for name in known
+        )
+        return Route(predicate=predicate, description=f"targeted ({description})", partitions=combinations)
+
+
+_layouts: Dict[str, Layout] = {}
+_layouts_lock = threading.Lock()
+
+
+def layout_of(container) -> Layout:
+    """Partition layout of a container, read from its properties once per container."""
+    with _layouts_lock:
+        layout = _layouts.get(container.id)
+    if layout is None:
+        layout = Layout(list(container.read()["partitionKey"]["paths"]))
+        with _layouts_lock:
+            _layouts[container.id] = layout
+    return layout
@@ -1,76 +1,31 @@
 # Import needed modules  
 import os  
-from azure.cosmos import CosmosClient, PartitionKey  
+from azure.cosmos import CosmosClient  
 from azure.identity import DefaultAzureCredential  
 from dotenv import load_dotenv  
+from active_store import confirm_recreate  
+from embedding_dimensions import EMBEDDING_DIMENSIONS  
+from cosmos_partitioning import COSMOS_PARTITION_STRATEGY, partition_key_definition  
+from vector_layout import EMAIL_VECTOR_LAYOUT, cosmos_vector_policies, vector_fields  
   
 # Load environment variables from .env file  
 load_dotenv()  
   
-# Set your AAD credentials for Cosmos DB authentication  
-aad_client_id = os.getenv("AAD_CLIENT_ID")  
-aad_client_secret = os.getenv("AAD_CLIENT_SECRET")  
-aad_tenant_id = os.getenv("AAD_TENANT_ID")  
-  
-os.environ["AZURE_CLIENT_ID"] = aad_client_id  
-os.environ["AZURE_CLIENT_SECRET"] = aad_client_secret  
-os.environ["AZURE_TENANT_ID"] = aad_tenant_id  
-  
-# Configure your Cosmos DB connection settings  
-cosmos_uri = os.getenv("COSMOS_URI")  
-cosmos_db_name = os.getenv("COSMOS_DB_NAME", "vectordb")  
-container_name = os.getenv("COSMOS_CONTAINER_NAME", "vectortest_hybridsearch")  
-  
-# Create the CosmosClient using DefaultAzureCredential  
-credential = DefaultAzureCredential()  
-cosmos_client = CosmosClient(cosmos_uri, credential=credential)  
-  
-# Create the database if it does not exist  
-database = cosmos_client.create_database_if_not_exists(id=cosmos_db_name)  
-  
-# Check if the container exists and drop it if it does  
-try:  
-    container = database.get_container_client(container_name)  
-    print(f"Container '{container_name}' exists. Dropping...")  
-    container.delete_container()  
-    print(f"Container '{container_name}' dropped successfully.")  
-except Exception as e:  
-    print(f"Container '{container_name}' does not exist or cannot be accessed. Proceeding to create...")  
-  
-# Define the vector embedding policy for the two vector fields  
-vector_embedding_policy = {  
-    "vectorEmbeddings": [  
-        {  
-            "path": "/subjectVector",  
-            "dataType": "float32",  
-            "distanceFunction": "cosine",  
-            "dimensions": 1536  
-        },  
-        {  
-            "path": "/bodyVector",  
-            "dataType": "float32",  
-            "distanceFunction": "cosine",  
-            "dimensions": 1536  
-        }  
-    ]  
-}  
-  
-# Define the indexing policy  
-indexing_policy = {  
+# Define the indexing policy; the vector fields of EMAIL_VECTOR_LAYOUT are added below  
+base_indexing_policy = {  
     "indexingMode": "consistent",  
     "automatic": True,  
     "includedPaths": [{"path": "/"}],  
     "excludedPaths": [  
         {"path": "/_etag/?"},  
-        {"path": "/subjectVector/*"},  
-        {"path": "/bodyVector/*"}  
-    ],  
-    "vectorIndexes": [  
-        {"path": "/subjectVector", "type": "quantizedFlat"},  
-        {"path": "/bodyVector", "type": "quantizedFlat"}  
+        {"path": "/body_preview/?"}  
     ]  
 }  
   
+# Vector embedding policy and vector indexes (quantizedFlat) for 'subjectVector' + 'bodyVector' or the fused  
+# 'contentVector', see vector_layout.py; AZURE_OPENAI_EMB_DIMENSIONS, 1536 unless reduced  
+vector_embedding_policy, indexing_policy = cosmos_vector_policies(base_indexing_policy, EMBEDDING_DIMENSIONS)  
+  
 # Define the full-text policy  
 full_text_policy = {  
     "defaultLanguage": "en-US",  
@@ -84,13 +39,50 @@ full_text_policy = {
     ]  
 }  
   
-# Create the container  
-container = database.create_container(  
-    id=container_name,  
-    partition_key=PartitionKey(path="/id"),  
-    vector_embedding_policy=vector_embedding_policy,  
-    indexing_policy=indexing_policy,  
-    full_text_policy=full_text_policy,  
-)  
+if __name__ == "__main__":  
+    # Set your AAD credentials for Cosmos DB authentication  
+    aad_client_id = os.getenv("AAD_CLIENT_ID")  
+    aad_client_secret = os.getenv("AAD_CLIENT_SECRET")  
+    aad_tenant_id = os.getenv("AAD_TENANT_ID")  
+  
+    os.environ["AZURE_CLIENT_ID"] = aad_client_id  
+    os.environ["AZURE_CLIENT_SECRET"] = aad_client_secret  
+    os.environ["AZURE_TENANT_ID"] = aad_tenant_id  
+  
+    # Configure your Cosmos DB connection settings  
+    cosmos_uri = os.getenv("COSMOS_URI")  
+    cosmos_db_name = os.getenv("COSMOS_DB_NAME", "vectordb")  
+    container_name = os.getenv("COSMOS_CONTAINER_NAME", "vectortest_hybridsearch")  
+  
+    # Refuse to drop a container the active-store pointer does not name, unless confirmed  
+    if not confirm_recreate("cosmos", container_name):  
+        raise SystemExit(f"Container '{container_name}' left unchanged.")  
+  
+    # Create the CosmosClient using DefaultAzureCredential  
+    credential = DefaultAzureCredential()  
+    cosmos_client = CosmosClient(cosmos_uri, credential=credential)  
+  
+    # Create the database if it does not exist  
+    database = cosmos_client.create_database_if_not_exists(id=cosmos_db_name)  
+  
+    # Check if the container exists and drop it if it does (first setup only; to change the  
+    # schema of a live container without downtime use reindex.py)  
+    try:  
+        container = database.get_container_client(container_name)  
+        print(f"Container '{container_name}' exists. Dropping...")  
+        container.delete_container()  
+        print(f"Container '{container_name}' dropped successfully.")  
+    except Exception as e:  
+        print(f"Container '{container_name}' does not exist or cannot be accessed. Proceeding to create...")  
+  
+    # Create the container  
+    container = database.create_container(  
+        id=container_name,  
+        partition_key=partition_key_definition(),  # COSMOS_PARTITION_STRATEGY, see cosmos_partitioning.py  
+        vector_embedding_policy=vector_embedding_policy,  
+        indexing_policy=indexing_policy,  
+        full_text_policy=full_text_policy,  
+    )  
   
-print(f"Container '{container_name}' created with vector indexing on 'subjectVector' and 'bodyVector'.")  
\ No newline at end of file
+    print(f"Container '{container_name}' created with vector indexing on {', '.join(vector_fields())} "  
+          f"('{EMAIL_VECTOR_LAYOUT}' layout), partitioned by '{COSMOS_PARTITION_STRATEGY}'.")  
\ No newline at end of file
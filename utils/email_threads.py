@@ -0,0 +1,227 @@
+# Thread detection and duplicate collapsing
+#
+# Every .msg file used to become its own document, so a long reply chain – each
+# message quoting all the previous ones – turned into dozens of nearly identical
+# documents, each summarized, embedded and indexed, and top-k results were
+# crowded with copies of one thread. Now:
+#
+#   • at ingest (process_raw_data.py), before any OpenAI call, messages are
+#     grouped into threads from their Message-ID / In-Reply-To / References
+#     headers, plus normalized subjects ("RE: FW: Budget" -> "budget") of
+#     replies between overlapping participants (sent items often lack transport
+#     headers). Within a thread, a message whose body shingles are contained in a
+#     longer message's (>= EMAIL_DUPLICATE_CONTAINMENT, e.g. the quoted history of
+#     a later reply) and whose attachments it also carries is a redundant copy:
+#     it is not summarized or embedded, only stored as a thin metadata row (its own
+#     sender, recipients and times, so filters still find it) with duplicate_of set
+#     to the email carrying its content. That email records how many copies it
+#     stands for (duplicate_count). A second copy of the same Message-ID is not
+#     stored at all.
+#   • every document gets a thread_id (uuid5 of the thread's root Message-ID, see
+#     thread_root) and a message_id; document ids derive from the Message-ID, so
+#     re-ingesting the same message overwrites it instead of adding a copy. The
+#     per-blob Azure Function applies the same rule one message at a time: the
+#     first References entry, else the thread_id of the In-Reply-To parent already
+#     in the index, else the parent's Message-ID (the root of a two-message thread).
+#   • at query time collapse_threads() keeps the best-ranked result per thread.
+import re
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set
+
+try:
+    from .settings import getenv
+except ImportError:  # imported as a top-level module by the utils/ scripts
+    from settings import getenv
+
+# Share of a message's body shingles that must appear in a longer message of the thread
+DUPLICATE_CONTAINMENT = float(getenv("EMAIL_DUPLICATE_CONTAINMENT", "0.9"))
+# Bodies with fewer shingles only count as copies when identical ("Thanks!" is not a copy of every reply)
+MIN_SHINGLES = 5
+SHINGLE_SIZE = 3
+
+_REPLY_PREFIX = re.compile(r"^\s*(re|fw|fwd|aw|wg|sv|vs|antw|tr|rv)\s*(\[\d+\])?\s*:\s*", re.IGNORECASE)
+_TAG_PREFIX = re.compile(r"^\s*\[[^\]]*\]\s*")
+_MESSAGE_ID = re.compile(r"<[^<>\s]+>")
+_WORD = re.compile(r"\w+")
+
+
+def normalize_subject(subject: str) -> str:
+    """Subject without reply / forward prefixes and [tags], lower-cased, whitespace collapsed."""
+    subject = subject or ""
+    while True:
+        stripped = _TAG_PREFIX.sub("", _REPLY_PREFIX.sub("", subject))
+        if stripped == subject:
+            break
+        subject = stripped
+    return " ".join(subject.split()).lower()
+
+
+def is_reply(subject: str) -> bool:
+    return normalize_subject(subject) != " ".join((subject or "").split()).lower()
+
+
+def normalize_message_id(value: Optional[str]) -> str:
+    value = (value or "").strip()
+    match = _MESSAGE_ID.search(value)
+    return (match.group() if match else value).strip("<>").lower()
+
+
+def parse_references(value: Optional[str]) -> List[str]:
+    """Message-IDs of a References header, oldest (the thread root) first."""
+    return [normalize_message_id(m) for m in _MESSAGE_ID.findall(value or "")]
+
+
+def thread_id_for(root: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"email-thread:{root}"))
+
+
+def email_id_for(message_id: str) -> str:
+    """Document id of a message: stable per Message-ID, random without one."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"email:{message_id}")) if message_id else str(uuid.uuid4())
+
+
+def body_shingles(text: str) -> FrozenSet[int]:
+    """Hashed word 3-grams of a plain-text body; quote markers and line breaks do not matter."""
+    words = _WORD.findall((text or "").lower())
+    if len(words) < SHINGLE_SIZE:
+        return frozenset([zlib.crc32(" ".join(words).encode("utf-8"))]) if words else frozenset()
+    return frozenset(
+        zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8")) for i in range(len(words) - SHINGLE_SIZE + 1)
+    )
+
+
+def is_contained(shingles: FrozenSet[int], other: FrozenSet[int]) -> bool:
+    """True when a body is a near-duplicate of (or quoted in full by) the other one."""
+    if not shingles:
+        return False
+    if len(shingles) < MIN_SHINGLES:
+        return shingles == other
+    return len(shingles & other) / len(shingles) >= DUPLICATE_CONTAINMENT
+
+
+@dataclass
+class MessageRecord:
+    """What thread detection needs from one message: headers, participants and the plain-text body."""
+    key: str  # file path (or any unique handle)
+    message_id: str = ""
+    in_reply_to: str = ""
+    references: List[str] = field(default_factory=list)
+    subject: str = ""
+    participants: FrozenSet[str] = frozenset()
+    attachments: FrozenSet[str] = frozenset()
+    sent_time: str = ""
+    body: str = ""
+
+    def root(self) -> str:
+        """
+        Root Message-ID as far as this message's own headers tell: References starts at the root,
+        In-Reply-To only names the parent (the root when the parent is not a reply itself).
+        """
+        if self.references:
+            return self.references[0]
+        return self.in_reply_to or self.message_id or f"subject:{normalize_subject(self.subject)}"
+
+
+@dataclass
+class ThreadAssignment:
+    thread_id: str
+    message_id: str
+    duplicate_of: Optional[str] = None  # key of the kept message this one is a copy of
+    duplicate_count: int = 0
+
+    def document_fields(self) -> Dict[str, Any]:
+        return {"thread_id": self.thread_id, "message_id": self.message_id, "duplicate_of": None,
+                "duplicate_count": self.duplicate_count}
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent: Dict[str, str] = {}
+
+    def find(self, node: str) -> str:
+        self.parent.setdefault(node, node)
+        while self.parent[node] != node:
+            self.parent[node] = self.parent[self.parent[node]]
+            node = self.parent[node]
+        return node
+
+    def union(self, a: str, b: str) -> None:
+        self.parent[self.find(a)] = self.find(b)
+
+
+def assign_threads(records: Iterable[MessageRecord]) -> Dict[str, ThreadAssignment]:
+    """Thread of every message and, within each thread, which messages are redundant copies."""
+    records = list(records)
+    groups = _UnionFind()
+    for record in records:
+        node = f"msg:{record.key}"
+        groups.find(node)
+        # Messages meet through the Message-IDs they carry or reference, even when the referenced one is missing
+        for message_id in [record.message_id, record.in_reply_to, *record.references]:
+            if message_id:
+                groups.union(node, f"id:{message_id}")
+    by_subject: Dict[str, List[MessageRecord]] = {}
+    for record in records:
+        subject = normalize_subject(record.subject)
+        if subject:
+            by_subject.setdefault(subject, []).append(record)
+    for same_subject in by_subject.values():
+        for i, record in enumerate(same_subject):
+            for other in same_subject[i + 1:]:
+                if (is_reply(record.subject) or is_reply(other.subject)) and record.participants & other.participants:
+                    groups.union(f"msg:{record.key}", f"msg:{other.key}")
+
+    threads: Dict[str, List[MessageRecord]] = {}
+    for record in records:
+        threads.setdefault(groups.find(f"msg:{record.key}"), []).append(record)
+
+    assignments: Dict[str, ThreadAssignment] = {}
+    for members in threads.values():
+        thread_id = thread_id_for(thread_root(members))
+        shingles = {r.key: body_shingles(r.body) for r in members}
+        # Most complete messages first: a later reply quoting the whole chain is kept, the chain folds into it
+        kept: List[MessageRecord] = []
+        for record in sorted(members, key=lambda r: (len(shingles[r.key]), r.sent_time, r.key), reverse=True):
+            original = next((
+                k for k in kept
+                if (record.message_id and record.message_id == k.message_id)
+                or (is_contained(shingles[record.key], shingles[k.key]) and record.attachments <= k.attachments)
+            ), None)
+            assignments[record.key] = ThreadAssignment(thread_id, record.message_id,
+                                                       duplicate_of=original.key if original else None)
+            if original:
+                assignments[original.key].duplicate_count += 1
+            else:
+                kept.append(record)
+    return assignments
+
+
+def thread_root(members: Iterable[MessageRecord]) -> str:
+    """
+    Root Message-ID of a thread: the first References entry of its earliest member carrying one
+    (every reply of a chain names the same root there), else the earliest member's own root.
+    """
+    ordered = sorted(members, key=lambda r: (r.sent_time or "~", r.key))
+    return next((r.references[0] for r in ordered if r.references), ordered[0].root())
+
+
+def thread_key(item: Dict[str, Any]) -> str:
+    """Collapse key of a search result: its thread, or itself for documents ingested before threads existed."""
+    return item.get("thread_id") or item.get("id")
+
+
+def collapse_threads(items: Iterable[Any], seen: Optional[Set[str]] = None,
+                     key: Callable[[Any], str] = thread_key) -> Iterator[Any]:
+    """
+    Best-ranked result of each thread, in rank order (lazily). `seen` holds the threads of
+    results shown on earlier pages and is updated, so later pages skip them too.
+    """
+    seen = set() if seen is None else seen
+    for item in items:
+        thread = key(item)
+        if thread in seen:
+            continue
+        seen.add(thread)
+        yield item
@@ -0,0 +1,45 @@
+# Configurable embedding dimensions
+#
+# Vectors used to be 1536-dimensional everywhere. AZURE_OPENAI_EMB_DIMENSIONS
+# (e.g. 256 or 512) now flows through index creation, ingestion and query
+# embedding; smaller vectors cut index storage, Cosmos DB RUs and the cost of
+# every vector comparison several-fold.
+#
+# How the reduced vector is obtained (AZURE_OPENAI_EMB_DIMENSION_MODE):
+#   • "api"      – the embeddings API's `dimensions` parameter
+#                  (text-embedding-3-* deployments only)
+#   • "truncate" – request the full vector and keep the first N components,
+#                  re-normalized to unit length. For text-embedding-3 models this
+#                  matches "api"; it is also what migrate_embedding_dimensions.py
+#                  does to vectors that are already stored.
+# At the native size (AZURE_OPENAI_EMB_NATIVE_DIMENSIONS, 1536) nothing changes,
+# so ada-002 deployments keep working without the `dimensions` parameter.
+import math
+
+try:
+    from .settings import getenv
+except ImportError:  # imported as a top-level module by the utils/ scripts
+    from settings import getenv
+
+EMBEDDING_DIMENSIONS = int(getenv("AZURE_OPENAI_EMB_DIMENSIONS", "1536"))
+NATIVE_EMBEDDING_DIMENSIONS = int(getenv("AZURE_OPENAI_EMB_NATIVE_DIMENSIONS", "1536"))
+EMBEDDING_DIMENSION_MODE = getenv("AZURE_OPENAI_EMB_DIMENSION_MODE", "api")
+EMBEDDING_MODEL_NAME = getenv("AZURE_OPENAI_EMB_MODEL", "text-embedding-ada-002")
+
+
+def embedding_payload(text):
+    """Request body for the embeddings REST API, asking for reduced dimensions when configured."""
+    payload = {"input": text}
+    if EMBEDDING_DIMENSION_MODE == "api" and EMBEDDING_DIMENSIONS != NATIVE_EMBEDDING_DIMENSIONS:
+        payload["dimensions"] = EMBEDDING_DIMENSIONS
+    return payload
+
+
+def fit_dimensions(vector, dimensions=None):
+    """Truncate a vector to `dimensions` (default: the configured size) and re-normalize it."""
+    dimensions = dimensions or EMBEDDING_DIMENSIONS
+    if len(vector) <= dimensions:
+        return vector
+    vector = vector[:dimensions]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
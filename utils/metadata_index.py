@@ -0,0 +1,337 @@
+# Local metadata / facet index for the email corpus
+#
+# Filter-only requests ("all Urgent emails from bob@… last week"), counts and
+# facets (top senders, emails per day) have no semantic component, yet the
+# Cosmos DB path embeds the search text and ranks with RRF(VectorDistance,
+# FullTextScore) for them. This module keeps the filterable metadata of every
+# email – from, recipients, category, important, sent/received time, size –
+# in a small SQLite file next to the application: one narrow row per email,
+# one B-tree index per column and a (address -> email) recipients table, so
+# such queries are answered in milliseconds without touching the vector store.
+#
+# The file lives at the repository root (METADATA_INDEX_PATH), so the apps, the
+# MCP servers and the utils/ scripts share it whatever their working directory.
+# It records which container it was built from and when; readers use it only
+# while it covers the live container (covers()) and otherwise fall back to
+# Cosmos DB. It is rebuilt from the live container with
+#     python utils/metadata_index.py --rebuild
+# (reindex.py copy cosmos --switch does this itself) and kept current by the
+# ingestion scripts (upload_documents_cosmos.py).
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from .active_store import active_entry, active_name
+    from .settings import getenv
+except ImportError:  # imported as a top-level module by the utils/ scripts
+    from active_store import active_entry, active_name
+    from settings import getenv
+
+METADATA_INDEX_PATH = getenv(
+    "METADATA_INDEX_PATH", str(Path(__file__).resolve().parent.parent / "metadata_index.sqlite")
+)
+
+# Document fields held by the index -> SQLite column
+FIELDS = {
+    "id": "id",
+    "from": "sender",
+    "to_list": "to_list",
+    "cc_list": "cc_list",
+    "category": "category",
+    "important": "important",
+    "sent_time": "sent_time",
+    "received_time": "received_time",
+    "size": "size",
+}
+# Pseudo field for facets over individual recipient addresses (to + cc)
+RECIPIENT_FACET = "recipient"
+HISTOGRAM_INTERVALS = {
+    "day": "substr(sent_time, 1, 10)",
+    "week": "strftime('%Y-W%W', substr(sent_time, 1, 19))",
+    "month": "substr(sent_time, 1, 7)",
+    "year": "substr(sent_time, 1, 4)",
+}
+
+_ADDRESS_RE = re.compile(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}")
+_TOKEN_RE = re.compile(
+    r"""\s*(?:
+        (?P<field>c\s*\.\s*[A-Za-z_]\w*|c\s*\[\s*["'][A-Za-z_]\w*["']\s*\])
+      | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+      | (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<op><=|>=|<>|!=|=|<|>|\(|\)|,)
+      | (?P<word>[A-Za-z_]\w*)
+    )""",
+    re.VERBOSE,
+)
+# Keywords and (Cosmos DB SQL) functions the translator passes through
+_KEYWORDS = {"AND", "OR", "NOT", "IN", "BETWEEN", "TRUE", "FALSE", "NULL"}
+_FUNCTIONS = {"CONTAINS", "STARTSWITH", "ENDSWITH", "LOWER", "UPPER"}
+
+
+class UnsupportedFilter(ValueError):
+    """The filter uses fields or syntax the metadata index cannot evaluate."""
+
+
+def _cosmos_contains(value, part, ignore_case=False):
+    if value is None or part is None:
+        return None
+    return int(part.lower() in value.lower()) if ignore_case else int(part in value)
+
+
+def _cosmos_startswith(value, part, ignore_case=False):
+    if value is None or part is None:
+        return None
+    return int(value.lower().startswith(part.lower())) if ignore_case else int(value.startswith(part))
+
+
+def _cosmos_endswith(value, part, ignore_case=False):
+    if value is None or part is None:
+        return None
+    return int(value.lower().endswith(part.lower())) if ignore_case else int(value.endswith(part))
+
+
+def tokenize_filter(filter_str: str) -> Iterator[Tuple[str, Any]]:
+    """
+    Split a Cosmos DB SQL filter on alias 'c' into (kind, value) tokens: ("field", name),
+    ("string", unescaped text), ("number", int/float), ("op", operator) or ("word", keyword).
+    Raises UnsupportedFilter on anything that is not one of those.
+    """
+    pos = 0
+    filter_str = filter_str.strip()
+    while pos < len(filter_str):
+        match = _TOKEN_RE.match(filter_str, pos)
+        if match is None or match.end() == pos:
+            raise UnsupportedFilter(f"Cannot parse filter near: {filter_str[pos:pos + 20]!r}")
+        pos = match.end()
+        kind, token = match.lastgroup, match.group(match.lastgroup)
+        if kind == "field":
+            yield kind, re.sub(r"""^c\s*(?:\.\s*|\[\s*["'])|["']\s*\]$""", "", token)
+        elif kind == "string":
+            yield kind, re.sub(r"\\(.)", r"\1", token[1:-1])
+        elif kind == "number":
+            yield kind, float(token) if "." in token else int(token)
+        else:
+            yield kind, token
+
+
+def translate_filter(filter_str: str) -> Tuple[str, List[Any]]:
+    """
+    Translate a Cosmos DB SQL filter on alias 'c' (as produced by the query generator) into a
+    parameterized SQLite WHERE expression. Only indexed fields, literals, comparison/boolean
+    operators and a few string functions are accepted; anything else raises UnsupportedFilter,
+    so the caller can fall back to Cosmos DB.
+    """
+    sql, params = [], []
+    for kind, token in tokenize_filter(filter_str):
+        if kind == "field":
+            if token not in FIELDS:
+                raise UnsupportedFilter(f"Field '{token}' is not in the metadata index")
+            sql.append(FIELDS[token])
+        elif kind in ("string", "number"):
+            sql.append("?")
+            params.append(token)
+        elif kind == "op":
+            sql.append("!=" if token == "<>" else token)
+        else:
+            upper = token.upper()
+            if upper in ("TRUE", "FALSE"):
+                sql.append("1" if upper == "TRUE" else "0")
+            elif upper in _KEYWORDS or upper in _FUNCTIONS:
+                sql.append(upper)
+            else:
+                raise UnsupportedFilter(f"Unsupported keyword or function '{token}'")
+    return " ".join(sql), params
+
+
+class MetadataIndex:
+    """SQLite-backed metadata index; safe to share between threads."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or METADATA_INDEX_PATH
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.create_function("CONTAINS", -1, _cosmos_contains, deterministic=True)
+        self._db.create_function("STARTSWITH", -1, _cosmos_startswith, deterministic=True)
+        self._db.create_function("ENDSWITH", -1, _cosmos_endswith, deterministic=True)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS emails (
+                id TEXT PRIMARY KEY, sender TEXT, to_list TEXT, cc_list TEXT, category TEXT,
+                important INTEGER, sent_time TEXT, received_time TEXT, size INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS emails_sender ON emails (sender);
+            CREATE INDEX IF NOT EXISTS emails_category ON emails (category);
+            CREATE INDEX IF NOT EXISTS emails_important ON emails (important);
+            CREATE INDEX IF NOT EXISTS emails_sent_time ON emails (sent_time);
+            CREATE INDEX IF NOT EXISTS emails_size ON emails (size);
+            CREATE TABLE IF NOT EXISTS recipients (email_id TEXT NOT NULL, address TEXT NOT NULL, kind TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS recipients_address ON recipients (address);
+            CREATE INDEX IF NOT EXISTS recipients_email ON recipients (email_id);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+
+    # ------------- coverage ------------------
+    def info(self) -> Dict[str, str]:
+        """Container the index was built from ('container') and when ('built_at', UTC ISO 8601); {} if never built."""
+        with self._lock:
+            return dict(self._db.execute("SELECT key, value FROM meta").fetchall())
+
+    def covers(self, container_name: str) -> bool:
+        """
+        True when the index was fully built from `container_name` after the active-store pointer last
+        switched; otherwise its rows may be missing or stale and callers must query Cosmos DB.
+        """
+        info = self.info()
+        if info.get("container") != container_name or not info.get("built_at"):
+            return False
+        switched_at = (active_entry("cosmos") or {}).get("switched_at")
+        return not switched_at or info["built_at"] >= switched_at
+
+    def rebuild(self, container, batch_size: int = 1000) -> int:
+        """Replace the whole index with the metadata of every email in `container`; returns the count."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            # Not covering anything while rows are missing: readers use Cosmos DB meanwhile
+            self._db.execute("DELETE FROM meta")
+            self._db.execute("DELETE FROM emails")
+            self._db.execute("DELETE FROM recipients")
+            self._db.execute("COMMIT")
+        built_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        # Project only the metadata fields – vectors and bodies are never read
+        projection = ", ".join(f'c["{field}"]' for field in FIELDS)
+        items = container.query_items(query=f"SELECT {projection} FROM c", enable_cross_partition_query=True)
+        batch, total = [], 0
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                total += self.upsert(batch)
+                batch = []
+        total += self.upsert(batch)
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                 [("container", container.id), ("built_at", built_at)])
+        return total
+
+    # ------------- maintenance (called by ingestion) ------------------
+    def upsert(self, emails: Iterable[Dict[str, Any]]) -> int:
+        """Add or replace the metadata of the given email documents; returns the number written."""
+        rows, recipient_rows = [], []
+        for email in emails:
+            rows.append(tuple(email.get(field) for field in FIELDS))
+            for kind in ("to_list", "cc_list"):
+                for address in _ADDRESS_RE.findall(email.get(kind) or ""):
+                    recipient_rows.append((email["id"], address.lower(), kind[:2]))
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO emails ({', '.join(FIELDS.values())}) VALUES ({', '.join('?' * len(FIELDS))})",
+                rows,
+            )
+            self._db.executemany("DELETE FROM recipients WHERE email_id = ?", [(row[0],) for row in rows])
+            self._db.executemany("INSERT INTO recipients (email_id, address, kind) VALUES (?, ?, ?)", recipient_rows)
+            self._db.execute("COMMIT")
+        return len(rows)
+
+    def delete(self, ids: Iterable[str]) -> None:
+        ids = [(i,) for i in ids]
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("DELETE FROM emails WHERE id = ?", ids)
+            self._db.executemany("DELETE FROM recipients WHERE email_id = ?", ids)
+            self._db.execute("COMMIT")
+
+    # ------------- queries ------------------
+    def search(self, filter_str: str = "", limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """Metadata of the newest emails matching the filter (raises UnsupportedFilter)."""
+        where, params = self._where(filter_str)
+        columns = list(FIELDS.values())
+        rows = self._query(
+            f"SELECT {', '.join(columns)} FROM emails {where} ORDER BY sent_time DESC LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        )
+        return [{field: value for field, value in zip(FIELDS, row)} for row in rows]
+
+    def count(self, filter_str: str = "") -> int:
+        where, params = self._where(filter_str)
+        return self._query(f"SELECT COUNT(*) FROM emails {where}", params)[0][0]
+
+    def facet(self, field: str, filter_str: str = "", limit: int = 10) -> List[Tuple[Any, int]]:
+        """Most frequent values of `field` (or of RECIPIENT_FACET) among the matching emails."""
+        where, params = self._where(filter_str)
+        if field == RECIPIENT_FACET:
+            query = (
+                f"SELECT r.address, COUNT(*) AS n FROM recipients r JOIN (SELECT id FROM emails {where}) e "
+                "ON e.id = r.email_id GROUP BY r.address ORDER BY n DESC LIMIT ?"
+            )
+        elif field in FIELDS and field != "id":
+            column = FIELDS[field]
+            query = f"SELECT {column}, COUNT(*) AS n FROM emails {where} GROUP BY {column} ORDER BY n DESC LIMIT ?"
+        else:
+            raise UnsupportedFilter(f"Cannot facet on '{field}'")
+        return [tuple(row) for row in self._query(query, params + [limit])]
+
+    def histogram(self, filter_str: str = "", interval: str = "day") -> List[Tuple[str, int]]:
+        """Number of matching emails per sent_time bucket ('day', 'week', 'month' or 'year')."""
+        if interval not in HISTOGRAM_INTERVALS:
+            raise ValueError(f"interval must be one of {sorted(HISTOGRAM_INTERVALS)}")
+        where, params = self._where(filter_str)
+        where = f"{where} AND sent_time IS NOT NULL" if where else "WHERE sent_time IS NOT NULL"
+        bucket = HISTOGRAM_INTERVALS[interval]
+        rows = self._query(
+            f"SELECT {bucket} AS bucket, COUNT(*) FROM emails {where} GROUP BY bucket ORDER BY bucket", params
+        )
+        return [tuple(row) for row in rows]
+
+    def _query(self, query: str, params: List[Any]) -> List[Tuple[Any, ...]]:
+        try:
+            with self._lock:
+                return self._db.execute(query, params).fetchall()
+        except sqlite3.OperationalError as e:
+            # Tokens were all valid but do not form a valid expression (e.g. unbalanced parentheses)
+            raise UnsupportedFilter(f"Invalid filter: {e}") from e
+
+    def _where(self, filter_str: str) -> Tuple[str, List[Any]]:
+        if not filter_str or not filter_str.strip():
+            return "", []
+        expression, params = translate_filter(filter_str)
+        return f"WHERE ({expression})", params
+
+
+def is_filter_only(query_json: Optional[Dict[str, Any]]) -> bool:
+    """True for generated queries that carry a filter but no semantic search text."""
+    return bool(query_json) and not (query_json.get("search_text") or "").strip() and bool(
+        (query_json.get("filter") or "").strip()
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rebuild the local metadata index from the Cosmos DB container")
+    parser.add_argument("--rebuild", action="store_true", help="scan the container and (re)index every email")
+    args = parser.parse_args()
+    if args.rebuild:
+        from azure.cosmos import CosmosClient
+        from azure.identity import DefaultAzureCredential
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        os.environ["AZURE_CLIENT_ID"] = os.getenv("AAD_CLIENT_ID", "")
+        os.environ["AZURE_CLIENT_SECRET"] = os.getenv("AAD_CLIENT_SECRET", "")
+        os.environ["AZURE_TENANT_ID"] = os.getenv("AAD_TENANT_ID", "")
+        container = (
+            CosmosClient(os.getenv("COSMOS_URI"), credential=DefaultAzureCredential())
+            .get_database_client(os.getenv("COSMOS_DB_NAME", "vectordb"))
+            # Live container: the active-store pointer flipped by reindex.py, else COSMOS_CONTAINER_NAME
+            .get_container_client(active_name("cosmos", os.getenv("COSMOS_CONTAINER_NAME", "vectortest_hybridsearch")))
+        )
+        index = MetadataIndex()
+        total = index.rebuild(container)
+        print(f"Indexed metadata of {total} emails from '{container.id}' into {index.path}")
@@ -0,0 +1,155 @@
+# Migrate stored email vectors to a smaller embedding size
+#
+# Copies every email from the current Cosmos DB container / AI Search index into
+# a NEW container / index whose vector fields have `--dimensions` dimensions:
+#
+#   • default    – the stored vectors are truncated and re-normalized
+#                  (fit_dimensions). Valid for text-embedding-3 models, whose
+#                  leading components carry most of the information; no OpenAI calls.
+#   • --reembed  – subject and body are embedded again at the target size (needed
+#                  for ada-002 vectors, or an AI Search index that does not store
+#                  its vectors, i.e. the compressed profiles). Also needed to move to
+#                  another --layout (split / fused, see vector_layout.py).
+#
+# The source is left untouched. Once the copy looks good, point
+# COSMOS_CONTAINER_NAME / AZURE_SEARCH_INDEX at the target and set
+# AZURE_OPENAI_EMB_DIMENSIONS to the same size so queries are embedded to match.
+#
+#     python utils/migrate_embedding_dimensions.py cosmos --target vectortest_256 --dimensions 256
+#     python utils/migrate_embedding_dimensions.py aisearch --target vectest-256 --dimensions 256 --profile scalar
+#     python utils/migrate_embedding_dimensions.py cosmos --target vectortest_fused --dimensions 1536 --reembed --layout fused
+import argparse
+import os
+
+import requests
+from dotenv import load_dotenv
+
+from embedding_dimensions import NATIVE_EMBEDDING_DIMENSIONS, fit_dimensions
+from vector_layout import ALL_VECTOR_FIELDS, EMAIL_VECTOR_LAYOUT, LAYOUTS, cosmos_vector_policies, embed_document, vector_fields
+
+load_dotenv()
+
+azure_openai_embedding_deployment = os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT")
+azure_openai_key = os.getenv("AZURE_OPENAI_API_KEY")
+azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION")
+
+
+def get_embedding(text, dimensions):
+    url = f"{azure_openai_endpoint}/openai/deployments/{azure_openai_embedding_deployment}/embeddings?api-version={azure_openai_api_version}"
+    headers = {"Content-Type": "application/json", "api-key": azure_openai_key}
+    payload = {"input": text}
+    if dimensions != NATIVE_EMBEDDING_DIMENSIONS:
+        payload["dimensions"] = dimensions
+    response = requests.post(url, headers=headers, json=payload)
+    response.raise_for_status()
+    return fit_dimensions(response.json()["data"][0]["embedding"], dimensions)
+
+
+def project(doc, dimensions, reembed, layout):
+    """Copy of `doc` with the vectors of `layout` at the target size."""
+    doc = dict(doc)
+    if doc.get("duplicate_of"):
+        return doc  # metadata-only copy of another email in its thread (email_threads.py), has no vectors
+    if reembed:
+        embed_document(doc, lambda text: get_embedding(text, dimensions), layout)
+    else:
+        fields = vector_fields(layout)
+        for field in fields:
+            if not doc.get(field):
+                raise ValueError(f"Email {doc.get('id')} has no stored {field}; rerun with --reembed")
+            doc[field] = fit_dimensions(doc[field], dimensions)
+        for field in set(ALL_VECTOR_FIELDS) - set(fields):
+            doc.pop(field, None)
+    return doc
+
+
+def migrate_cosmos(target, dimensions, reembed, batch_size, layout):
+    from azure.cosmos import CosmosClient
+    from azure.identity import DefaultAzureCredential
+
+    for name in ("CLIENT_ID", "CLIENT_SECRET", "TENANT_ID"):
+        os.environ[f"AZURE_{name}"] = os.getenv(f"AAD_{name}", "")
+    cosmos_client = CosmosClient(os.getenv("COSMOS_URI"), credential=DefaultAzureCredential())
+    database = cosmos_client.get_database_client(os.getenv("COSMOS_DB_NAME", "vectordb"))
+    source = database.get_container_client(os.getenv("COSMOS_CONTAINER_NAME", "vectortest_hybridsearch"))
+
+    # Same partition key, indexing and full-text policies as the source; only the vector fields and size change
+    properties = source.read()
+    vector_policy, indexing_policy = cosmos_vector_policies(properties["indexingPolicy"], dimensions, layout)
+    target_container = database.create_container_if_not_exists(
+        id=target,
+        partition_key=properties["partitionKey"],
+        indexing_policy=indexing_policy,
+        vector_embedding_policy=vector_policy,
+        full_text_policy=properties.get("fullTextPolicy"),
+    )
+
+    copied = 0
+    pages = source.query_items(query="SELECT * FROM c", enable_cross_partition_query=True, max_item_count=batch_size).by_page()
+    for page in pages:
+        for doc in page:
+            doc = {k: v for k, v in doc.items() if not k.startswith("_")}
+            target_container.upsert_item(project(doc, dimensions, reembed, layout))
+            copied += 1
+        print(f"Copied {copied} emails to container '{target}'")
+    return copied
+
+
+def migrate_aisearch(target, dimensions, reembed, batch_size, profile, layout):
+    from azure.core.credentials import AzureKeyCredential
+    from azure.identity import DefaultAzureCredential
+    from azure.search.documents import SearchClient
+    from azure.search.documents.indexes import SearchIndexClient
+    from aisearch_profiles import build_index
+
+    endpoint = os.environ["AZURE_SEARCH_SERVICE_ENDPOINT"]
+    admin_key = os.getenv("AZURE_SEARCH_ADMIN_KEY", "")
+    credential = AzureKeyCredential(admin_key) if admin_key else DefaultAzureCredential()
+    source = SearchClient(endpoint=endpoint, index_name=os.getenv("AZURE_SEARCH_INDEX", "vectest"), credential=credential)
+
+    SearchIndexClient(endpoint=endpoint, credential=credential).create_or_update_index(
+        build_index(target, profile, dimensions, azure_openai_endpoint, azure_openai_embedding_deployment, azure_openai_key, layout)
+    )
+    target_client = SearchClient(endpoint=endpoint, index_name=target, credential=credential)
+
+    copied = 0
+    batch = []
+    # Vector fields are only retrievable when the source index stores them
+    for doc in source.search(search_text="*"):
+        doc = {k: v for k, v in doc.items() if not k.startswith("@search")}
+        batch.append(project(doc, dimensions, reembed, layout))
+        if len(batch) >= batch_size:
+            target_client.upload_documents(documents=batch)
+            copied += len(batch)
+            batch = []
+            print(f"Copied {copied} emails to index '{target}'")
+    if batch:
+        target_client.upload_documents(documents=batch)
+        copied += len(batch)
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the email store into a new container / index with smaller vectors")
+    parser.add_argument("backend", choices=["cosmos", "aisearch"])
+    parser.add_argument("--target", required=True, help="name of the new container / index")
+    parser.add_argument("--dimensions", type=int, required=True)
+    parser.add_argument("--reembed", action="store_true", help="embed subject and body again instead of truncating")
+    parser.add_argument("--layout", default=EMAIL_VECTOR_LAYOUT, choices=sorted(LAYOUTS),
+                        help="vector layout of the target; a different layout than the source needs --reembed")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--profile", default=os.getenv("AZURE_SEARCH_INDEX_PROFILE", "baseline"), help="AI Search index profile of the target")
+    args = parser.parse_args()
+
+    if args.backend == "cosmos":
+        copied = migrate_cosmos(args.target, args.dimensions, args.reembed, args.batch_size, args.layout)
+    else:
+        copied = migrate_aisearch(args.target, args.dimensions, args.reembed, args.batch_size, args.profile, args.layout)
+    print(f"Done: {copied} emails migrated to '{args.target}' at {args.dimensions} dimensions.")
+    print(f"Switch over with AZURE_OPENAI_EMB_DIMENSIONS={args.dimensions}, EMAIL_VECTOR_LAYOUT={args.layout} and "
+          f"{'COSMOS_CONTAINER_NAME' if args.backend == 'cosmos' else 'AZURE_SEARCH_INDEX'}={args.target}")
+
+
+if __name__ == "__main__":
+    main()
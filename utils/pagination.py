@@ -0,0 +1,88 @@
+# Cursor-based pagination of search results
+#
+# Result sizes used to be fixed (top=3 on AI Search, TOP 20 on Cosmos DB) and
+# seeing more meant re-running everything: query generation, embedding and
+# search. A search now returns a ResultPage and, when more results may exist, an
+# opaque continuation token. The token carries the translated query and its
+# plan, so a later page is fetched without calling the query generator again;
+# the query embedding is cached by the callers.
+#
+# Tokens are URL-safe base64 JSON:
+#   • offset        – ranked queries (full text, vector, hybrid) page with skip /
+#                     OFFSET … LIMIT, since ranked Cosmos DB queries require TOP or
+#                     OFFSET LIMIT and have no server-side continuation
+#   • continuation  – plain filter scans on Cosmos DB resume from the service's own
+#                     continuation token, which costs no re-scan
+# They are not signed: they hold nothing a caller could not pass as a query anyway.
+import base64
+import json
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+# Ranked pages are re-scored from the top, so deep offsets cost latency and RUs linearly
+MAX_OFFSET = 500
+
+
+class InvalidCursor(ValueError):
+    """The continuation token is malformed or does not belong to this search."""
+
+
+@dataclass
+class Cursor:
+    search_text: str
+    filter: str
+    plan: str
+    offset: int = 0
+    continuation: Optional[str] = None
+
+    def encode(self) -> str:
+        return base64.urlsafe_b64encode(json.dumps(asdict(self)).encode("utf-8")).decode("ascii")
+
+    @classmethod
+    def decode(cls, token: str) -> "Cursor":
+        try:
+            return cls(**json.loads(base64.urlsafe_b64decode(token.encode("ascii"))))
+        except (ValueError, TypeError, UnicodeError) as e:
+            raise InvalidCursor(f"Invalid continuation token: {e}") from e
+
+    def query_json(self) -> Dict[str, str]:
+        return {"search_text": self.search_text, "filter": self.filter}
+
+    def next(self, returned: int, continuation: Optional[str] = None) -> Optional["Cursor"]:
+        """Cursor after a page that returned `returned` results, or None at the end."""
+        if continuation is not None:
+            return replace(self, continuation=continuation)
+        if self.continuation is not None or returned == 0 or self.offset + returned > MAX_OFFSET:
+            return None
+        return replace(self, offset=self.offset + returned)
+
+
+class ResultPage:
+    """One page of results, iterated lazily; next_cursor is known once the page is consumed."""
+
+    def __init__(self, items: Iterable[Any], page_size: int, next_cursor: Callable[[int], Optional[Cursor]]):
+        self._items = items
+        self.page_size = page_size
+        self._next_cursor = next_cursor
+        self.count = 0
+        self.next_cursor: Optional[str] = None
+
+    def __iter__(self) -> Iterator[Any]:
+        for item in self._items:
+            self.count += 1
+            yield item
+        # A short page is the last one
+        cursor = self._next_cursor(self.count) if self.count >= self.page_size else None
+        self.next_cursor = cursor.encode() if cursor else None
+
+
+def next_page_token(cursor: Cursor, returned: int, page_size: int, continuation: Optional[str] = None,
+                    native: bool = False) -> Optional[str]:
+    """
+    Token for the page after an eagerly fetched one that returned `returned` of `page_size` results.
+    `native` pages resume from the service's `continuation` token (None when exhausted).
+    """
+    if returned < page_size or (native and not continuation):
+        return None
+    cursor = cursor.next(returned, continuation if native else None)
+    return cursor.encode() if cursor else None
@@ -5,7 +5,9 @@ from openai import AzureOpenAI
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
 import re
-import uuid
+from embedding_dimensions import embedding_payload, fit_dimensions
+from result_fields import body_preview
+from email_threads import MessageRecord, assign_threads, email_id_for, normalize_message_id, parse_references
 load_dotenv()
 class ParsedEmail(BaseModel):
     summary: str
@@ -37,8 +39,9 @@ def get_openai_embedding(text):
         response = embedding_client.embeddings.create(
             model=azure_openai_embedding_deployment,
             input=text,
+            **{k: v for k, v in embedding_payload(text).items() if k != "input"},
         )
-        return response.data[0].embedding
+        return fit_dimensions(response.data[0].embedding)
     except Exception as e:
         print(f"Error getting OpenAI embedding: {e}")
         return None
@@ -78,7 +81,32 @@ def format_datetime(dt):
     """Format datetime to the OData V4 format."""  
     return dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'  
 
-def process_msg_file(msg_file_path, email_id):  
+def read_thread_record(msg_file_path):  
+    """Headers, participants and plain-text body for thread detection (no OpenAI calls)."""  
+    try:  
+        msg = extract_msg.Message(msg_file_path)  
+        # Transport headers; sent items often have none, thread detection then falls back to the subject  
+        header = msg.header or {}  
+        participants = [extract_email(msg.sender or "")] + [recipient.email for recipient in msg.recipients or []]  
+        record = MessageRecord(  
+            key=msg_file_path,  
+            message_id=normalize_message_id(header.get("Message-ID")),  
+            in_reply_to=normalize_message_id(header.get("In-Reply-To")),  
+            references=parse_references(header.get("References")),  
+            subject=msg.subject or "",  
+            participants=frozenset(p.lower() for p in participants if p),  
+            attachments=frozenset(a.longFilename or a.shortFilename or "Unknown" for a in msg.attachments),  
+            sent_time=format_datetime(msg.date) if msg.date else "",  
+            body=msg.body or "",  
+        )  
+        msg.close()  
+        return record  
+    except Exception as e:  
+        print(f"Error reading headers of {msg_file_path}: {e}")  
+        return None  
+
+def process_msg_file(msg_file_path, email_id, summarize=True):  
+    """Email document of a .msg file; without `summarize` no OpenAI call is made and body / category stay empty."""  
     try:  
         # Open the .msg file  
         msg = extract_msg.Message(msg_file_path)  
@@ -92,11 +120,18 @@ def process_msg_file(msg_file_path, email_id):
         msg_data["subject"] = msg.subject or ""  
         msg_data["important"] = msg.importance # Check if the email is marked as important  
   
+        if not summarize:  
+            msg_data["body"] = ""  
+            msg_data["body_preview"] = body_preview(msg.body or "")  
+            msg_data["category"] = ""  
+  
         # Extract body & category 
         messages = [{"role": "user", "content": f"summarize the email content and categorize the email into one of the following ['Urgent: Emails that require immediate attention or action.Projects: Emails related to specific projects or tasks, including updates, progress reports, and deliverables.Meetings: Emails about scheduling, agendas, and minutes of meetings.Internal: Emails from within the organization, such as announcements, newsletters, and internal memos.External: Emails from clients, partners, suppliers, or other external parties.Admin: Emails related to administrative matters, human resources, policies, and compliance.']. The output should be in JSON format with 'summary' and 'category' as keys:\n{msg.htmlBody}"}]    
-        output = get_openai_chat_response(messages, json_output=True)
-        msg_data["body"] = output.summary
-        msg_data["category"] =  output.category 
+        if summarize:  
+            output = get_openai_chat_response(messages, json_output=True)
+            msg_data["body"] = output.summary
+            msg_data["body_preview"] = body_preview(output.summary)  # shown in result lists, so searches need not fetch the body
+            msg_data["category"] =  output.category 
   
         # Extract attachments  
         attachment_names = []
@@ -123,18 +158,50 @@ def process_msg_file(msg_file_path, email_id):
   
 def extract_emails_from_folder(folder_path):  
     extracted_emails = []  
-    email_counter = 100000  # Start numbering emails from 100000  
-  
-    # Iterate through files in the folder  
-    for file_name in os.listdir(folder_path):  
-        if file_name.endswith(".msg"):  
-            email_counter += 1  
-            msg_file_path = os.path.join(folder_path, file_name)  
-            email_id = str(uuid.uuid4())
-            msg_data = process_msg_file(msg_file_path, email_id)  
+  
+    # Thread detection first (headers only), so redundant copies are never summarized or embedded  
+    msg_file_paths = [os.path.join(folder_path, f) for f in sorted(os.listdir(folder_path)) if f.endswith(".msg")]  
+    records = [record for record in map(read_thread_record, msg_file_paths) if record]  
+    threads = assign_threads(records)  
+    # Stable per Message-ID, so re-ingesting a message overwrites it  
+    email_ids = {record.key: email_id_for(threads[record.key].message_id) for record in records}  
+  
+    kept = {}  
+    for record in records:  
+        thread = threads[record.key]  
+        if thread.duplicate_of:  
+            continue  
+        msg_data = process_msg_file(record.key, email_ids[record.key])  
+        if msg_data:  
+            msg_data.update(thread.document_fields())  
+            extracted_emails.append(msg_data)  
+            kept[record.key] = msg_data  
+  
+    # Redundant copies keep their own sender, recipients and times as a thin metadata row (filters still find  
+    # them) pointing at the email that carries their content: no summary and no embedding  
+    copies = 0  
+    for record in records:  
+        thread = threads[record.key]  
+        if not thread.duplicate_of:  
+            continue  
+        original = kept.get(thread.duplicate_of)  
+        if original is None:  
+            # The email carrying its content failed to process: this one is summarized and embedded itself  
+            msg_data = process_msg_file(record.key, email_ids[record.key])  
             if msg_data:  
+                msg_data.update(thread.document_fields(), duplicate_count=0)  
                 extracted_emails.append(msg_data)  
-  
+            continue  
+        if thread.message_id and thread.message_id == original["message_id"]:  
+            continue  # the same message twice (e.g. from two mailboxes): stored once  
+        msg_data = process_msg_file(record.key, email_ids[record.key], summarize=False)  
+        if msg_data:  
+            msg_data.update(thread.document_fields())  
+            msg_data.update(category=original["category"], duplicate_of=original["id"])  
+            extracted_emails.append(msg_data)  
+            copies += 1  
+  
+    print(f"Stored {copies} redundant copies as metadata rows in {len({t.thread_id for t in threads.values()})} threads")  
     return extracted_emails  
   
 def save_to_json(data, output_file):  
@@ -0,0 +1,177 @@
+# Cost-based planner between query generation and query execution
+#
+# Every translated query used to take the most expensive route (hybrid +
+# semantic rerank on Azure AI Search, RRF(vector, full text) on Cosmos DB),
+# even when search_text is empty or a single exact term. The planner looks at
+# the generated {"search_text", "filter"} JSON and picks the cheapest plan that
+# can still answer it:
+#
+#   filter_scan    – no search text: filter + newest first, no embedding, no ranking
+#   keyword        – one exact term / identifier / quoted phrase: full-text only
+#   vector         – conceptual "emails like / about the tone of …": embedding only
+#   hybrid         – a few keywords: full text + vector fused
+#   hybrid_rerank  – natural-language requests: hybrid + semantic reranker
+#
+# Backends without a plan (e.g. Cosmos DB has no semantic reranker) get the
+# next cheaper plan. Every execution is appended to a JSONL log with its plan,
+# latency and cost (estimated units, plus the measured request charge where the
+# backend reports one) so the rules and thresholds can be tuned from real data.
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence
+
+try:
+    from .settings import getenv
+except ImportError:  # imported as a top-level module by the utils/ scripts
+    from settings import getenv
+
+FILTER_SCAN = "filter_scan"
+KEYWORD = "keyword"
+VECTOR = "vector"
+HYBRID = "hybrid"
+HYBRID_RERANK = "hybrid_rerank"
+PLANS = (FILTER_SCAN, KEYWORD, VECTOR, HYBRID, HYBRID_RERANK)  # cheapest first
+
+# Relative cost per plan: embedding call, ANN search, full-text scoring, reranker
+PLAN_COST_UNITS = {FILTER_SCAN: 1, KEYWORD: 1, VECTOR: 2, HYBRID: 3, HYBRID_RERANK: 6}
+
+# Tuning knobs
+HYBRID_MAX_TERMS = int(getenv("PLANNER_HYBRID_MAX_TERMS", "3"))
+PLANNER_LOG_PATH = getenv("PLANNER_LOG_PATH", "query_plans.jsonl")
+
+_EXACT_TERM_RE = re.compile(
+    r"""^(?:
+        "[^"]+"|'[^']+'                          # quoted phrase
+      | [\w.%+-]+@[\w.-]+\.\w+                   # email address
+      | [\w-]+\.[A-Za-z0-9]{2,4}                 # file name
+      | [A-Za-z]*[-_#]?\d[\w-]*                  # ids, ticket / invoice / PO numbers
+    )$""",
+    re.VERBOSE,
+)
+_CONCEPTUAL_RE = re.compile(r"\b(similar to|like the|tone|sounds?|feel(?:s|ing)?|sentiment|vibe)\b", re.IGNORECASE)
+_QUESTION_RE = re.compile(r"^(who|what|when|where|why|how|which|did|does|is|are|was|were)\b|\?$", re.IGNORECASE)
+
+
+@dataclass
+class QueryPlan:
+    name: str
+    reason: str
+    search_text: str
+    filter: str
+
+
+def classify(query_json: Dict[str, Any]) -> QueryPlan:
+    """Pick the cheapest plan adequate for a generated query (before backend capabilities are applied)."""
+    search_text = (query_json.get("search_text") or "").strip()
+    filter_str = (query_json.get("filter") or "").strip()
+    terms = search_text.split()
+    if not terms:
+        plan, reason = FILTER_SCAN, "no search text"
+    elif _EXACT_TERM_RE.match(search_text):
+        plan, reason = KEYWORD, "single exact term"
+    elif len(terms) == 1:
+        plan, reason = KEYWORD, "single keyword"
+    elif _CONCEPTUAL_RE.search(search_text):
+        plan, reason = VECTOR, "conceptual / similarity request"
+    elif len(terms) <= HYBRID_MAX_TERMS and not _QUESTION_RE.search(search_text):
+        plan, reason = HYBRID, f"{len(terms)} keywords"
+    else:
+        plan, reason = HYBRID_RERANK, "natural-language request"
+    return QueryPlan(plan, reason, search_text, filter_str)
+
+
+def plan_query(query_json: Dict[str, Any], supported: Sequence[str] = PLANS) -> QueryPlan:
+    """classify(), then step down to the nearest cheaper plan the backend supports."""
+    plan = classify(query_json)
+    if plan.name not in supported:
+        cheaper = [p for p in PLANS[: PLANS.index(plan.name)] if p in supported and p != FILTER_SCAN]
+        if plan.search_text and cheaper:
+            plan.reason += f"; {plan.name} unsupported"
+            plan.name = cheaper[-1]
+    return plan
+
+
+class PlanStats:
+    """Per-plan counters plus an append-only JSONL log of every executed plan."""
+
+    def __init__(self, log_path: Optional[str] = PLANNER_LOG_PATH):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self.plans: Dict[str, Dict[str, float]] = {}
+
+    def timed(
+        self,
+        backend: str,
+        plan: QueryPlan,
+        results: Iterable[Any],
+        request_charge: Optional[Any] = None,
+    ) -> Iterator[Any]:
+        """
+        Pass `results` through and record the plan once they are exhausted: time to the first
+        and the last result, result count and cost. `request_charge` is a callable returning the
+        backend's measured charge (e.g. Cosmos DB RUs), read after the last page.
+        """
+        start = time.perf_counter()
+        first = None
+        count = 0
+        try:
+            for item in results:
+                if first is None:
+                    first = time.perf_counter() - start
+                count += 1
+                yield item
+        finally:
+            latency = time.perf_counter() - start
+            charge = None
+            if request_charge is not None:
+                try:
+                    charge = request_charge()
+                except Exception:
+                    charge = None
+            self.record(backend, plan, latency, first if first is not None else latency, count, charge)
+
+    def record(
+        self,
+        backend: str,
+        plan: QueryPlan,
+        latency: float,
+        first_result_latency: float,
+        results: int,
+        request_charge: Optional[float] = None,
+    ) -> None:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "backend": backend,
+            "plan": plan.name,
+            "reason": plan.reason,
+            "terms": len(plan.search_text.split()),
+            "has_filter": bool(plan.filter),
+            "latency": round(latency, 4),
+            "first_result_latency": round(first_result_latency, 4),
+            "results": results,
+            "cost_units": PLAN_COST_UNITS[plan.name],
+            "request_charge": request_charge,
+        }
+        with self._lock:
+            totals = self.plans.setdefault(plan.name, {"count": 0, "total_latency": 0.0, "cost_units": 0})
+            totals["count"] += 1
+            totals["total_latency"] += latency
+            totals["cost_units"] += PLAN_COST_UNITS[plan.name]
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+        print(
+            f"Query plan {plan.name} ({plan.reason}) on {backend}: {latency:.2f}s, "
+            f"{results} results, cost {PLAN_COST_UNITS[plan.name]} units"
+            + (f", charge {request_charge}" if request_charge is not None else "")
+        )
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name: {**totals, "avg_latency": totals["total_latency"] / totals["count"]}
+                for name, totals in self.plans.items()
+            }
@@ -0,0 +1,278 @@
+# Blue/green reindex of the email store
+#
+# create_aisearch_index.py / create_cosmosdb_index.py drop the live store before
+# recreating it, so any schema change meant downtime plus re-embedding every
+# email. This pipeline instead:
+#
+#   1. builds the new ("green") index / container next to the live ("blue") one,
+#      from the current schema (aisearch_profiles.build_index / the policies in
+#      create_cosmosdb_index.py and --partition-strategy, see cosmos_partitioning.py;
+#      --vector-layout, see vector_layout.py),
+#   2. copies the documents WITH their stored vectors – no OpenAI calls – in
+#      parallel id-range partitions (keyset pagination on the key field),
+#   3. compares document counts and, with --switch, atomically flips the
+#      active-store pointer (active_store.py) that all readers resolve per request,
+#   4. reports copy throughput per partition and overall.
+#
+# The blue store is left untouched, so rolling back is another pointer flip:
+#
+#     python utils/reindex.py copy aisearch --target vectest-v2 --profile scalar --switch
+#     python utils/reindex.py copy cosmos --target emails_v2 --workers 8 --partition-strategy month_sender
+#     python utils/reindex.py switch cosmos emails_v2        # or back to the previous name
+#
+# Vectors must be retrievable from the source and be those of the target layout: AI
+# Search profiles with stored=False, and split <-> fused changes, need
+# migrate_embedding_dimensions.py --reembed instead. Writes that reach the blue
+# store during the copy are not carried over; pause ingestion or rerun the copy
+# (upserts are idempotent) before switching.
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from active_store import active_name, set_active
+from cosmos_partitioning import COSMOS_PARTITION_STRATEGY, assign_partition_fields, partition_key_definition
+from embedding_dimensions import EMBEDDING_DIMENSIONS, fit_dimensions
+from metadata_index import MetadataIndex
+from result_fields import add_body_preview
+from vector_layout import ALL_VECTOR_FIELDS, EMAIL_VECTOR_LAYOUT, LAYOUTS, cosmos_vector_policies, vector_fields
+
+load_dotenv()
+
+DEFAULT_NAMES = {
+    "aisearch": os.getenv("AZURE_SEARCH_INDEX", "vectest"),
+    "cosmos": os.getenv("COSMOS_CONTAINER_NAME", "vectortest_hybridsearch"),
+}
+
+# Ids are uuid4 strings: one partition per leading hex digit; the open-ended first
+# and last ranges also catch ids outside [0-9a-f]
+_BOUNDARIES = list("123456789abcdef")
+ID_RANGES = list(zip([None] + _BOUNDARIES, _BOUNDARIES + [None]))
+
+
+class Progress:
+    """Thread-safe copy counters with periodic throughput output."""
+
+    def __init__(self, every=5.0):
+        self.start = time.perf_counter()
+        self.every = every
+        self._last_print = self.start
+        self._lock = threading.Lock()
+        self.docs = 0
+        self.bytes = 0
+        self.partitions = {}
+
+    def add(self, partition, docs):
+        size = sum(len(json.dumps(doc, default=str)) for doc in docs)
+        with self._lock:
+            self.docs += len(docs)
+            self.bytes += size
+            self.partitions[partition] = self.partitions.get(partition, 0) + len(docs)
+            now = time.perf_counter()
+            if now - self._last_print >= self.every:
+                self._last_print = now
+                print(f"  {self.docs} emails copied ({self.rate(now):.1f} emails/s, {self.bytes / 2**20 / (now - self.start):.2f} MB/s)")
+
+    def rate(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.start
+        return self.docs / elapsed if elapsed else 0.0
+
+    def report(self, partition_seconds):
+        elapsed = time.perf_counter() - self.start
+        print(f"Copied {self.docs} emails ({self.bytes / 2**20:.1f} MB) in {elapsed:.1f}s: "
+              f"{self.rate():.1f} emails/s, {self.bytes / 2**20 / elapsed if elapsed else 0:.2f} MB/s")
+        for partition, count in sorted(self.partitions.items()):
+            seconds = partition_seconds.get(partition, 0.0)
+            print(f"  partition {partition:<8} {count:>8} emails  {count / seconds if seconds else 0:>8.1f} emails/s")
+
+
+def range_label(lo, hi):
+    return f"{lo or ''}..{hi or ''}"
+
+
+def prepare(doc, dimensions, layout):
+    """Drop service metadata, fit the layout's stored vectors to the target size and backfill body_preview."""
+    fields = vector_fields(layout)
+    doc = {k: v for k, v in doc.items() if not k.startswith("_") and not k.startswith("@search")
+           and (k in fields or k not in ALL_VECTOR_FIELDS)}
+    for field in fields:
+        vector = doc.get(field)
+        if not vector and doc.get("duplicate_of"):
+            continue  # metadata-only copy of another email in its thread (email_threads.py)
+        if not vector:
+            raise ValueError(f"Email {doc.get('id')} has no retrievable {field}; "
+                             "use migrate_embedding_dimensions.py --reembed for this source")
+        if len(vector) < dimensions:
+            raise ValueError(f"Email {doc.get('id')}: {field} has {len(vector)} dimensions, target needs {dimensions}")
+        doc[field] = fit_dimensions(vector, dimensions)
+    return add_body_preview(doc)
+
+
+def copy_partitions(copy_range, workers):
+    """Run `copy_range(lo, hi)` for every id range on `workers` threads; returns seconds per partition."""
+    seconds = {}
+
+    def run(bounds):
+        start = time.perf_counter()
+        copy_range(*bounds)
+        seconds[range_label(*bounds)] = time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() re-raises the first failure
+        list(pool.map(run, ID_RANGES))
+    return seconds
+
+
+def copy_aisearch(source_name, target, profile, workers, batch_size, layout):
+    from azure.core.credentials import AzureKeyCredential
+    from azure.identity import DefaultAzureCredential
+    from azure.search.documents import SearchClient
+    from azure.search.documents.indexes import SearchIndexClient
+    from aisearch_profiles import build_index
+
+    endpoint = os.environ["AZURE_SEARCH_SERVICE_ENDPOINT"]
+    admin_key = os.getenv("AZURE_SEARCH_ADMIN_KEY", "")
+    credential = AzureKeyCredential(admin_key) if admin_key else DefaultAzureCredential()
+    index_client = SearchIndexClient(endpoint=endpoint, credential=credential)
+    index_client.create_or_update_index(
+        build_index(target, profile, EMBEDDING_DIMENSIONS, os.getenv("AZURE_OPENAI_ENDPOINT"),
+                    os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT"), os.getenv("AZURE_OPENAI_API_KEY"), layout)
+    )
+    source = SearchClient(endpoint=endpoint, index_name=source_name, credential=credential)
+    target_client = SearchClient(endpoint=endpoint, index_name=target, credential=credential)
+    progress = Progress()
+
+    def copy_range(lo, hi):
+        bounds = ([f"id ge '{lo}'"] if lo else []) + ([f"id lt '{hi}'"] if hi else [])
+        last = None
+        while True:
+            # Keyset pagination: $skip is capped at 100k, "id gt last" is not
+            clauses = bounds + ([f"id gt '{last}'"] if last else [])
+            page = list(source.search(search_text="*", filter=" and ".join(clauses) or None, order_by=["id asc"], top=batch_size))
+            if not page:
+                return
+            docs = [prepare(doc, EMBEDDING_DIMENSIONS, layout) for doc in page]
+            target_client.merge_or_upload_documents(documents=docs)
+            progress.add(range_label(lo, hi), docs)
+            last = page[-1]["id"].replace("'", "''")
+
+    seconds = copy_partitions(copy_range, workers)
+    progress.report(seconds)
+    # Indexing is asynchronous; give the counts a moment to converge
+    deadline = time.time() + 120
+    while target_client.get_document_count() < source.get_document_count() and time.time() < deadline:
+        time.sleep(2)
+    return source.get_document_count(), target_client.get_document_count()
+
+
+def copy_cosmos(source_name, target, workers, batch_size, partition_strategy, layout):
+    from azure.cosmos import CosmosClient
+    from azure.identity import DefaultAzureCredential
+    from create_cosmosdb_index import base_indexing_policy, full_text_policy
+
+    for name in ("CLIENT_ID", "CLIENT_SECRET", "TENANT_ID"):
+        os.environ[f"AZURE_{name}"] = os.getenv(f"AAD_{name}", "")
+    cosmos_client = CosmosClient(os.getenv("COSMOS_URI"), credential=DefaultAzureCredential())
+    database = cosmos_client.get_database_client(os.getenv("COSMOS_DB_NAME", "vectordb"))
+    source = database.get_container_client(source_name)
+    vector_embedding_policy, indexing_policy = cosmos_vector_policies(base_indexing_policy, EMBEDDING_DIMENSIONS, layout)
+    target_container = database.create_container_if_not_exists(
+        id=target,
+        partition_key=partition_key_definition(partition_strategy),
+        vector_embedding_policy=vector_embedding_policy,
+        indexing_policy=indexing_policy,
+        full_text_policy=full_text_policy,
+    )
+    progress = Progress()
+
+    def copy_range(lo, hi):
+        clauses, parameters = [], []
+        if lo:
+            clauses.append("c.id >= @lo")
+            parameters.append({"name": "@lo", "value": lo})
+        if hi:
+            clauses.append("c.id < @hi")
+            parameters.append({"name": "@hi", "value": hi})
+        query = "SELECT * FROM c" + (" WHERE " + " AND ".join(clauses) if clauses else "")
+        pages = source.query_items(query=query, parameters=parameters, enable_cross_partition_query=True,
+                                   max_item_count=batch_size).by_page()
+        for page in pages:
+            # Derived partition key fields may be missing in containers created before they existed
+            docs = [assign_partition_fields(prepare(doc, EMBEDDING_DIMENSIONS, layout)) for doc in page]
+            for doc in docs:
+                target_container.upsert_item(doc)
+            progress.add(range_label(lo, hi), docs)
+
+    seconds = copy_partitions(copy_range, workers)
+    progress.report(seconds)
+    count = "SELECT VALUE COUNT(1) FROM c"
+    return (list(source.query_items(query=count, enable_cross_partition_query=True))[0],
+            list(target_container.query_items(query=count, enable_cross_partition_query=True))[0],
+            target_container)
+
+
+def switch(backend, name, container=None):
+    previous = set_active(backend, name)
+    print(f"Readers of {backend} now use '{name}' (previous: '{previous or DEFAULT_NAMES[backend]}').")
+    if backend == "cosmos":
+        # The metadata index no longer covers the live container; readers use Cosmos DB until it is rebuilt
+        if container is None:
+            print("Rebuild the metadata index for it: python utils/metadata_index.py --rebuild")
+        else:
+            print(f"Rebuilt the metadata index from '{name}' ({MetadataIndex().rebuild(container)} emails).")
+    if backend == "aisearch":
+        print("The Azure Function still uploads to AZURE_SEARCH_INDEX; update its app setting as well "
+              "(and EMAIL_VECTOR_LAYOUT of the app and the Function if the vector layout changed).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Blue/green reindex of the email store without re-embedding")
+    commands = parser.add_subparsers(dest="command", required=True)
+    copy = commands.add_parser("copy", help="build a new index / container and copy documents and vectors into it")
+    copy.add_argument("backend", choices=["aisearch", "cosmos"])
+    copy.add_argument("--target", required=True, help="name of the new index / container")
+    copy.add_argument("--source", help="defaults to the active store")
+    copy.add_argument("--profile", default=os.getenv("AZURE_SEARCH_INDEX_PROFILE", "baseline"), help="AI Search index profile of the target")
+    copy.add_argument("--partition-strategy", default=COSMOS_PARTITION_STRATEGY, help="Cosmos DB layout of the target")
+    copy.add_argument("--vector-layout", default=EMAIL_VECTOR_LAYOUT, choices=sorted(LAYOUTS),
+                      help="vector fields of the target; must match the source's stored vectors")
+    copy.add_argument("--workers", type=int, default=4, help="partitions copied in parallel")
+    copy.add_argument("--batch-size", type=int, default=500)
+    copy.add_argument("--switch", action="store_true", help="switch readers over when the counts match")
+    flip = commands.add_parser("switch", help="point readers at an existing index / container (switch over or roll back)")
+    flip.add_argument("backend", choices=["aisearch", "cosmos"])
+    flip.add_argument("name")
+    args = parser.parse_args()
+
+    if args.command == "switch":
+        switch(args.backend, args.name)
+        return
+
+    source = args.source or active_name(args.backend, DEFAULT_NAMES[args.backend])
+    if source == args.target:
+        parser.error(f"'{args.target}' is the live store; pick a new name for the target")
+    print(f"Copying {args.backend} '{source}' -> '{args.target}' with {args.workers} workers")
+    if args.backend == "aisearch":
+        target_container = None
+        source_count, target_count = copy_aisearch(source, args.target, args.profile, args.workers, args.batch_size,
+                                                  args.vector_layout)
+    else:
+        source_count, target_count, target_container = copy_cosmos(source, args.target, args.workers, args.batch_size, args.partition_strategy,
+                                                args.vector_layout)
+    print(f"Documents: source {source_count}, target {target_count}")
+
+    if args.switch:
+        if target_count < source_count:
+            print("Target is missing documents; not switching. Rerun the copy, then `switch`.")
+            return
+        switch(args.backend, args.target, target_container)
+    else:
+        print(f"Switch over with: python utils/reindex.py switch {args.backend} {args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Result projections and the precomputed body preview
+#
+# Every result list shows the same four fields plus a 200-character preview of
+# the body, but the search paths used to fetch whole documents: all retrievable
+# fields on Azure AI Search (including the two embedding vectors per hit) and the
+# full c.body on Cosmos DB, only to slice body[:200] in the client. The preview is
+# now computed once at ingest (body_preview) and every search path selects just
+# RESULT_FIELDS (plus thread_id, to collapse results per thread, see email_threads.py).
+from typing import Any, Dict, Iterable, List
+
+PREVIEW_CHARS = 200
+RESULT_FIELDS = ("id", "from", "subject", "sent_time", "body_preview", "thread_id")
+
+# Cosmos DB projection; documents ingested before body_preview existed get it computed
+# server-side, so the full body still never leaves the database
+COSMOS_RESULT_PROJECTION = (
+    f'c.id, c["from"], c.subject, c.sent_time, (c.body_preview ?? LEFT(c.body, {PREVIEW_CHARS})) AS body_preview, '
+    'c.thread_id'
+)
+
+
+def body_preview(body: str) -> str:
+    """First PREVIEW_CHARS characters of the body, with an ellipsis when truncated."""
+    body = body or ""
+    return body[:PREVIEW_CHARS] + ("..." if len(body) > PREVIEW_CHARS else "")
+
+
+def add_body_preview(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Set body_preview on an email document unless it already has one."""
+    if not doc.get("body_preview"):
+        doc["body_preview"] = body_preview(doc.get("body", ""))
+    return doc
+
+
+def _query_ids(container, ids: List[str], **kwargs) -> List[Dict[str, Any]]:
+    names = [f"@id{i}" for i in range(len(ids))]
+    return list(container.query_items(
+        query=f"SELECT {COSMOS_RESULT_PROJECTION} FROM c WHERE c.id IN ({', '.join(names)})",
+        parameters=[{"name": name, "value": value} for name, value in zip(names, ids)],
+        **kwargs,
+    ))
+
+
+def read_projected(container, layout, rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Projected result rows for documents known by id (e.g. metadata index matches), in input order.
+    Replaces a full-document point read per id: one query per partition key value (one query in
+    total on the /id layout, where Cosmos DB routes the id list itself).
+    """
+    rows = list(rows)
+    ids = [row["id"] for row in rows]
+    if not ids:
+        return []
+    if layout.paths == ["/id"]:
+        found = _query_ids(container, ids, enable_cross_partition_query=True)
+    else:
+        groups: Dict[str, Any] = {}
+        for row in rows:
+            value = layout.partition_value(row)
+            groups.setdefault(repr(value), (value, []))[1].append(row["id"])
+        found = [item for value, group in groups.values() for item in _query_ids(container, group, partition_key=value)]
+    by_id = {item["id"]: item for item in found}
+    return [by_id[i] for i in ids if i in by_id]
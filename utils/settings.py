@@ -0,0 +1,25 @@
+# Settings of the shared utils/ modules
+#
+# The modules below read their settings from the environment when they are
+# imported, usually before the calling script (a utils/ script, a Streamlit app
+# or an MCP server) has loaded its .env. getenv() loads the .env once, on the
+# first setting read, so every module sees the same settings whatever the import
+# order; variables already set in the environment win over the file.
+import os
+import threading
+
+from dotenv import load_dotenv
+
+_lock = threading.Lock()
+_loaded = False
+
+
+def getenv(name, default=None):
+    """os.getenv after the .env file has been loaded (once per process)."""
+    global _loaded
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                load_dotenv()
+                _loaded = True
+    return os.getenv(name, default)
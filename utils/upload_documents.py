@@ -5,13 +5,18 @@ import os
 import requests  
 import json  
 import dotenv  
+from embedding_dimensions import embedding_payload, fit_dimensions  
+from active_store import active_name  
+from result_fields import add_body_preview  
+from vector_layout import embed_document  
   
 dotenv.load_dotenv()  
   
 # Configuration  
 endpoint = os.environ["AZURE_SEARCH_SERVICE_ENDPOINT"]  
 credential = AzureKeyCredential(os.getenv("AZURE_SEARCH_ADMIN_KEY", "")) if len(os.getenv("AZURE_SEARCH_ADMIN_KEY", "")) > 0 else DefaultAzureCredential()  
-index_name = os.getenv("AZURE_SEARCH_INDEX", "vectest")  
+# Live index: the active-store pointer flipped by reindex.py, else AZURE_SEARCH_INDEX  
+index_name = active_name("aisearch", os.getenv("AZURE_SEARCH_INDEX", "vectest"))  
   
 azure_openai_embedding_deployment = os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT")  
 azure_openai_key = os.getenv("AZURE_OPENAI_API_KEY")  
@@ -29,16 +34,19 @@ def get_embedding(text):
         "Content-Type": "application/json",  
         "api-key": azure_openai_key  
     }  
-    response = requests.post(url, headers=headers, json={"input": text})  
+    response = requests.post(url, headers=headers, json=embedding_payload(text))  
     response.raise_for_status()  
-    return response.json()["data"][0]["embedding"]  
+    return fit_dimensions(response.json()["data"][0]["embedding"])  
   
 # Compute vectors and add data to Azure Cognitive Search  
 search_client = SearchClient(endpoint=endpoint, index_name=index_name, credential=credential)  
   
 for item in data:  
-    item["subjectVector"] = get_embedding(item["subject"])  
-    item["bodyVector"] = get_embedding(item["body"])  
+    # subjectVector + bodyVector, or one fused contentVector (EMAIL_VECTOR_LAYOUT, see vector_layout.py);  
+    # redundant copies in a thread are metadata-only rows (duplicate_of, see email_threads.py)  
+    if not item.get("duplicate_of"):  
+        embed_document(item, get_embedding)  
+    add_body_preview(item)  # files extracted before body_preview existed  
   
 search_client.upload_documents(documents=data)  
 print("Documents uploaded successfully.")  
\ No newline at end of file
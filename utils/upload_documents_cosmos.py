@@ -6,6 +6,12 @@ import requests
 from dotenv import load_dotenv  
 from azure.cosmos import CosmosClient, PartitionKey  
 from azure.identity import DefaultAzureCredential  
+from metadata_index import MetadataIndex  
+from embedding_dimensions import embedding_payload, fit_dimensions  
+from cosmos_partitioning import assign_partition_fields  
+from active_store import active_name  
+from result_fields import add_body_preview  
+from vector_layout import embed_document  
   
 # Load environment variables from .env file  
 load_dotenv()  
@@ -23,7 +29,8 @@ os.environ["AZURE_TENANT_ID"] = aad_tenant_id
 # Configure your Cosmos DB connection settings  
 cosmos_uri = os.getenv("COSMOS_URI")  
 cosmos_db_name = os.getenv("COSMOS_DB_NAME", "vectordb")  
-container_name = os.getenv("COSMOS_CONTAINER_NAME", "vectortest_hybridsearch")  
+# Live container: the active-store pointer flipped by reindex.py, else COSMOS_CONTAINER_NAME  
+container_name = active_name("cosmos", os.getenv("COSMOS_CONTAINER_NAME", "vectortest_hybridsearch"))  
   
 # Create the Cosmos DB client using DefaultAzureCredential  
 credential = DefaultAzureCredential()  
@@ -48,26 +55,41 @@ def get_embedding(text):
         "Content-Type": "application/json",  
         "api-key": azure_openai_key  
     }  
-    response = requests.post(url, headers=headers, json={"input": text})  
+    response = requests.post(url, headers=headers, json=embedding_payload(text))  
     response.raise_for_status()  
-    return response.json()["data"][0]["embedding"]  
+    return fit_dimensions(response.json()["data"][0]["embedding"])  
   
 # Load data from the extracted emails JSON file  
 with open("extracted_emails.json", "r") as file:  
     emails = json.load(file)  
   
+# Local metadata/facet index kept in step with the container (filter-only, count and facet queries)  
+metadata_index = MetadataIndex()  
+# An index built from another (or no) container is rebuilt after the upload instead  
+metadata_index_current = metadata_index.covers(container_name)  
+  
 # Ingest each document into Cosmos DB without parallelization  
 for email in emails:  
-    # Compute the embeddings for the "subject" and "body" fields  
-    email["subjectVector"] = get_embedding(email["subject"])  
-    email["bodyVector"] = get_embedding(email["body"])  
+    # Compute the embeddings: "subject" and "body", or one fused "subject + summary" (EMAIL_VECTOR_LAYOUT, see vector_layout.py)  
+    # Redundant copies in a thread are metadata-only rows (duplicate_of, see email_threads.py)  
+    if not email.get("duplicate_of"):  
+        embed_document(email, get_embedding)  
   
     # Ensure each document has an "id" property (required by Cosmos DB)  
     if "id" not in email or not email["id"]:  
         email["id"] = str(uuid.uuid4())  
   
+    # Derived partition key fields (pk_sender, pk_month) for every container layout  
+    assign_partition_fields(email)  
+    add_body_preview(email)  # files extracted before body_preview existed  
+  
     # Upsert the item into Cosmos DB  
     cosmos_container_client.upsert_item(email)  
+    if metadata_index_current:  
+        metadata_index.upsert([email])  
     print(f"Upserted document with id: {email['id']}")  
   
-print("Documents uploaded successfully to Cosmos DB.")  
\ No newline at end of file
+print("Documents uploaded successfully to Cosmos DB.")  
+if not metadata_index_current:  
+    total = metadata_index.rebuild(cosmos_container_client)  
+    print(f"Rebuilt the metadata index from '{container_name}' ({total} emails).")  
\ No newline at end of file
@@ -0,0 +1,120 @@
+# Vector layout of the email store: one vector per field, or one fused vector
+#
+# Ingestion embeds subject and body separately (subjectVector, bodyVector) and
+# both are indexed, yet every query path searches bodyVector only – half of the
+# embedding calls, vector storage and Cosmos DB vector index writes buy nothing.
+# EMAIL_VECTOR_LAYOUT picks the layout new stores are created and loaded with:
+#
+#   split  – subjectVector + bodyVector (previous layout)
+#   fused  – one contentVector over "subject + summary" (body already is the
+#            LLM summary written by process_raw_data.py): one embedding call
+#            and one vector per email
+#
+# Queries search bodyVector on split stores and contentVector on fused ones.
+# Cosmos DB readers take the field from the container's vector embedding policy
+# (vector_field_of), so switching layouts with reindex.py needs no config change;
+# the AI Search app uses EMAIL_VECTOR_LAYOUT. Moving a store to another layout
+# needs new embeddings: migrate_embedding_dimensions.py --reembed --layout fused.
+# benchmark_vector_layouts.py compares the two layouts.
+import copy
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    from .settings import getenv
+except ImportError:  # imported as a top-level module by the utils/ scripts
+    from settings import getenv
+
+SPLIT = "split"
+FUSED = "fused"
+LAYOUTS = {
+    SPLIT: ("subjectVector", "bodyVector"),
+    FUSED: ("contentVector",),
+}
+# The field every query path searches
+QUERY_FIELDS = {SPLIT: "bodyVector", FUSED: "contentVector"}
+ALL_VECTOR_FIELDS = tuple(f for fields in LAYOUTS.values() for f in fields)
+EMAIL_VECTOR_LAYOUT = getenv("EMAIL_VECTOR_LAYOUT", SPLIT)
+
+
+def _layout(layout: Optional[str]) -> str:
+    layout = layout or EMAIL_VECTOR_LAYOUT
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown vector layout '{layout}', expected one of {sorted(LAYOUTS)}")
+    return layout
+
+
+def vector_fields(layout: Optional[str] = None) -> Tuple[str, ...]:
+    """Vector fields stored by a layout (default: EMAIL_VECTOR_LAYOUT)."""
+    return LAYOUTS[_layout(layout)]
+
+
+def query_vector_field(layout: Optional[str] = None) -> str:
+    return QUERY_FIELDS[_layout(layout)]
+
+
+def layout_of_fields(fields) -> str:
+    """Layout of a store or document from the vector fields it has."""
+    return FUSED if "contentVector" in fields else SPLIT
+
+
+def fused_text(doc: Dict[str, Any]) -> str:
+    subject = (doc.get("subject") or "").strip()
+    body = (doc.get("body") or "").strip()
+    return f"{subject}\n\n{body}" if subject and body else subject or body
+
+
+def vector_texts(doc: Dict[str, Any], layout: Optional[str] = None) -> Dict[str, str]:
+    """Text to embed for every vector field of the layout – one embedding call each."""
+    if _layout(layout) == FUSED:
+        return {"contentVector": fused_text(doc)}
+    return {"subjectVector": doc.get("subject") or "", "bodyVector": doc.get("body") or ""}
+
+
+def embed_document(doc: Dict[str, Any], get_embedding: Callable[[str], List[float]],
+                   layout: Optional[str] = None) -> Dict[str, Any]:
+    """Set the layout's vector fields on an email document, dropping those of other layouts."""
+    for field in ALL_VECTOR_FIELDS:
+        doc.pop(field, None)
+    for field, text in vector_texts(doc, layout).items():
+        doc[field] = get_embedding(text)
+    return doc
+
+
+def cosmos_vector_policies(indexing_policy: Dict[str, Any], dimensions: int,
+                           layout: Optional[str] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    (vector_embedding_policy, indexing_policy) for a Cosmos DB container of the layout: the
+    vector paths are excluded from the regular index and get a quantizedFlat vector index.
+    """
+    fields = vector_fields(layout)
+    vector_embedding_policy = {
+        "vectorEmbeddings": [
+            {"path": f"/{field}", "dataType": "float32", "distanceFunction": "cosine", "dimensions": dimensions}
+            for field in fields
+        ]
+    }
+    indexing_policy = copy.deepcopy(indexing_policy)
+    vector_paths = {f"/{field}/*" for field in ALL_VECTOR_FIELDS}
+    indexing_policy["excludedPaths"] = [
+        p for p in indexing_policy.get("excludedPaths", []) if p["path"] not in vector_paths
+    ] + [{"path": f"/{field}/*"} for field in fields]
+    indexing_policy["vectorIndexes"] = [{"path": f"/{field}", "type": "quantizedFlat"} for field in fields]
+    return vector_embedding_policy, indexing_policy
+
+
+_fields: Dict[str, str] = {}
+_fields_lock = threading.Lock()
+
+
+def vector_field_of(container) -> str:
+    """Vector field queries search in a Cosmos DB container, read from its policy once per container."""
+    with _fields_lock:
+        field = _fields.get(container.id)
+    if field is None:
+        policy = container.read().get("vectorEmbeddingPolicy") or {}
+        paths = [e["path"].lstrip("/") for e in policy.get("vectorEmbeddings", [])]
+        field = query_vector_field(layout_of_fields(paths))
+        with _fields_lock:
+            _fields[container.id] = field
+    return field